@@ -21,8 +21,8 @@ def prepare_data() -> pd.DataFrame:
                           .merge(dim_meters,    left_on = 'dim_meters_id',    right_on = 'id', suffixes = ('', '_dm')) \
                           .merge(dim_bills,     left_on = 'dim_bills_id',     right_on = 'id', suffixes = ('', '_db'))
 
-    # 2: Handling missing values in 'supplier'
-    df['supplier'] = df['supplier'].replace([np.nan, ''], 'Unspecified')
+    # 2: Handling missing values in 'supplier' (as strings, since a categorical can't take on new values)
+    df['supplier'] = df['supplier'].astype(object).replace([np.nan, ''], 'Unspecified').astype('category')
 
     return df
 
@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import pandas as pd
 
 from analysis.jp.flat import prepared_data
+from utils.rendering  import density_scatter
 from utils.runtime    import find_project_root
 
 def eda1(df: pd.DataFrame = prepared_data):
@@ -9,7 +10,7 @@ def eda1(df: pd.DataFrame = prepared_data):
     Plots a scatter chart to visualize the relationship between kWh and Total Cost.
 
     Methodology:
-        1. Create a scatter plot with 'kwh' on the x-axis and 'total_cost' on the y-axis.
+        1. Create a scatter plot with 'kwh' on the x-axis and 'total_cost' on the y-axis, binned into a hexbin for large frames.
         2. Use color to represent 'total_cost' and add a color bar for reference.
 
     Parameters:
@@ -20,14 +21,15 @@ def eda1(df: pd.DataFrame = prepared_data):
     '''
 
     # 1: Creating the scatter plot with 'kwh' vs 'total_cost'
-    plt.scatter(x = df['kwh'], 
-                y = df['total_cost'],
-                c = df['total_cost'],
-                cmap = 'viridis',
-                edgecolor = None)
+    p = density_scatter(ax = plt.gca(),
+                        x  = df['kwh'], 
+                        y  = df['total_cost'],
+                        c  = df['total_cost'],
+                        cmap = 'viridis',
+                        edgecolor = None)
 
     # 2: Adding a color bar to represent 'total_cost'
-    plt.colorbar(label = 'Total Cost')
+    plt.colorbar(p, label = 'Total Cost')
 
     # Final plot settings
     plt.xlabel('kWh')
@@ -21,7 +21,7 @@ def eda3(df: pd.DataFrame = prepared_data):
     '''
 
     # 1: Grouping all billed data and calculating mean total_cost
-    dfg = df.groupby(['period', 'date'])['total_cost'].mean().reset_index()
+    dfg = df.groupby(['period', 'date'], observed = True)['total_cost'].mean().reset_index()
 
 
     # 2: Creating the scatter plot
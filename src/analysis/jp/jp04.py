@@ -1,17 +1,33 @@
 import matplotlib.pyplot as plt
+import numpy  as np
 import pandas as pd
 
 from analysis.jp.flat import prepared_data
 from sklearn.ensemble import IsolationForest
-from utils.runtime    import find_project_root, pickle_and_load
-
-def remove_anomalies(df: pd.DataFrame = prepared_data) -> pd.DataFrame:
+from typing           import Any, Dict
+from utils.rendering  import density_scatter
+from utils.runtime    import execution_config, find_project_root, pickle_and_load
+
+def remove_anomalies(df          : pd.DataFrame   = prepared_data,
+                     sample_size : int            = 100000,
+                     batch_size  : int            = 100000,
+                     refit       : bool           = False,
+                     refit_share : float          = 0.25,
+                     previous    : Dict[str, Any] = None) -> Dict[str, Any]:
     '''
-    Applies anomaly detection on the 'total_cost' column using Isolation Forest.
+    Applies anomaly detection on the 'total_cost' column using an Isolation Forest fit on a bounded sample, and persists
+    each row's anomaly score so that later runs only need to score rows they haven't seen before.
 
     Methodology:
-        1. Fit an Isolation Forest model on the 'total_cost' column to detect anomalies.
-        2. Filter the dataframe to remove detected anomalies.
+        1. Set aside a previous run that can't be reused, like a pickle from before scores were persisted, or any previous
+           run when `refit` is set.
+        2. Return a previous run as it is when it scored exactly the rows of `df`, matched on 'id' and 'total_cost'.
+        3. Carry over the scores of rows that were already scored in a previous run, matched on the fact table's 'id' and
+           'total_cost', since a rebuilt fact table can give an id to a different reading.
+        4. Reuse the Isolation Forest from a previous run, unless more than `refit_share` of the rows are new, in which
+           case the data has moved far enough that a new one is fit on a random sample of at most `sample_size` rows, and
+           every row is scored again.
+        5. Score the remaining rows in batches of `batch_size`, where a negative score marks an anomaly.
 
     Data Science Concepts:
         • Isolation Forest:
@@ -19,28 +35,67 @@ def remove_anomalies(df: pd.DataFrame = prepared_data) -> pd.DataFrame:
             - Designed for anomaly detection, it isolates observations by randomly selecting a feature and 
               then randomly selecting a split value between the maximum and minimum values of the selected feature.
             - The 'contamination' parameter estimates the proportion of outliers in the data set.
+            - Each tree only ever sees 256 rows, so a large random sample describes the distribution as well as the
+              full history does, and the cost of fitting stays flat as readings accumulate.
 
     Parameters:
-        df (pd.DataFrame): The dataframe containing the 'total_cost' column.
+        df          (pd.DataFrame)   : The dataframe containing the 'total_cost' column.
+        sample_size (int)            : The most rows to fit the Isolation Forest on. Defaults to 100000.
+        batch_size  (int)            : The number of rows to score at a time. Defaults to 100000.
+        refit       (bool)           : Whether to fit a new forest and rescore every row, whatever a previous run holds.
+                                       Defaults to False.
+        refit_share (float)          : The share of new rows above which a new forest is fit. Defaults to 0.25.
+        previous    (Dict[str, Any]) : The output of a previous run, whose forest and scores are reused. Defaults to None.
 
     Returns:
-        pd.DataFrame: The dataframe after anomaly detection and filtering.
+        Dict[str, Any]: The fitted 'forest' and the 'scored' dataframe with an 'anomaly_score' column.
     '''
 
-    # 1: Fitting the Isolation Forest model
-    isolation_forest = IsolationForest(contamination = 0.001, n_jobs = -1, random_state = 0)
-    outliers = isolation_forest.fit_predict(df[['total_cost']])
+    # 1: Setting aside a previous run that can't be reused
+    if refit or not (isinstance(previous, dict) and {'forest', 'scored'} <= previous.keys()):
+        previous = None
+
+    # 2: Returning a previous run that's still current
+    if previous is not None and df[['id', 'total_cost']].reset_index(drop = True) \
+                                  .equals(previous['scored'][['id', 'total_cost']].reset_index(drop = True)):
+        return previous
+
+    # 3: Carrying over previously persisted scores
+    df = df.copy()
+    df['anomaly_score'] = np.nan if previous is None else \
+                          df[['id', 'total_cost']].merge(previous['scored'][['id', 'total_cost', 'anomaly_score']],
+                                                         on  = ['id', 'total_cost'],
+                                                         how = 'left')['anomaly_score'].to_numpy()
+
+    # 4: Reusing the previous forest, or fitting a new one on a bounded sample
+    config = execution_config()
+
+    if previous is None or df['anomaly_score'].isna().mean() > refit_share:
+        forest = IsolationForest(contamination = 0.001, n_jobs = config['n_jobs'], random_state = config['seed'])
+        forest.fit(df[['total_cost']].sample(n = min(len(df), sample_size), random_state = config['seed']))
+        df['anomaly_score'] = np.nan
+    else:
+        forest = previous['forest']
+
+    # 5: Scoring the remaining rows in batches
+    unscored = np.flatnonzero(df['anomaly_score'].isna().to_numpy())
+
+    for start in range(0, len(unscored), batch_size):
+        rows = unscored[start:start + batch_size]
+        df.iloc[rows, df.columns.get_loc('anomaly_score')] = forest.decision_function(df.iloc[rows][['total_cost']])
+
+    return {'forest' : forest, 
+            'scored' : df}
 
-    # 2: Filtering the dataframe to remove detected anomalies
-    return df[outliers == 1]
+anomaly_outputs = pickle_and_load(remove_anomalies, 'jp04.pkl', refresh = True)
 
-without_anomalies = pickle_and_load(remove_anomalies, 'jp04.pkl')
+without_anomalies = anomaly_outputs['scored'].query('anomaly_score >= 0').drop(columns = 'anomaly_score')
 
 
 def plot_anomalies(df  : pd.DataFrame = prepared_data,
                    dfa : pd.DataFrame = without_anomalies):
     '''
-    Visualizes the data before and after anomaly detection using scatter plots.
+    Visualizes the data before and after anomaly detection using scatter plots, binned into hexbins for large frames.
 
     Parameters:
         df  (pd.DataFrame): The original dataframe before anomaly detection.
@@ -60,13 +115,14 @@ def plot_anomalies(df  : pd.DataFrame = prepared_data,
     colormap_range = (df['total_cost'].min(), df['total_cost'].max())
 
     for i, (title, data) in enumerate(data_for_plotting.items()):
-        axs[i].scatter(x = data['total_cost'],
-                       y = data['timestamp'],
-                       c = data['total_cost'],
-                       cmap = 'viridis',
-                       vmin = colormap_range[0],
-                       vmax = colormap_range[1],
-                       edgecolor = None)
+        density_scatter(ax = axs[i],
+                        x  = data['total_cost'],
+                        y  = data['timestamp'],
+                        c  = data['total_cost'],
+                        cmap = 'viridis',
+                        vmin = colormap_range[0],
+                        vmax = colormap_range[1],
+                        edgecolor = None)
         
         axs[i].set_title(f"$04$: Total Cost ${title}$ Anomaly Detection")
 
@@ -7,29 +7,43 @@ import re
 from analysis.jp.jp04          import without_anomalies
 from sklearn.compose           import ColumnTransformer
 from sklearn.feature_selection import SelectFromModel
-from sklearn.linear_model      import LassoCV
+from sklearn.base              import clone
+from sklearn.linear_model      import Lasso, LassoCV
 from sklearn.model_selection   import train_test_split
 from sklearn.pipeline          import Pipeline
 from sklearn.preprocessing     import OneHotEncoder, StandardScaler
 from typing                    import List, Tuple
-from utils.runtime             import find_project_root, pickle_and_load
+from utils.runtime             import execution_config, find_project_root, pickle_and_load
 
-def lasso(df: pd.DataFrame = without_anomalies) -> Tuple[np.ndarray, np.ndarray, pd.Series, pd.Series, List[str], pd.Series]:
+def lasso(df          : pd.DataFrame = without_anomalies,
+          screen_size : int          = None,
+          n_alphas    : int          = 100,
+          cache       : str          = './src/analysis/jp/pickled/jp06_cache') -> Tuple[np.ndarray, np.ndarray, pd.Series, pd.Series, List[str], pd.Series]:
     '''
     Applies LASSO feature selection to determine important features for predicting 'total_cost'.
 
     Methodology:
         1. Preprocess the data by dropping irrelevant columns and handling categorical and numerical features.
         2. Split the data into training and test sets.
-        3. Fit a LASSO model to the training data.
+        3. Optionally choose the regularization strength on a stratified sample of the training set.
+        4. Fit a LASSO model to the training data, caching the fitted preprocessor separately from the model.
 
     Data Science Concepts:
         • LASSO (Least Absolute Shrinkage and Selection Operator):
             - A regression analysis method that performs both variable selection and regularization to enhance the 
               prediction accuracy and interpretability of the resulting statistical model.
+        • Warm-Started Regularization Paths:
+            - `LassoCV` solves a descending sequence of `n_alphas` alphas per fold, starting each solve from the 
+              coefficients of the last, so a shorter path trades resolution in alpha for fewer solves.
+            - Screening runs that cross-validated path on a stratified sample instead, then fits the full training set 
+              once at the alpha it chose, rather than once per alpha and fold.
 
     Parameters:
-        df (pd.DataFrame): The dataframe returned from the `remove_anomalies` function.
+        df          (pd.DataFrame) : The dataframe returned from the `remove_anomalies` function.
+        screen_size (int)          : The size of the stratified sample used to choose alpha before the full fit.
+                                     Defaults to None, which cross-validates the full alpha path on the full training set.
+        n_alphas    (int)          : The number of alphas along the cross-validated path. Defaults to 100.
+        cache       (str)          : The directory where the fitted preprocessor is cached between runs.
 
     Returns:
         X_train_lasso   (np.ndarray) : The transformed training feature set.
@@ -56,16 +70,36 @@ def lasso(df: pd.DataFrame = without_anomalies) -> Tuple[np.ndarray, np.ndarray,
     categorical_features = X.select_dtypes(include = ['object', 'category']).columns.union(['hour'])
     numeric_features     = X.select_dtypes(include = ['int64', 'float64']).columns
 
-    # 2: Creating a pipeline with preprocessing and LASSO
-    model = Pipeline(steps = [('preprocessor',     ColumnTransformer([('num', StandardScaler(), numeric_features),
-                                                                      ('cat', OneHotEncoder(),  categorical_features)])),
+    # 2: Splitting the data
+    config = execution_config()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, random_state = config['seed'])
 
-                              ('feature_selector', SelectFromModel(LassoCV(max_iter     = 50000, 
-                                                                           n_jobs       = -1, 
-                                                                           random_state = 0)))])
+    preprocessor = ColumnTransformer([('num', StandardScaler(), numeric_features),
+                                      ('cat', OneHotEncoder(),  categorical_features)])
+
+    # 3: Screening alphas on a sample stratified by deciles of 'total_cost', then fitting a single alpha on the full set
+    selector = LassoCV(n_alphas     = n_alphas,
+                       max_iter     = 50000, 
+                       n_jobs       = config['n_jobs'], 
+                       random_state = config['seed'])
+
+    if screen_size is not None and screen_size < len(X_train):
+        X_screen, _, y_screen, _ = train_test_split(X_train, y_train, 
+                                                    train_size   = screen_size, 
+                                                    stratify     = pd.qcut(y_train, 10, labels = False, duplicates = 'drop'),
+                                                    random_state = config['seed'])
+
+        screen   = Pipeline(steps = [('preprocessor', clone(preprocessor)),
+                                     ('lasso',        selector)]).fit(X_screen, y_screen)
+        selector = Lasso(alpha        = screen.named_steps['lasso'].alpha_,
+                         max_iter     = 50000, 
+                         random_state = config['seed'])
+
+    # 4: Creating a pipeline with a cached preprocessor and LASSO, then fitting the model and selecting features
+    model = Pipeline(steps  = [('preprocessor',     preprocessor),
+                               ('feature_selector', SelectFromModel(selector))],
+                     memory = find_project_root(cache))
 
-    # 3: Splitting the data, fitting the model, and selecting features
-    X_train, X_test, y_train, y_test = train_test_split(X, y, random_state = 0)
     model.fit(X_train, y_train)
 
     # Accessing the fitted LassoCV model, getting its feature names, and applying the SelectFromModel mask
@@ -1,80 +1,173 @@
 import matplotlib.pyplot as plt
 import numpy  as np
 import pandas as pd
+import time
+
+from analysis.jp.jp06          import lasso_outputs
+from joblib                    import parallel_config
+from scipy.sparse              import issparse
+from sklearn.base              import clone
+from sklearn.ensemble          import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.experimental      import enable_halving_search_cv # noqa: F401, enables HalvingRandomSearchCV
+from sklearn.metrics           import mean_squared_error, r2_score
+from sklearn.model_selection   import train_test_split, HalvingRandomSearchCV, RandomizedSearchCV
+from sklearn.pipeline          import Pipeline
+from sklearn.preprocessing     import FunctionTransformer
+from typing                    import List, Tuple
+from utils.runtime             import execution_config, find_project_root, pickle_and_load
+
+def densify(X) -> np.ndarray:
+    '''
+    Converts the sparse LASSO-transformed matrix to a dense array for engines that don't accept sparse input.
+    '''
 
-from analysis.jp.jp06        import lasso_outputs
-from sklearn.ensemble        import RandomForestRegressor
-from sklearn.metrics         import mean_squared_error, r2_score
-from sklearn.model_selection import train_test_split, RandomizedSearchCV
-from typing                  import Tuple
-from utils.runtime           import find_project_root, pickle_and_load
-
-def random_forest(X : np.ndarray = lasso_outputs['X_train'], 
-                  y : pd.Series  = lasso_outputs['y_train']) -> Tuple[RandomForestRegressor, pd.Series, np.ndarray]:
+    return X.toarray() if issparse(X) else np.asarray(X)
+
+# Model engines available for the model selection stage, with their search spaces and plot annotations
+ENGINES = {'random_forest'          : {'name'      : 'Random Forest',
+                                       'estimator' : RandomForestRegressor(random_state = 0),
+                                       'grid'      : {'n_estimators'      : [2, 4, 8, 16, 32, 64],
+                                                      'max_depth'         : [2, 4, 8, 16],
+                                                      'min_samples_split' : [2, 4, 8, 16],
+                                                      'min_samples_leaf'  : [2, 4, 8, 16]},
+                                       'labels'    : {'max_depth'         : 'Max Depth',
+                                                      'min_samples_split' : 'Min Samples Split',
+                                                      'min_samples_leaf'  : 'Min Samples Leaf',
+                                                      'n_estimators'      : '# of Estimators'}},
+
+           'hist_gradient_boosting' : {'name'      : 'Histogram Gradient Boosting',
+                                       'estimator' : Pipeline(steps = [('densify', FunctionTransformer(densify)),
+                                                                       ('model',   HistGradientBoostingRegressor(random_state = 0))]),
+                                       'grid'      : {'model__learning_rate'    : [0.05, 0.1, 0.2],
+                                                      'model__max_iter'         : [50, 100, 200],
+                                                      'model__max_leaf_nodes'   : [15, 31, 63],
+                                                      'model__min_samples_leaf' : [4, 8, 16, 32]},
+                                       'labels'    : {'model__learning_rate'    : 'Learning Rate',
+                                                      'model__max_leaf_nodes'   : 'Max Leaf Nodes',
+                                                      'model__min_samples_leaf' : 'Min Samples Leaf',
+                                                      'model__max_iter'         : '# of Iterations'}}}
+
+def random_forest(X      : np.ndarray = lasso_outputs['X_train'], 
+                  y      : pd.Series  = lasso_outputs['y_train'],
+                  engine : str        = 'random_forest',
+                  search : str        = 'randomized') -> Tuple[RandomForestRegressor, pd.Series, np.ndarray]:
     '''
-    Fits a Random Forest Regressor model using Randomized Search CV for hyperparameter tuning and visualizes predictions.
+    Fits a model from `ENGINES`, a Random Forest Regressor by default, using a randomized hyperparameter search, then
+    makes predictions on a held-out test set.
 
     Methodology:
         1. Perform a train/test split on the training dataset.
-        2. Tune hyperparameters using Randomized Search CV.
-        3. Fit the best Random Forest model and make predictions.
+        2. Tune hyperparameters using Randomized Search CV, or Successive Halving when `search` is 'halving'.
+        3. Fit the best model and make predictions.
         4. Visualize the predicted vs. actual values and calculate R² and MSE.
 
     Data Science Concepts:
         • Random Forest:
             - An ensemble learning method that operates by constructing multiple decision trees during training.
             - For regression tasks, the output of the random forest is the mean prediction of the individual trees.
+        • Histogram Gradient Boosting:
+            - Builds trees sequentially, each correcting the residuals of the last, on features binned into at most 256
+              values, which makes every split search a pass over a histogram instead of a sort.
         • Hyperparameter Tuning:
             - The process of selecting the set of optimal hyperparameters for a learning algorithm, often using methods like 
               grid search or randomized search.
+            - Successive halving evaluates every candidate on a small share of the rows, then repeatedly keeps the best 
+              third and triples their share, so only the finalists ever see the full training set.
 
     Parameters:
-        X (np.ndarray) : The transformed training feature set from LASSO feature selection.
-        y (pd.Series)  : The training target variable.
+        X      (np.ndarray) : The transformed training feature set from LASSO feature selection.
+        y      (pd.Series)  : The training target variable.
+        engine (str)        : The key of the model engine in `ENGINES`. Defaults to 'random_forest'.
+        search (str)        : The hyperparameter search, either 'randomized' or 'halving'. Defaults to 'randomized'.
 
     Returns:
-        best_estimator (RandomForestRegressor) : The best-fitted Random Forest model.
-        y_test_rf      (pd.Series)             : The test target variable for RandomForestRegressor.
-        y_pred_rf      (np.ndarray)            : Predicted values by the model on the test set.
+        best    (RandomForestRegressor) : The best-fitted model.
+        y_test  (pd.Series)             : The test target variable.
+        y_pred  (np.ndarray)            : Predicted values by the model on the test set.
+        engine  (str)                   : The key of the model engine in `ENGINES`.
+        seconds (float)                 : The wall-clock time of the hyperparameter search.
     '''
 
     # 1: Splitting the data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, random_state = 0)
-
-    # 2: Initialize the Random Forest Regressor
-    rf = RandomForestRegressor(random_state = 0)
-
-    # Hyperparameter Grid
-    hyperparameter_grid = {'n_estimators'      : [2, 4, 8, 16, 32, 64],
-                           'max_depth'         : [2, 4, 8, 16],
-                           'min_samples_split' : [2, 4, 8, 16],
-                           'min_samples_leaf'  : [2, 4, 8, 16]}
-
-    # 3: # Randomized Search with Cross-Validation
-    random_search = RandomizedSearchCV(rf, hyperparameter_grid, n_jobs = -1, random_state = 0)
-    random_search.fit(X_train, y_train)
+    config = execution_config()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, random_state = config['seed'])
+
+    # 2: Initialize the engine, seeded with the shared seed, and its hyperparameter grid
+    estimator           = clone(ENGINES[engine]['estimator'])
+    estimator.set_params(**{param: config['seed'] for param in estimator.get_params() if param.endswith('random_state')})
+    hyperparameter_grid = ENGINES[engine]['grid']
+
+    # 3: Randomized Search or Successive Halving with Cross-Validation
+    if search == 'halving':
+        random_search = HalvingRandomSearchCV(estimator, hyperparameter_grid, 
+                                              n_candidates  = 27, # 27 → 9 → 3 → 1, the finalist alone seeing every row
+                                              factor        = 3,
+                                              min_resources = 'exhaust',
+                                              n_jobs        = config['n_jobs'], 
+                                              random_state  = config['seed'])
+    else:
+        random_search = RandomizedSearchCV(estimator, hyperparameter_grid, n_jobs = config['n_jobs'], random_state = config['seed'])
+
+    start = time.perf_counter()
+    with parallel_config(backend = config['backend'], inner_max_num_threads = config['threads']):
+        random_search.fit(X_train, y_train)
 
     # Predictions using the best model
     best   = random_search.best_estimator_
     y_pred = best.predict(X_test)
 
-    return {'best'   : best, 
-            'y_test' : y_test, 
-            'y_pred' : y_pred}
+    return {'best'    : best, 
+            'y_test'  : y_test, 
+            'y_pred'  : y_pred,
+            'engine'  : engine,
+            'seconds' : time.perf_counter() - start}
 
 random_forest_outputs = pickle_and_load(random_forest, 'jp08.pkl')
 
 
+def compare_engines(X        : np.ndarray = lasso_outputs['X_train'], 
+                    y        : pd.Series  = lasso_outputs['y_train'],
+                    engines  : List[str]  = list(ENGINES),
+                    searches : List[str]  = ['randomized', 'halving']) -> pd.DataFrame:
+    '''
+    Runs the model selection stage for every combination of engine and search, reporting fit time and score side by side.
+
+    Parameters:
+        X        (np.ndarray) : The transformed training feature set from LASSO feature selection.
+        y        (pd.Series)  : The training target variable.
+        engines  (List[str])  : The keys of the model engines in `ENGINES` to compare. Defaults to all of them.
+        searches (List[str])  : The hyperparameter searches to compare. Defaults to 'randomized' and 'halving'.
+
+    Returns:
+        pd.DataFrame: One row per engine and search with its search time in seconds, and R² and MSE on the test set.
+    '''
+
+    results = []
+    for engine in engines:
+        for search in searches:
+
+            outputs = random_forest(X, y, engine = engine, search = search)
+            results.append({'engine'  : ENGINES[engine]['name'],
+                            'search'  : search,
+                            'seconds' : round(outputs['seconds'], 1),
+                            'r2'      : round(r2_score(outputs['y_test'], outputs['y_pred']), 3),
+                            'mse'     : round(mean_squared_error(outputs['y_test'], outputs['y_pred']), 4)})
+
+    return pd.DataFrame(results)
+
+
 def plot_random_forest(best   : RandomForestRegressor = random_forest_outputs['best'], 
                        y_test : pd.Series             = random_forest_outputs['y_test'], 
-                       y_pred : np.ndarray            = random_forest_outputs['y_pred']):
+                       y_pred : np.ndarray            = random_forest_outputs['y_pred'],
+                       engine : str                   = random_forest_outputs.get('engine', 'random_forest')):
     '''
-    Visualizes predictions of the Random Forest model compared to actual values. Then calculates R² and MSE.
+    Visualizes predictions of the selected model compared to actual values. Then calculates R² and MSE.
 
     Parameters:
-        best   (RandomForestRegressor) : The fitted Random Forest model.
-        y_test (pd.Series)             : The test target variable for RandomForestRegressor.
+        best   (RandomForestRegressor) : The fitted model.
+        y_test (pd.Series)             : The test target variable.
         y_pred (np.ndarray)            : Predicted values by the model on the test set.
+        engine (str)                   : The key of the model engine in `ENGINES`, used to label the hyperparameters.
     
     Produces:
         A scatter plot saved as a PNG file and displayed on the screen, showing the comparison between predicted and actual values.
@@ -98,11 +191,9 @@ def plot_random_forest(best   : RandomForestRegressor = random_forest_outputs['b
              ha = 'left', va = 'center', transform = plt.gca().transAxes)
 
     # Second text annotation for hyperparameters (top left)
+    labels = ENGINES[engine]['labels']
     plt.text(0.05, 0.95, 
-             (f"Max Depth         ${best.get_params()['max_depth']}$\n"
-              f"Min Samples Split ${best.get_params()['min_samples_split']}$\n"
-              f"Min Samples Leaf  ${best.get_params()['min_samples_leaf']}$\n"
-              f"# of Estimators   ${best.get_params()['n_estimators']}$"), 
+             "\n".join(f"{label:<17} ${best.get_params()[param]}$" for param, label in labels.items()), 
              fontsize = 9, fontweight = 'bold', linespacing = 1.3,
              bbox = dict(facecolor = '0.3', edgecolor = '0.3', boxstyle = 'round,pad = 0.75', alpha = 0.5),
              ha = 'left', va = 'top', transform = plt.gca().transAxes)
@@ -110,7 +201,7 @@ def plot_random_forest(best   : RandomForestRegressor = random_forest_outputs['b
     plt.colorbar(label = 'Residuals')
     plt.xlabel('Total Cost')
     plt.ylabel('Predicted Values')
-    plt.title('$08$: Random Forest - Predictions vs. Actual Values')
+    plt.title(f"$08$: {ENGINES[engine]['name']} - Predictions vs. Actual Values")
     plt.tight_layout(pad = 2.0)
 
     # Saving the plot to a file
@@ -3,11 +3,12 @@ import numpy  as np
 import pandas as pd
 
 from analysis.jp.jp06        import lasso_outputs
-from analysis.jp.jp08        import random_forest_outputs
+from analysis.jp.jp08        import ENGINES, random_forest_outputs
+from joblib                  import parallel_config
 from sklearn.ensemble        import RandomForestRegressor
 from sklearn.linear_model    import LinearRegression
 from sklearn.model_selection import cross_val_score
-from utils.runtime           import find_project_root
+from utils.runtime           import execution_config, find_project_root
 
 def cross_validation(X    : np.ndarray            = lasso_outputs['X_train'], 
                      y    : pd.Series             = lasso_outputs['y_train'], 
@@ -38,14 +39,18 @@ def cross_validation(X    : np.ndarray            = lasso_outputs['X_train'],
     '''
 
     # 1: Performing cross-validation
-    cv_scores_rf = cross_val_score(best,               X, y, cv = 8, scoring = 'r2', n_jobs = -1)
-    cv_scores_lr = cross_val_score(LinearRegression(), X, y, cv = 8, scoring = 'r2', n_jobs = -1)
+    config = execution_config()
+    with parallel_config(backend = config['backend'], inner_max_num_threads = config['threads']):
+        cv_scores_rf = cross_val_score(best,               X, y, cv = 8, scoring = 'r2', n_jobs = config['n_jobs'])
+        cv_scores_lr = cross_val_score(LinearRegression(), X, y, cv = 8, scoring = 'r2', n_jobs = config['n_jobs'])
 
     # 2: Visualizing the R² scores in a bar chart
     n_folds   = np.arange(1, len(cv_scores_rf) + 1)
     bar_width = 0.35
 
-    bars_rf = plt.bar(n_folds - bar_width/2, cv_scores_rf, bar_width, label = 'Random Forest', color = 'forestgreen')
+    engine    = ENGINES[random_forest_outputs.get('engine', 'random_forest')]['name']
+
+    bars_rf = plt.bar(n_folds - bar_width/2, cv_scores_rf, bar_width, label = engine, color = 'forestgreen')
     bars_lr = plt.bar(n_folds + bar_width/2, cv_scores_lr, bar_width, label = 'Linear Regression')
 
     # Annotations for each bar
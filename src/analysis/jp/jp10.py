@@ -1,72 +1,237 @@
+import joblib
 import matplotlib.pyplot as plt
 import numpy as np
-import random
+import os
+import time
 import warnings
 
 from analysis.jp.jp06 import lasso_outputs
 from analysis.jp.jp08 import random_forest_outputs
-from joblib           import Parallel, delayed
+from functools        import lru_cache
+from joblib           import Parallel, delayed, parallel_config
 from sklearn.ensemble import RandomForestRegressor
 from scipy.optimize   import minimize
-from typing           import List, Tuple
-from utils.runtime    import find_project_root, pickle_and_load
+from typing           import Dict, List, Tuple
+from utils.runtime    import column_means, execution_config, find_project_root, memmap_matrix, pickle_and_load
 
-def slsqp(X    : np.ndarray            = lasso_outputs['X_train'], 
-          best : RandomForestRegressor = random_forest_outputs['best']) -> Tuple[List[np.ndarray], List[np.ndarray], Tuple[float, float]]:
+def split_candidates(best           : RandomForestRegressor,
+                     X_dense        : np.ndarray,
+                     max_candidates : int = 32) -> Dict[int, np.ndarray]:
+    '''
+    Collects, for every feature, one value from each interval between the split thresholds the forest uses on it.
+    A tree ensemble's prediction is constant between consecutive thresholds, so these values cover every distinct 
+    prediction reachable by moving that feature alone. Models without accessible trees fall back to data quantiles.
+
+    Parameters:
+        best           (RandomForestRegressor) : The best-fitted model from `jp08`.
+        X_dense        (np.ndarray)            : The dense training feature set, used for the outermost intervals.
+                                                 It's scanned row-wise, so a memory-mapped matrix works as is.
+        max_candidates (int)                   : The most values to keep per feature, spread evenly. Defaults to 32.
+
+    Returns:
+        Dict[int, np.ndarray]: Maps each feature's column position to its candidate values, all at least 0.01.
+    '''
+
+    trees = [tree.tree_ for tree in getattr(best, 'estimators_', [])]
+    if trees:
+        features   = np.concatenate([tree.feature   for tree in trees])
+        thresholds = np.concatenate([tree.threshold for tree in trees])
+
+    lows, highs = X_dense.min(axis = 0), X_dense.max(axis = 0)
+
+    candidates = {}
+    for j in range(X_dense.shape[1]):
+
+        if trees:
+            cuts   = np.unique(thresholds[features == j])
+            values = np.concatenate([[lows[j]], (cuts[1:] + cuts[:-1]) / 2, [highs[j]]])
+        else:
+            values = np.quantile(X_dense[:, j], np.linspace(0, 1, max_candidates))
+
+        values = np.unique(np.clip(values, 0.01, None))
+        if len(values) > max_candidates:
+            values = values[np.unique(np.linspace(0, len(values) - 1, max_candidates).round().astype(int))]
+
+        candidates[j] = values
+
+    return candidates
+
+
+@lru_cache(maxsize = 1)
+def worker_model(model_path : str) -> RandomForestRegressor:
+    '''
+    Loads the stored model once per worker process, so each SLSQP task ships only a path instead of the whole forest.
+
+    Parameters:
+        model_path (str) : Path to the model stored with `joblib.dump`.
+
+    Returns:
+        RandomForestRegressor: The loaded model, reused by every later task in the same worker.
+    '''
+
+    return joblib.load(model_path)
+
+
+def optimize_sample(model_path      : str,
+                    features        : np.ndarray,
+                    mean_constraint : float) -> Tuple[np.ndarray, float, int, bool]:
+    '''
+    Runs one SLSQP solve from a single sample, holding `num__kwh_delivered` at its mean and every other feature at or 
+    above 0.01.
+
+    Parameters:
+        model_path      (str)        : Path to the stored model, loaded through `worker_model`.
+        features        (np.ndarray) : The sample's starting feature values.
+        mean_constraint (float)      : The value `num__kwh_delivered` is held at.
+
+    Returns:
+        Tuple[np.ndarray, float, int, bool]: The optimized features, their predicted cost, the iterations run and 
+                                             whether the solver converged.
+    '''
+
+    best        = worker_model(model_path)
+    constraints = {'type': 'eq', 'fun': lambda features: features[0] - mean_constraint}
+    bounds      = [(0.01, None) for _ in range(len(features))]
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category = RuntimeWarning) # Scipy warns every time the bounds are clipped
+
+        result = minimize(lambda features: best.predict([features])[0], 
+                          np.clip(features, 0.01, None), 
+                          method      = 'SLSQP', 
+                          constraints = constraints, 
+                          bounds      = bounds)
+        
+        return result.x, best.predict([result.x])[0], result.nit, result.success
+
+def slsqp(X              : np.ndarray            = lasso_outputs['X_train'], 
+          best           : RandomForestRegressor = random_forest_outputs['best'],
+          method         : str                   = 'coordinate',
+          seed           : int                   = None,
+          batch_size     : int                   = 512,
+          max_sweeps     : int                   = 10,
+          max_candidates : int                   = 32) -> Tuple[List[np.ndarray], List[np.ndarray], Tuple[float, float]]:
     '''
     Performs optimization on feature sets and visualizes the distribution of predicted costs for these optimized sets.
 
     Methodology:
-        1. Convert the sparse matrix to a dense array for manipulation.
-        2. Select a random subset of samples for optimization.
+        1. Store the sparse matrix once as a shared, memory-mapped dense array for manipulation.
+        2. Select a seeded random subset of samples for optimization.
         3. Define an objective function based on the Random Forest predictions.
-        4. Perform optimization on each sample.
+        4. Perform optimization on the samples, either with a batched coordinate search over the forest's split 
+           intervals ('coordinate') or with one SLSQP solve per sample ('slsqp'). The SLSQP path stores the model
+           once with `joblib.dump`, and each worker loads it a single time through `worker_model`.
 
     Data Science Concepts:
         • SLSQP (Sequential Least Squares Quadratic Programming):
             - A mathematical optimization algorithm that solves nonlinearly constrained optimization problems.
             - Particularly useful in this context for its ability to handle constraints effectively.
             - We use SLSQP to constrain one specific feature (`num__kwh_delivered`) while allowing other features to vary.
+        • Tree-Aware Coordinate Search:
+            - A forest's prediction is piecewise constant, so finite-difference gradients are almost always zero and 
+              SLSQP mostly stops where it starts. Trying one value per split interval finds the actual steps.
+            - Each pass over a feature predicts every candidate value for every sample in the batch at once, and 
+              keeps the cheapest. Passes repeat until no sample improves or `max_sweeps` is reached.
+            - `num__kwh_delivered` stays fixed at its mean, and every other feature stays at or above 0.01, matching the
+              SLSQP constraint and bounds.
 
     Parameters:
-        X    (np.ndarray)            : The transformed training feature set from LASSO feature selection.
-        best (RandomForestRegressor) : The best-fitted Random Forest model from Randomized Search CV.
+        X              (np.ndarray)            : The transformed training feature set from LASSO feature selection.
+        best           (RandomForestRegressor) : The best-fitted Random Forest model from Randomized Search CV.
+        method         (str)                   : Either 'coordinate' or 'slsqp'. Defaults to 'coordinate'.
+        seed           (int)                   : Seeds the selection of samples. Defaults to the shared `execution_config` seed.
+        batch_size     (int)                   : The number of samples searched together. Defaults to 512.
+        max_sweeps     (int)                   : The most passes over every feature per batch. Defaults to 10.
+        max_candidates (int)                   : The most candidate values per feature. Defaults to 32.
 
     Returns:
         all_sets       (List[np.ndarray])    : All feature sets evaluated during the optimization.
         optimized_sets (List[np.ndarray])    : Feature sets that meet the specified cost bounds.
         cost_bounds    (Tuple[float, float]) : Lower and upper bounds for the optimized cost range.
+        stats          (Dict[str, float])    : Convergence statistics, including sweeps, predictions made and seconds.
     '''
 
     # 1: Set constants and prepare data
-    X_dense         = X.toarray()
-    random_samples  = random.sample(range(len(X_dense)), int(len(X_dense) * 0.05))
+    start           = time.perf_counter()
+    config          = execution_config()
+    X_dense         = memmap_matrix(X, 'X_train.npy')
+    rng             = np.random.default_rng(config['seed'] if seed is None else seed)
+    random_samples  = np.sort(rng.choice(len(X_dense), size = int(len(X_dense) * 0.05), replace = False))
     mean_total_cost = best.predict(X).mean()
     cost_bounds     = (mean_total_cost * 0.65, mean_total_cost * 0.85)
-    mean_constraint = X_dense[:, 0].mean()
-    constraints     = {'type': 'eq', 'fun': lambda features: features[0] - mean_constraint}
-    bounds          = [(0.01, None) for _ in range(X.shape[1])]
-
-    # 2: Define the objective function
-    def optimize_sample(i):
-
-        with warnings.catch_warnings():
-            warnings.filterwarnings('ignore', category = RuntimeWarning) # Scipy warns every time the bounds are clipped
-
-            result = minimize(lambda features: best.predict([features])[0], 
-                              np.clip(X_dense[i], 0.01, None), 
-                              method      = 'SLSQP', 
-                              constraints = constraints, 
-                              bounds      = bounds)
-            
-            return result.x, best.predict([result.x])[0]
-
-    # 3: Optimizing and storing results
-    results = Parallel(n_jobs = -1)(delayed(optimize_sample)(i) for i in random_samples)
-
-    return {'all_sets'       : [result[0] for result in results], 
-            'optimized_sets' : [result[0] for result in results if cost_bounds[0] <= result[1] <= cost_bounds[1]], 
-            'cost_bounds'    : cost_bounds}
+    mean_constraint = column_means(X_dense)[0]
+
+    if method == 'slsqp':
+
+        # 2: Store the model once, so workers load it from disk instead of receiving it with every task
+        model_path = os.path.join(find_project_root('./src/analysis/jp/pickled'), 'jp10_model.joblib')
+        joblib.dump(best, model_path)
+
+        # 3: Optimizing and storing results, sending each worker only the row it optimizes
+        with parallel_config(backend = config['backend'], inner_max_num_threads = config['threads']):
+            results = Parallel(n_jobs = config['n_jobs'])(delayed(optimize_sample)(model_path, 
+                                                                                   np.array(X_dense[i], dtype = np.float64), 
+                                                                                   mean_constraint) for i in random_samples)
+        sets    = np.array([result[0] for result in results])
+        costs   = np.array([result[1] for result in results])
+        stats   = {'sweeps'    : float(np.mean([result[2] for result in results])),
+                   'converged' : float(np.mean([result[3] for result in results]))}
+
+    else:
+
+        # 2: Start every sample at its clipped values, with `num__kwh_delivered` held at its mean
+        candidates   = split_candidates(best, X_dense, max_candidates)
+        sets         = np.clip(X_dense[random_samples], 0.01, None).astype(np.float64)
+        sets[:, 0]   = mean_constraint
+        costs        = best.predict(sets)
+        initial      = costs.copy()
+        sweeps       = []
+        predictions  = len(sets)
+
+        # 3: Sweep every free feature in batches, keeping the cheapest candidate value for each sample
+        for b in range(0, len(sets), batch_size):
+            batch = slice(b, b + batch_size)
+            rows  = len(sets[batch])
+
+            for sweep in range(1, max_sweeps + 1):
+                improved = False
+
+                for j, values in candidates.items():
+                    if j == 0:
+                        continue
+
+                    trials       = np.repeat(sets[batch], len(values), axis = 0)
+                    trials[:, j] = np.tile(values, rows)
+                    trial_costs  = best.predict(trials).reshape(rows, len(values))
+                    predictions += len(trials)
+
+                    cheapest = trial_costs.argmin(axis = 1)
+                    lowest   = trial_costs[np.arange(rows), cheapest]
+                    better   = lowest < costs[batch] - 1e-12
+
+                    if better.any():
+                        sets[batch][better, j] = values[cheapest[better]]
+                        costs[batch][better]   = lowest[better]
+                        improved               = True
+
+                if not improved:
+                    break
+
+            sweeps.append((sweep, not improved))
+
+        stats = {'sweeps'      : float(np.mean([sweep for sweep, _ in sweeps])),
+                 'converged'   : float(np.mean([converged for _, converged in sweeps])),
+                 'predictions' : predictions,
+                 'improved'    : float(np.mean(costs < initial))}
+
+    stats.update({'method'  : method, 
+                  'samples' : len(random_samples),
+                  'seconds' : time.perf_counter() - start})
+
+    return {'all_sets'       : list(sets), 
+            'optimized_sets' : [features for features, cost in zip(sets, costs) if cost_bounds[0] <= cost <= cost_bounds[1]], 
+            'cost_bounds'    : cost_bounds,
+            'stats'          : stats}
 
 slsqp_outputs = pickle_and_load(slsqp, 'jp10.pkl')
 
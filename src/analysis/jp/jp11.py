@@ -6,7 +6,7 @@ import seaborn as sns
 from analysis.jp.jp06 import lasso_outputs
 from analysis.jp.jp10 import slsqp_outputs
 from typing           import List
-from utils.runtime    import find_project_root
+from utils.runtime    import column_means, find_project_root, memmap_matrix
 
 def percent_changes(X    : np.ndarray       = lasso_outputs['X_train'], 
                     sets : List[np.ndarray] = slsqp_outputs['optimized_sets'], 
@@ -16,7 +16,7 @@ def percent_changes(X    : np.ndarray       = lasso_outputs['X_train'],
 
     Methodology:
         1. Convert the optimized feature sets into a DataFrame.
-        2. Calculate the mean of each feature for both original and optimized sets.
+        2. Calculate the mean of each feature for the optimized sets, reusing the cached means of the shared training matrix.
         3. Compute and visualize the percentage changes.
 
     Parameters:
@@ -30,7 +30,7 @@ def percent_changes(X    : np.ndarray       = lasso_outputs['X_train'],
 
     # 1: Convert the list of feature arrays into a DataFrame and calculate the means
     optimized_means = pd.DataFrame(sets,        columns = fts).mean()
-    original_means  = pd.DataFrame(X.toarray(), columns = fts).mean()
+    original_means  = pd.Series(column_means(memmap_matrix(X, 'X_train.npy')), index = fts)
 
     # 2: Compute the percentage changes
     pct_changes = ((optimized_means - original_means) / original_means).sort_values(ascending = False)
@@ -6,7 +6,7 @@
     This file contains a function that will create a figure displaying Austin Street's
     energy costs.
 '''
-from utils.runtime import connect_to_db
+from utils.runtime import connect_to_db, cached_query
 import pandas as pd
 import matplotlib.pyplot as plt
 from utils.runtime import setup_plot_params
@@ -133,7 +133,7 @@ query = """ SELECT supplier,
                 LEFT JOIN dim_bills         db ON fe.dim_bills_id     = db.id
             WHERE dd.date <= '2023-07-31';
         """
-cost_df = electric_brew.query(query).to_df()
+cost_df = cached_query(electric_brew, query)
 
 # engineer query # 1
 cost_df['month'] = cost_df['date'].dt.to_period('M') 
@@ -155,7 +155,7 @@ query = """ SELECT supplier,
         """
 
 # engineer query # 2
-cost_df = electric_brew.query(query).to_df()
+cost_df = cached_query(electric_brew, query)
 cost_df['month'] = cost_df['date'].dt.to_period('M') 
 cost_df.sort_values('date', inplace = True)
 cost_df['energy_type'] = cost_df['supplier'].apply(lambda x: 'Solar' if x == 'Ampion' else 'conventional_supplier')
@@ -6,7 +6,7 @@
     This file contains a function that will create a figure that displays the kind of energy
     used by Austin Street; solar v. conventional
 '''
-from utils.runtime import connect_to_db
+from utils.runtime import connect_to_db, cached_query
 import pandas as pd
 import matplotlib.pyplot as plt
 from utils.runtime import setup_plot_params
@@ -132,7 +132,7 @@ query = """ SELECT supplier,
         """
 
 # engineer query # 1
-usage_df = electric_brew.query(query).to_df()
+usage_df = cached_query(electric_brew, query)
 usage_df['month'] = usage_df['date'].dt.to_period('M') 
 usage_df['supplier'] = usage_df['supplier'].apply(lambda x: 'Solar' if x == 'Ampion' else 'conventional_supplier')
 usage_df = usage_df.groupby(['month', 'supplier'])['kwh'].sum().unstack(fill_value=0)
@@ -149,7 +149,7 @@ query = """ SELECT supplier,
         """
 
 # engineer query # 2
-energy_percent_df = electric_brew.query(query).to_df()
+energy_percent_df = cached_query(electric_brew, query)
 energy_percent_df['month'] = energy_percent_df['date'].dt.month
 energy_percent_df['energy_type'] = energy_percent_df['supplier'].apply(lambda x: 'Solar' if x == 'Ampion' else 'conventional_supplier')
 energy_percent_df.sort_values('date', inplace = True)
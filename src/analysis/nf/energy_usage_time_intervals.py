@@ -6,7 +6,7 @@
     This file contains a fucntion that will create a figure displaying the total energy usage by
     Austin Street Brewery over the duration of the dataset.
 '''
-from utils.runtime import connect_to_db
+from utils.runtime import connect_to_db, cached_query
 import pandas as pd
 import matplotlib.pyplot as plt
 from utils.runtime import setup_plot_params
@@ -73,7 +73,7 @@ query = """ SELECT date,
 electric_brew = connect_to_db()
 
 # execute query, save a df
-df = electric_brew.query(query).to_df()
+df = cached_query(electric_brew, query)
 
 # create fig
 usage_fig(df)
\ No newline at end of file
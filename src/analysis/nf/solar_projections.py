@@ -6,7 +6,7 @@
     This file will generate a figure that displays what Austin Street Brewery would have paid
     had all the power come from solar providers over the last year
 '''
-from utils.runtime import connect_to_db
+from utils.runtime import connect_to_db, cached_query
 import pandas as pd
 import matplotlib.pyplot as plt
 from utils.runtime import setup_plot_params
@@ -123,7 +123,7 @@ query = """ SELECT supplier,
                 LEFT JOIN dim_bills         db ON fe.dim_bills_id     = db.id
             WHERE dd.date  >= '2022-09-01' AND dd.date <= '2023-07-31';
         """
-cost_df = electric_brew.query(query).to_df()
+cost_df = cached_query(electric_brew, query)
 
 # engineer query
 cost_df['month'] = cost_df['date'].dt.to_period('M') 
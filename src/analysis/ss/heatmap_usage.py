@@ -8,7 +8,7 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import calendar
 
-from utils.runtime import connect_to_db, setup_plot_params, find_project_root
+from utils.runtime import connect_to_db, cached_query, setup_plot_params, find_project_root
 
 # set plot params to align with all electric_brew plots
 setup_plot_params()
@@ -29,7 +29,7 @@ ORDER BY dd.hour, dd.month, dm.operational_area
 """
 
 # Get the list of unique operational areas
-unique_areas = fct_electric_brew.execute("SELECT DISTINCT operational_area FROM dim_meters").fetch_df()
+unique_areas = cached_query(fct_electric_brew, "SELECT DISTINCT operational_area FROM dim_meters")
 
 # Loop through each operational area and generate a heatmap
 for area in unique_areas['operational_area']:
@@ -37,7 +37,7 @@ for area in unique_areas['operational_area']:
     area_query = query_template.format(operational_area=area)
     
     # Fetch the DataFrame for the current operational area
-    df_area = fct_electric_brew.execute(area_query).fetch_df()
+    df_area = cached_query(fct_electric_brew, area_query)
 
     # Pivot the DataFrame for average kWh usage
     heatmap_data = df_area.pivot_table(index='hour', columns='month', values='avg_kWh_usage', aggfunc='mean')
@@ -8,7 +8,7 @@
 ## Finally, it plots the data using matplotlib to generate a line chart showing the peaks and valleys of kWh usage over time for each operational area.
 ## OUTPUT: Line chart showing the total kWh usage by operational area (meter) over time.
 
-from utils.runtime import connect_to_db, setup_plot_params
+from utils.runtime import connect_to_db, cached_query, setup_plot_params
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
@@ -19,7 +19,7 @@ setup_plot_params()
 fct_electric_brew = connect_to_db()
 
 # Directly run a SQL query and read the result into a DataFrame
-df_meter_usage = fct_electric_brew.query("SELECT * FROM meter_usage").to_df()
+df_meter_usage = cached_query(fct_electric_brew, "SELECT * FROM meter_usage")
 
 
 # looking at all electrical meters, summed KwH usage
@@ -33,8 +33,8 @@ GROUP BY dm.meter_id, dd.year, dd.month, dm.operational_area,
 ORDER BY dm.meter_id, dd.year, dd.month, dm.operational_area
 """
 
-df_total_usage_by_ops_area = fct_electric_brew.execute(query3).fetch_df()
-df = fct_electric_brew.execute(query3).fetch_df() 
+df_total_usage_by_ops_area = cached_query(fct_electric_brew, query3)
+df = cached_query(fct_electric_brew, query3) 
 
 # Preprocessing the data
 df['year_month'] = pd.to_datetime(df['year'].astype(str) + '-' + df['month'].astype(str))
@@ -15,7 +15,7 @@ logger.setLevel(logging.WARN)            # Set the logging level to WARN to igno
 # Generate and modify grouped DataFrame
 max_mean_dif_df = mue.groupby(['month', 
                                'year', 
-                               'meter_id']).agg({'kwh': ['max', 
+                               'meter_id'], observed = True).agg({'kwh': ['max', 
                                                          'mean', 
                                                          'median'],
                                                  'month_name': 'first'}).reset_index()
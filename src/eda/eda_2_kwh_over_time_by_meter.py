@@ -1,5 +1,6 @@
-from eda_features  import meter_usage_engineered as mue
-from utils.runtime import setup_plot_params
+from eda_features    import meter_usage_engineered as mue
+from utils.rendering import lttb
+from utils.runtime   import setup_plot_params
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -10,9 +11,10 @@ colors = setup_plot_params()
 unique_meters = mue['meter_id'].unique()
 color_map = dict(zip(unique_meters, reversed(colors)))
 
-# Scatter plot for each meter_id
+# Scatter plot for each meter_id, downsampled to the points that define each meter's shape over time
 for meter, color in color_map.items():
-    subset = mue[mue['meter_id'] == meter]
+    subset = mue[mue['meter_id'] == meter].sort_values('interval_end_datetime')
+    subset = subset.iloc[lttb(subset['interval_end_datetime'], subset['kwh'], n_out = 5000)]
     plt.scatter(subset['interval_end_datetime'], 
                 subset['kwh'], 
                 color = color, 
@@ -42,7 +42,7 @@ def feature_engineering(df : pd.DataFrame) -> pd.DataFrame:
     df['hour']       = df['interval_end_datetime'].dt.hour
 
     # Normalize 'kwh' by 'meter_id'
-    grouped              = df.groupby('meter_id').agg({'kwh': ['mean', 'std']}).reset_index()
+    grouped              = df.groupby('meter_id', observed = True).agg({'kwh': ['mean', 'std']}).reset_index()
     grouped.columns      = ['meter_id', 'mean_kwh', 'std_kwh']
     df                   = pd.merge(df, grouped, on = 'meter_id', how = 'left')
     df['kwh_normalized'] = (df['kwh'] - df['mean_kwh']) / df['std_kwh']
@@ -0,0 +1,160 @@
+from typing import Tuple
+
+import numpy  as np
+import pandas as pd
+
+'''
+Contains the NumPy kernels behind the cost allocation in `model_fct_electric_brew`. They work on plain arrays of rows
+in allocation order, so they can be reused and checked on their own, without loading any of the project's DataFrames.
+
+Functions:
+    - allocate_kwh     : Allocates each interval's kWh against the kWh delivered on its bill, in order, within each segment.
+    - segment_ratio    : Divides each value by the total of its segment.
+    - check_allocation : Compares both kernels against the pandas groupby code they replaced, on random segments.
+'''
+
+def _segment_order(segments : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Stably sorts rows by segment, so rows of one segment become contiguous while keeping their allocation order, and
+    returns that order along with the position where each segment starts within it.
+    '''
+
+    order   = np.argsort(segments, kind = 'stable')
+    ordered = segments[order]
+    starts  = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+
+    return order, starts
+
+def allocate_kwh(segments : np.ndarray,
+                 kwh      : np.ndarray,
+                 capacity : np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Allocates each interval's kWh against the kWh delivered on its bill. Within each segment (a bill), rows draw on the
+    bill in their given order, and each row is allocated whatever the bill has left once that row is counted.
+
+    Methodology:
+        1. Stably sort the rows by segment, keeping each segment's rows in their original order.
+        2. Take the running total of kWh within each segment, skipping missing values, as one running total over every
+           row less the total reached before the segment starts.
+        3. Compute the kWh left on the bill as `capacity` less that running total, clipped at zero.
+        4. Allocate the smaller of each row's kWh and the kWh left, leaving the remainder unused.
+        5. Restore the original row order. Rows without a segment (-1) get NaN for every output.
+
+    Parameters:
+        segments (np.ndarray) : Integer segment codes per row, in allocation order, with -1 for rows without a segment.
+        kwh      (np.ndarray) : The kWh of each row.
+        capacity (np.ndarray) : The kWh delivered on each row's bill, constant within a segment.
+
+    Returns:
+        kwh_left   (np.ndarray) : The kWh left on the bill after each row, never negative.
+        kwh_used   (np.ndarray) : The kWh allocated to the bill for each row.
+        kwh_unused (np.ndarray) : The kWh of each row the bill couldn't cover.
+    '''
+
+    segments = np.asarray(segments)
+    kwh      = np.asarray(kwh,      dtype = np.float64)
+    capacity = np.asarray(capacity, dtype = np.float64)
+
+    # Step 1: Make each segment's rows contiguous
+    order, starts = _segment_order(segments)
+
+    # Step 2: Running totals restart at every segment, by subtracting each segment's offset from one global running total
+    running = np.nancumsum(kwh[order])
+
+    if len(kwh):
+        offsets  = running[starts] - np.nan_to_num(kwh[order][starts])
+        running -= np.repeat(offsets, np.diff(np.r_[starts, len(kwh)]))
+
+    running[np.isnan(kwh[order])] = np.nan
+
+    # Steps 3 & 4: Clip what's left on the bill and allocate against it
+    left   = np.clip(capacity[order] - running, 0, None)
+    used   = np.minimum(kwh[order], left)
+    unused = kwh[order] - used
+
+    # Step 5: Restore the original order and blank out rows without a segment
+    outputs = []
+    for values in [left, used, unused]:
+        restored               = np.empty_like(values)
+        restored[order]        = values
+        restored[segments < 0] = np.nan
+        outputs.append(restored)
+
+    return tuple(outputs)
+
+def segment_ratio(segments : np.ndarray,
+                  values   : np.ndarray) -> np.ndarray:
+    '''
+    Divides each value by the total of its segment, like `groupby(...).transform('sum')` followed by a division.
+    This is the share of a bill's allocated kWh each interval accounts for, which spreads the bill's service charge and
+    taxes across its intervals.
+
+    Parameters:
+        segments (np.ndarray) : Integer segment codes per row, with -1 for rows without a segment.
+        values   (np.ndarray) : The values to divide.
+
+    Returns:
+        np.ndarray: Each value's share of its segment's total, or NaN for rows without a segment.
+    '''
+
+    segments = np.asarray(segments)
+    values   = np.asarray(values, dtype = np.float64)
+    grouped  = segments >= 0
+
+    totals = np.bincount(segments[grouped], weights = np.nan_to_num(values[grouped]))
+    ratios = np.full(len(values), np.nan)
+    ratios[grouped] = values[grouped] / totals[segments[grouped]]
+
+    return ratios
+
+def check_allocation(cases : int = 300,
+                     rows  : int = 500,
+                     seed  : int = 0) -> pd.DataFrame:
+    '''
+    Compares `allocate_kwh` and `segment_ratio` against the pandas code they replaced in `model_fct_electric_brew`, a
+    grouped `cumsum` against the bill's kWh delivered and a grouped `transform('sum')`, on random cases. Each case
+    interleaves the rows of random segments, leaves some rows without a segment, and blanks out some kWh.
+
+    Parameters:
+        cases (int) : Number of random cases.
+        rows  (int) : The most rows in a case.
+        seed  (int) : Seeds the random cases.
+
+    Returns:
+        pd.DataFrame: One row per kernel with the number of `cases`, the largest absolute difference from pandas, and
+                      whether every case `match`es, counting NaN in the same rows as equal.
+    '''
+
+    rng     = np.random.default_rng(seed)
+    results = {'allocate_kwh' : [], 'segment_ratio' : []}
+
+    for _ in range(cases):
+        n        = int(rng.integers(0, rows + 1))
+        segments = rng.integers(-1, max(1, n // 10) + 1, size = n)
+        kwh      = np.where(rng.random(n) < 0.05, np.nan, rng.exponential(1.0, n).round(3))
+        capacity = rng.uniform(0, 50, size = segments.max(initial = 0) + 1).round()[np.maximum(segments, 0)]
+
+        # The pandas code groups on the bill's columns, whose missing keys drop out like segment -1
+        df    = pd.DataFrame({'key' : np.where(segments < 0, np.nan, segments), 'kwh' : kwh, 'kwh_delivered' : capacity})
+        group = df.groupby('key')
+
+        left   = (group['kwh_delivered'].transform('first') - group['kwh'].cumsum()).clip(lower = 0)
+        used   = np.minimum(df['kwh'], left)
+        unused = df['kwh'] - used
+        ratio  = df['kwh'] / group['kwh'].transform('sum')
+
+        expected = {'allocate_kwh'  : np.stack([left, used, unused]),
+                    'segment_ratio' : ratio.to_numpy()[None]}
+        actual   = {'allocate_kwh'  : np.stack(allocate_kwh(segments, kwh, capacity)),
+                    'segment_ratio' : segment_ratio(segments, kwh)[None]}
+
+        for kernel in results:
+            same = np.array_equal(np.isnan(expected[kernel]), np.isnan(actual[kernel]))
+            diff = np.nanmax(np.abs(expected[kernel] - actual[kernel]), initial = 0) if same else np.inf
+            results[kernel].append(diff)
+
+    return pd.DataFrame([{'kernel'         : kernel,
+                          'cases'          : cases,
+                          'max_difference' : max(diffs),
+                          'match'          : max(diffs) < 1e-9}
+                         for kernel, diffs in results.items()])
@@ -1,14 +1,20 @@
-from datetime          import datetime
 from glob              import glob
-from re                import findall, search, DOTALL
+from itertools         import groupby, islice
 from shutil            import rmtree
+from tempfile          import mkdtemp
 from typing            import *
-from utils.dataframes  import locations
+from utils.greenbutton import iter_green_button, write_green_button
+from utils.parsers     import FIELDS, PARSERS
+from utils.runtime     import find_project_root, read_data
+from utils.schemas     import apply_schema, storage_options, PROFILES, STORAGE
 
+import json
 import os
+import time
 import logging         as lg
 import pandas          as pd
 import pdfplumber      as pl
+import pypdfium2       as pdfium
 import pyarrow         as pa
 import pyarrow.parquet as pq
 
@@ -19,15 +25,117 @@ lg.basicConfig(level  = lg.INFO,
 Contains utility functions that scrape and restructure data from raw sources into columnar, efficient formats.
 
 Functions:
+    - iter_pages          : Yields the text of every page of some PDFs, optionally cropped to a region of each page.
+    - extract_pages       : Collects the pages `iter_pages` yields into a DataFrame.
     - load_data_files     : Load data files from the specified directory. Supports CSV and PDF file types.
+    - load_green_button   : Streams Green Button XML downloads into the curated `meter_usage` dataset in batches.
     - write_results       : Write curated data to a specified Parquet directory.
+    - assign_keys         : Gives each row the persistent id of its natural key from a table's key map.
+    - benchmark_storage   : Measures the size, write time and read time of every table under every storage profile.
+    - scrape_bills        : Streams every bill PDF to its format's parser in batches, with a report of any failures.
     - scrape_cmp_bills    : Automates extraction of billing details from CMP's PDF bills, structuring data for analysis.
     - scrape_ampion_bills : Automates extraction of billing details from Ampion's PDF bills, structuring data for analysis.
+    - check_scrape        : Compares a scraper's records against a known-good Parquet output.
+    - check_green_button  : Round-trips `meter_usage` records through locally written Green Button files.
 '''
 
-def load_data_files(path : str, 
-                    type : str = 'CSV', 
-                    cols : List[str] = None) -> Union[pd.DataFrame, str]:
+def iter_pages(files   : List[str],
+               engine  : str                                          = 'pdfplumber',
+               regions : Dict[int, Tuple[float, float, float, float]] = None,
+               first   : bool                                         = False) -> Iterator[Dict[str, Any]]:
+    '''
+    Yields the text of every page of some PDFs, one page at a time, optionally cropped to a region of particular pages,
+    so a parser only sees the part of a page its fields are laid out in. Each file is closed before the next is opened,
+    so only the page being read is held in memory.
+
+    The two engines differ in how they read a page. 'pdfplumber' interprets every character and rebuilds the lines in
+    reading order, which keeps side-by-side columns together but takes most of a second per page. 'pdfium' reads the
+    text pdfium already holds for the page, in the order it was drawn, which is over 30 times faster but may interleave
+    text from different parts of the page. Cropping to a region is how a parser on 'pdfium' keeps those parts apart.
+
+    Methodology:
+        1. Open each file with the chosen engine.
+        2. For each page, look up its region by page number, and convert the region's fractions into page coordinates.
+        3. Extract the text inside the region, or the whole page when it has none, normalizing line breaks to '\n'.
+        4. Yield every page with text, along with its file and page number.
+
+    Parameters:
+        files   (List[str])                    : Paths of the PDF files to extract.
+        engine  (str)                          : 'pdfplumber' or 'pdfium'. Defaults to 'pdfplumber'.
+        regions (Dict[int, Tuple[float, ...]]) : Maps page numbers (starting at 1) to the region of the page to keep, as
+                                                 fractions (left, top, right, bottom) of its width and height, measured
+                                                 from the top-left corner. Defaults to None (whole pages).
+        first   (bool)                         : Whether to extract only the first page of each file. Defaults to False.
+
+    Yields:
+        Dict[str, Any]: Each page with text, with its `page_number`, `file_path` and `content`.
+    '''
+
+    regions = regions or {}
+
+    for file in files:
+
+        # Step 1: Open the file with the chosen engine
+        if engine == 'pdfplumber':
+            with pl.open(file) as pdf:
+                for page in pdf.pages[:1] if first else pdf.pages:
+
+                    # Steps 2 & 3: pdfplumber measures from the top-left corner, like the regions
+                    if page.page_number in regions:
+                        left, top, right, bottom = regions[page.page_number]
+                        page = page.crop((left * page.width, top * page.height, right * page.width, bottom * page.height))
+
+                    content = page.extract_text()
+                    page.close() # Releases the characters pdfplumber cached while laying out the page
+
+                    # Step 4: Yield every page with text
+                    if content:
+                        yield {'page_number': page.page_number, 'file_path': file, 'content': content}
+
+        elif engine == 'pdfium':
+            pdf = pdfium.PdfDocument(file)
+            try:
+                for number in range(1, 2 if first else len(pdf) + 1):
+                    page = pdf[number - 1]
+                    text = page.get_textpage()
+
+                    # Steps 2 & 3: pdfium measures from the bottom-left corner, so the region's vertical fractions flip
+                    if number in regions:
+                        left, top, right, bottom = regions[number]
+                        width, height            = page.get_size()
+                        content = text.get_text_bounded(left   = left  * width,
+                                                        bottom = (1 - bottom) * height,
+                                                        right  = right * width,
+                                                        top    = (1 - top) * height)
+                    else:
+                        content = text.get_text_range()
+
+                    # Step 4: Yield every page with text
+                    if content:
+                        yield {'page_number': number, 'file_path': file, 'content': content.replace("\r\n", "\n")}
+            finally:
+                pdf.close()
+
+        else:
+            raise ValueError(f"Unsupported PDF engine: `{engine}`")
+
+def extract_pages(files   : List[str],
+                  engine  : str                                          = 'pdfplumber',
+                  regions : Dict[int, Tuple[float, float, float, float]] = None,
+                  first   : bool                                         = False) -> pd.DataFrame:
+    '''
+    Collects the pages `iter_pages` yields for some PDFs into a DataFrame, taking the same parameters.
+
+    Returns:
+        pd.DataFrame: One row per page with text, with its `page_number`, `file_path` and `content`.
+    '''
+
+    return pd.DataFrame(iter_pages(files, engine, regions, first), columns = ['page_number', 'file_path', 'content'])
+
+def load_data_files(path  : str, 
+                    type  : str = 'CSV', 
+                    cols  : List[str] = None,
+                    files : List[str] = None) -> Union[pd.DataFrame, str]:
     '''
     Load data files from the specified directory. Supports CSV and PDF file types.
 
@@ -37,15 +145,17 @@ def load_data_files(path : str,
            a. Load each file, optionally applying specified column names.
            b. Concatenate all CSV data into a single DataFrame.
         3. For PDF files:
-           a. Extract text content from each page of each PDF file.
+           a. Extract text content from each page of each PDF file using `extract_pages`.
            b. Create a DataFrame with content and page number for each extracted page.
         4. For Parquet files:
            a. Directly read the Parquet dataset from the specified directory.
 
     Parameters:
-        path (str)       : Path to the directory containing the files.
-        type (str)       : Type of the files to load (CSV, PDF, Parquet). Defaults to 'CSV'.
-        cols (List[str]) : List of column names to be used as headers for CSV files. Defaults to None.
+        path  (str)       : Path to the directory containing the files.
+        type  (str)       : Type of the files to load (CSV, PDF, Parquet). Defaults to 'CSV'.
+        cols  (List[str]) : List of column names to be used as headers for CSV files. Defaults to None.
+        files (List[str]) : Specific CSV or PDF files to load in place of every file in `path`, such as the new files
+                            `ingest_batch` picks up. Defaults to None.
 
     Returns:
         pd.DataFrame: Loaded data as a DataFrame. For CSV and Parquet files, it concatenates all data;
@@ -54,7 +164,7 @@ def load_data_files(path : str,
 
     # Step 1: Load all files for a given data `type`.
     type  = type.lower()
-    files = glob(os.path.join(path, "**", f"*.{type}"), recursive = True)
+    files = files or glob(os.path.join(path, "**", f"*.{type}"), recursive = True)
 
     if not files:
         raise FileNotFoundError(f"No '{type}' files found in {path}.")
@@ -77,12 +187,8 @@ def load_data_files(path : str,
         elif type == 'pdf':
 
             lg.info(f"Loading PDF files from `{path}`.")
-            pages = [{'page_number': page.page_number, 'file_path': file, 'content': page.extract_text()}
-                     for file in files
-                     for page in pl.open(file).pages
-                     if page.extract_text()]
             
-            return pd.DataFrame(pages)
+            return extract_pages(files)
         
         # Step 4: For Parquet files
         elif type == 'parquet':
@@ -97,32 +203,100 @@ def load_data_files(path : str,
     except Exception as e:
         lg.error(f"Error loading files from `{path}`: {e}\n")
 
-def write_results(data           : pd.DataFrame, 
-                  dest           : str, 
-                  add_id         : bool = False, 
-                  partition_by   : str  = 'account_number',
-                  compression    : str  = 'snappy',
-                  use_dictionary : bool = True,
-                  overwrite      : bool = True):
+def load_green_button(path         : str,
+                      usage_points : Dict[str, Dict[str, Any]],
+                      dest         : str  = "./data/cmp/curated/meter_usage",
+                      batch_size   : int  = 100_000,
+                      overwrite    : bool = False) -> int:
     '''
-    Write curated data to a specified Parquet directory with an optional primary key, optional partitioning,
-    and snappy compression. Optionally overwrite existing data or append to it.
+    Streams every Green Button (ESPI) XML file in a directory into the curated `meter_usage` dataset, alongside the
+    readings curated from CMP's CSV exports, without ever holding a whole download in memory.
+
+    Methodology:
+        1. Find every XML file in `path`.
+        2. Stream each file with `iter_green_button` in batches of `batch_size` readings.
+        3. Write each batch with `write_results` under the `meter_usage` schema, appending to `dest` unless `overwrite`
+           is set, in which case the first batch replaces it.
+
+    Parameters:
+        path         (str)                       : Path to the directory containing the Green Button files.
+        usage_points (Dict[str, Dict[str, Any]]) : Maps each `UsagePoint` id to its `account_number`, `service_point_id`,
+                                                   `meter_id` and `meter_channel`, as `iter_green_button` expects.
+        dest         (str)                       : Path to the curated dataset. Defaults to `meter_usage`'s.
+        batch_size   (int)                       : The number of readings written together. Defaults to 100,000.
+        overwrite    (bool)                      : Whether to replace `dest` rather than append to it. Defaults to False.
+
+    Returns:
+        int: The number of readings written.
+    '''
+
+    # Step 1: Find every XML file
+    files = glob(os.path.join(path, "**", "*.xml"), recursive = True)
+
+    if not files:
+        raise FileNotFoundError(f"No 'xml' files found in {path}.")
+
+    lg.info(f"Streaming {len(files)} Green Button files from `{path}`.")
+    rows = 0
+
+    # Steps 2 & 3: Stream each file and write it batch by batch
+    for file in files:
+        for batch in iter_green_button(file, usage_points, batch_size):
+            write_results(data      = batch,
+                          dest      = dest,
+                          schema    = "meter_usage",
+                          overwrite = overwrite and rows == 0)
+            rows += len(batch)
+
+    return rows
+
+def write_results(data             : pd.DataFrame, 
+                  dest             : str, 
+                  add_id           : bool           = False, 
+                  partition_by     : str            = 'account_number',
+                  compression      : str            = 'snappy',
+                  use_dictionary   : bool           = True,
+                  overwrite        : bool           = True,
+                  schema           : str            = None,
+                  sort_by          : List[str]      = None,
+                  row_group_size   : int            = None,
+                  column_encoding  : Dict[str, str] = None,
+                  write_statistics : bool           = True,
+                  profile          : str            = None):
+    '''
+    Write curated data to a specified Parquet directory with an optional primary key, optional partitioning, and the
+    compression of `compression` or a storage profile. Optionally overwrite existing data or append to it.
+
+    The layout parameters let readers like DuckDB and pyarrow skip row groups: when the data is sorted on a column,
+    each row group covers a narrow range of it, and the min/max statistics in the row group's footer tell a reader
+    whether a filter on that column can match anything inside.
 
     Methodology:
         1. Check if the destination directory exists. If not, create it.
         2. If the directory exists and `overwrite` is True, delete the existing data and recreate the directory.
         3. If the directory exists and `overwrite` is False, prepare to append data to the existing directory.
-        4. Optionally add a unique identifier to the data.
-        5. Write the DataFrame to the specified Parquet destination, handling compression and partitioning if required.
+        4. Optionally add a unique identifier to the data, and cast the data to its compact schema from `SCHEMAS`.
+        5. Optionally sort the data within each partition, after the identifier is assigned so ids don't depend on layout.
+        6. Write the DataFrame to the specified Parquet destination, handling compression, partitioning, row group sizes,
+           encodings and statistics if required.
 
     Parameters:
-        data           (pd.DataFrame) : The DataFrame to be written.
-        dest           (str)          : Path to the destination directory.
-        add_id         (bool)         : Whether to add a unique identifier to the data. Defaults to False.
-        partition_by   (str)          : Column to partition by. Defaults to 'account_number'.
-        compression    (str)          : Compression method for Parquet files. Defaults to 'snappy'.
-        use_dictionary (bool)         : Whether to enable dictionary encoding. Defaults to True.
-        overwrite      (bool)         : Whether to overwrite existing data in the directory. Defaults to True.
+        data             (pd.DataFrame)   : The DataFrame to be written.
+        dest             (str)            : Path to the destination directory.
+        add_id           (bool)           : Whether to add a unique identifier to the data. Defaults to False.
+        partition_by     (str)            : Column to partition by. Defaults to 'account_number'.
+        compression      (str)            : Compression method for Parquet files. Defaults to 'snappy'.
+        use_dictionary   (bool)           : Whether to enable dictionary encoding. Defaults to True.
+        overwrite        (bool)           : Whether to overwrite existing data in the directory. Defaults to True.
+        schema           (str)            : Name of the table in `SCHEMAS` whose compact dtypes to write. Defaults to None.
+        sort_by          (List[str])      : Columns to sort each partition by before writing. Defaults to None.
+        row_group_size   (int)            : The number of rows in each row group. Defaults to None, pyarrow's default.
+        column_encoding  (Dict[str, str]) : Maps columns to a Parquet encoding (e.g. 'DELTA_BINARY_PACKED'), which
+                                            replaces dictionary encoding for those columns. Defaults to None.
+        write_statistics (bool)           : Whether to write min/max statistics for each row group. Defaults to True.
+        profile          (str)            : Name of the storage profile in `PROFILES`, which replaces `compression` and adds
+                                            its encodings under any explicit `column_encoding`. Defaults to the profile
+                                            `STORAGE` assigns to `schema`, if any.
     '''
     
     # Step 1: Check if the destination directory exists.
@@ -140,209 +314,470 @@ def write_results(data           : pd.DataFrame,
 
     os.makedirs(dest, exist_ok = True)
     
-    # Step 4: Optionally add a unique identifier to the data.
+    # Step 4: Optionally add a unique identifier to the data, and cast it to its schema.
     if add_id:
         data.insert(0, 'id', range(1, len(data) + 1))
 
-    # Step 5: Write the DataFrame to the specified Parquet destination.
+    if schema:
+        data = apply_schema(data, schema)
+
+    # Step 5: Optionally sort the data within each partition.
+    if sort_by:
+        data = data.sort_values(([partition_by] if partition_by else []) + sort_by, kind = 'stable', ignore_index = True)
+
+    # Resolve the codec and encodings of the storage profile
+    compression_level = None
+    profile           = profile or STORAGE.get(schema)
+
+    if profile:
+        options           = storage_options(data, profile)
+        compression       = options['compression']
+        compression_level = options['compression_level']
+        column_encoding   = {**options['column_encoding'], **(column_encoding or {})} or None
+
+    # Columns with an explicit encoding can't also be dictionary-encoded
+    if column_encoding and use_dictionary:
+        use_dictionary = [col for col in data.columns if col not in column_encoding]
+
+    # Step 6: Write the DataFrame to the specified Parquet destination.
     try:
         pq.write_to_dataset(pa.Table.from_pandas(data), 
-                            root_path      = dest, 
-                            partition_cols = [partition_by] if partition_by else None,
-                            compression    = compression,
-                            use_dictionary = use_dictionary)
+                            root_path          = dest, 
+                            partition_cols     = [partition_by] if partition_by else None,
+                            compression        = compression,
+                            compression_level  = compression_level,
+                            use_dictionary     = use_dictionary,
+                            column_encoding    = column_encoding,
+                            write_statistics   = write_statistics,
+                            row_group_size     = row_group_size,
+                            min_rows_per_group = row_group_size,
+                            use_threads        = not sort_by) # Threaded writes don't keep rows in order
 
         lg.info(f"Data written in Parquet to `{dest}`.\n")
 
     except Exception as e:
         lg.error(f"Error writing data to `{dest}`: {e}\n")
 
-def scrape_cmp_bills(raw    : str = "./data/cmp/raw/bills/pdf",
-                     output : str = "./data/cmp/raw/bills/parquet"):
+def assign_keys(data        : pd.DataFrame,
+                natural_key : List[str],
+                key_map     : str) -> pd.DataFrame:
     '''
-    This function reads all PDFs in the specified `raw` directory, extracts specific information from CMP bills using 
-    regular expressions, and then returns a list of dictionaries containing the scraped data.
+    Gives each row of a dimension the persistent id of its natural key, so a rebuild reuses the ids rows had before
+    however its inputs are ordered, and facts keyed on those ids stay valid across rebuilds.
+
+    Ids come from a key map rather than a hash of the natural key, since they stay small enough for the narrow key
+    columns of `fct_electric_brew`. The map is a JSON file holding the natural key's columns and the id of every key
+    it has seen. A new key takes the next id after the highest ever assigned, in the order it first appears, and the
+    id of a key that disappears is kept in the map so it's never handed to another row.
+    The maps are tracked in git next to the modeled tables, so every checkout numbers rows the same way.
 
     Methodology:
-        1. Load data from PDF files in the `raw` directory using `load_data_files`.
-        2. Extract relevant fields from each page of the bill using regular expressions.
-        3. Create a list of dictionaries, each representing a record from a single delivery group within a bill.
-        4. Records contains fields like invoice numbers, account numbers, amounts due, delivery taxes, and supplier information.
+        1. Read the key map, or start an empty one, and check it was built on the same natural key.
+        2. Join each row's natural key values into a single string and check they're unique.
+        3. Look up each key's id, and assign the next ids to keys the map hasn't seen.
+        4. Write the map to a temporary file and move it into place, if any keys were added.
 
     Parameters:
-        raw (str): Path to the directory containing CMP bill PDF files.
+        data        (pd.DataFrame) : The dimension's rows.
+        natural_key (List[str])    : Columns that identify a row from one build to the next.
+        key_map     (str)          : Path to the table's key map.
+
+    Returns:
+        pd.DataFrame: `data` with its persistent ids in a leading `id` column.
     '''
 
+    # Step 1: Read the key map, or start an empty one
+    path = find_project_root(key_map)
+
     try:
-        # Step 1: Load data from PDF files
-        pdf_data = load_data_files(path = raw, 
-                                   type = 'PDF')
-        
-        def better_search(pattern, text, default = "0"):
-            '''
-            Searches for a pattern in text and returns either the first group if found or the default value.
-            '''
-
-            match = search(pattern, text, DOTALL)
-            return match.group(1) if match else default
-
-        # Regular expressions for data fields
-        r_amount_due       = r"Amount Due.*?\$\s*(\d+\.\d{2})"
-        r_delivery_tax     = r"Maine Sales Tax \+\$(\d+\.\d{2})"
-        r_delivery_group   = r"Delivery Charges:.*?\(\s*(\d{2}/\d{2}/\d{4})\s*-\s*(\d{2}/\d{2}/\d{4})\s*\)"
-        r_service_charge   = r"Service Charge.*?\+\$(\d+\.\d{2})"
-        r_delivery_service = r"Delivery Service: ([\d,]+) KWH (?:@\$\d+\.\d{6} )?\+\$(\d+\.\d{2})"
-        r_supplier_info    = r"Prior Balance for ([A-Z\s\w.]+)(?: Supplier)? \$\d+\.\d{2}"
-        r_kwh_supplied     = r"Energy Charge ([\d,]+) KWH"
-        r_supply_charge    = r"Energy Charge.*?\+\$(\d+\.\d{2})"
-        r_supply_tax       = r"Maine Sales Tax \+\$(\d+\.\d{2})"
-
-        # Step 2: Extract data using regular expressions
+        with open(path) as file:
+            keys = json.load(file)
+
+    except FileNotFoundError:
+        keys = {'natural_key' : natural_key, 'ids' : {}}
+
+    if keys['natural_key'] != natural_key:
+        raise ValueError(f"Key map `{key_map}` is keyed on {keys['natural_key']}, not {natural_key}.")
+
+    # Step 2: Join each row's natural key into a single string
+    names = data[natural_key].astype(str).agg('|'.join, axis = 1)
+
+    if names.duplicated().any():
+        raise ValueError(f"Natural key {natural_key} isn't unique, e.g. `{names[names.duplicated()].iloc[0]}`.")
+
+    # Step 3: Reuse known ids and assign the next ones to new keys
+    ids   = keys['ids']
+    new   = [name for name in names if name not in ids]
+    start = max(ids.values(), default = 0) + 1
+    ids.update(zip(new, range(start, start + len(new))))
+
+    data = data.copy()
+    data.insert(0, 'id', names.map(ids).to_numpy())
+
+    # Step 4: Persist the key map if it grew
+    if new:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(f"{path}.tmp", 'w') as file:
+            json.dump(keys, file, indent = 2)
+
+        os.replace(f"{path}.tmp", path)
+        lg.info(f"Assigned {len(new)} new ids in `{key_map}`.")
+
+    return data
+
+def benchmark_storage(tables   : Dict[str, str] = {'meter_usage'       : './data/cmp/curated/meter_usage',
+                                                 'locations'         : './data/cmp/curated/locations',
+                                                 'cmp_bills'         : './data/cmp/curated/bills',
+                                                 'ampion_bills'      : './data/ampion/curated',
+                                                 'dim_datetimes'     : './data/modeled/dim_datetimes',
+                                                 'dim_meters'        : './data/modeled/dim_meters',
+                                                 'dim_bills'         : './data/modeled/dim_bills',
+                                                 'fct_electric_brew' : './data/modeled/fct_electric_brew'},
+                      profiles : List[str]      = None,
+                      repeats  : int            = 3,
+                      slack    : float          = 1.25) -> pd.DataFrame:
+    '''
+    Measures the size on disk, write time and read time of every table under every storage profile, and recommends a
+    profile per table. `STORAGE` records the profiles chosen from these measurements, so rerun this as the archive of
+    interval data grows and revisit `STORAGE` where the tradeoff shifts.
+
+    Methodology:
+        1. Read each table with its schema, so every profile writes the same compact dtypes.
+        2. Write the table to a temporary directory under each profile, `repeats` times, keeping the fastest write.
+        3. Read it back `repeats` times, keeping the fastest read, and record the size of its files.
+        4. Recommend the smallest profile whose read time is within `slack` times the fastest read of that table.
+
+    Parameters:
+        tables   (Dict[str, str]) : Maps each table in `SCHEMAS` to its Parquet directory, relative to the project root.
+        profiles (List[str])      : The profiles in `PROFILES` to compare. Defaults to every profile.
+        repeats  (int)            : The number of times to time each write and read. Defaults to 3.
+        slack    (float)          : How much slower than the fastest read a recommended profile may be. Defaults to 1.25.
+
+    Returns:
+        pd.DataFrame: One row per table and profile, with its `mb`, `write_seconds`, `read_seconds` and whether it's
+                      the `recommended` profile for its table.
+    '''
+
+    results = []
+    for table, path in tables.items():
+
+        # Step 1: Read the table with its schema
+        df = read_data(path, schema = table)
+
+        for profile in profiles or PROFILES:
+            dest = os.path.join(mkdtemp(), table)
+            writes, reads = [], []
+
+            try:
+                # Step 2: Time the writes
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    write_results(data         = df.copy(),
+                                  dest         = dest,
+                                  partition_by = None,
+                                  profile      = profile)
+                    writes.append(time.perf_counter() - start)
+
+                # Step 3: Time the reads and measure the files
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    apply_schema(pq.read_table(dest).to_pandas(), table) # As `read_data` would, outside the project
+                    reads.append(time.perf_counter() - start)
+
+                size = sum(os.path.getsize(file) for file in glob(os.path.join(dest, "**", "*.parquet"), recursive = True))
+
+                results.append({'table'         : table,
+                                'profile'       : profile,
+                                'mb'            : round(size / 1e6, 3),
+                                'write_seconds' : round(min(writes), 4),
+                                'read_seconds'  : round(min(reads), 4)})
+
+            except Exception as e:
+                lg.error(f"Error benchmarking `{table}` with profile `{profile}`: {e}\n")
+
+            finally:
+                rmtree(os.path.dirname(dest), ignore_errors = True)
+
+    # Step 4: Recommend the smallest profile that reads within `slack` of the fastest
+    df = pd.DataFrame(results)
+    df['recommended'] = False
+
+    for table, group in df.groupby('table', sort = False):
+        eligible = group[group['read_seconds'] <= slack * group['read_seconds'].min()]
+        df.loc[eligible['mb'].idxmin(), 'recommended'] = True
+
+    return df
+
+def _route_bills(files   : List[str],
+                 formats : List[str]) -> pd.Series:
+    '''
+    Routes each bill to the first format in `formats` whose detection rule matches its first page, or None if none do.
+    Only the first pages are read, with the fast 'pdfium' engine, since detection just looks for a pattern.
+    '''
+
+    first = extract_pages(files, engine = 'pdfium', first = True).set_index('file_path')['content']
+    first = first.reindex(files, fill_value = "")
+
+    return first.map(lambda text: next((name for name in formats if PARSERS[name]['detect'].search(text)), None))
+
+def _page_batches(pages      : Iterator[Dict[str, Any]],
+                  batch_size : int) -> Iterator[pd.DataFrame]:
+    '''
+    Groups a stream of pages into DataFrames holding the pages of `batch_size` files each. Pages arrive file by file, so
+    each batch is complete as soon as the next file's first page arrives, and only one batch is held in memory at a time.
+    '''
+
+    files = groupby(pages, key = lambda page: page['file_path'])
+
+    while batch := [page for _, file_pages in islice(files, batch_size) for page in file_pages]:
+        yield pd.DataFrame(batch)
+
+def _parse_batch(name   : str,
+                 pages  : pd.DataFrame,
+                 report : pd.DataFrame) -> pd.DataFrame:
+    '''
+    Parses a batch of a format's pages in one call. If that fails, parses its files one at a time, recording each failure
+    in `report`, so only the files that fail are left out.
+    '''
+
+    try:
+        return PARSERS[name]['parse'](pages)
+
+    except Exception:
         records = []
-        for file_path, row in pdf_data.groupby("file_path"): # Adding records file-by-file
-
-            # Some string patterns can only exist on certain pages, so this helps narrow the search
-            page = {n: s for n, s in zip(row['page_number'], row['content'])}
-
-            invoice_number = os.path.basename(file_path).split('_')[0]
-            account_number = os.path.basename(os.path.dirname(file_path))
-            amount_due     = better_search(r_amount_due,   page.get(1))
-            delivery_tax   = better_search(r_delivery_tax, page.get(2))
-
-            delivery_groups = findall(r_delivery_group, page.get(2), DOTALL)
-            for start, end in delivery_groups:
-
-                # Find content for the current delivery group
-                delivery_content = search(rf"({start}.*?)({end}).*?(?=\s*Delivery Charges:|\Z)", 
-                                          page.get(2), 
-                                          DOTALL).group()
-
-                service_charge  = better_search(r_service_charge, delivery_content)
-                delivery_search = search(r_delivery_service, delivery_content, DOTALL)
-                kwh_delivered   = delivery_search.group(1).replace(",", "") if delivery_search else "0"
-                delivery_charge = delivery_search.group(2)                  if delivery_search else "0"
-
-                # Step 3: Extract supplier information
-                supplier      = ""
-                kwh_supplied  = supply_charge = supply_tax = "0"
-                supplier_page = next((n for n, s in page.items() 
-                                    if n >= 3 and search(r_supplier_info, s, DOTALL)), None)
-
-                if supplier_page:
-
-                    supplier_content = page[supplier_page]
-                    supplier      = better_search(r_supplier_info, supplier_content, "").strip().replace(" Supplier", "")
-                    kwh_supplied  = better_search(r_kwh_supplied,  supplier_content).replace(",", "")
-                    supply_charge = better_search(r_supply_charge, supplier_content)
-                    supply_tax    = better_search(r_supply_tax,    supplier_content)
-
-                # Step 4: Create records
-                records.append({'invoice_number'  : invoice_number,
-                                'account_number'  : account_number,
-                                'amount_due'      : float(amount_due),
-                                'delivery_tax'    : float(delivery_tax),
-                                'interval_start'  : datetime.strptime(start.strip(), "%m/%d/%Y").strftime("%Y-%m-%d"),
-                                'interval_end'    : datetime.strptime(end.strip(), "%m/%d/%Y").strftime("%Y-%m-%d"),
-                                'service_charge'  : float(service_charge),
-                                'kwh_delivered'   : int(kwh_delivered),
-                                'delivery_charge' : float(delivery_charge),
-                                'supplier'        : supplier,
-                                'kwh_supplied'    : int(kwh_supplied),
-                                'supply_charge'   : float(supply_charge),
-                                'supply_tax'      : float(supply_tax)})
-
-        # Step 5: Write the data to Parquet
-        write_results(data = pd.DataFrame(records), 
-                      dest = output)
+        for file_path, file_pages in pages.groupby('file_path'):
+            try:
+                records.append(PARSERS[name]['parse'](file_pages))
 
-    except Exception as e:
-        print(f"Error while processing CMP bills: {e}\n")
+            except Exception as e:
+                report.loc[report['file_path'] == file_path, 'error'] = f"{type(e).__name__}: {e}"
+
+        return pd.concat(records, ignore_index = True) if records else pd.DataFrame(columns = FIELDS)
+
+def scrape_bills(raw        : List[str]      = None,
+                 formats    : List[str]      = None,
+                 outputs    : Dict[str, str] = None,
+                 batch_size : int            = 100,
+                 files      : List[str]      = None,
+                 overwrite  : bool           = True) -> pd.DataFrame:
+    '''
+    Scrapes every bill PDF in the `raw` directories, routing each file to the parser in `PARSERS` whose detection rule
+    matches it, and writes each format's records to its own Parquet directory.
+
+    Each format's `extract` options decide how its pages are read by `iter_pages`, so a format whose fields sit in
+    fixed parts of the page can use the fast 'pdfium' engine on just those parts, rather than laying out every page.
+
+    Bills stream through the pipeline in batches of `batch_size` files: pages are read from one file at a time, each
+    batch is parsed as soon as its last file is read, and its records are appended to the output before the next batch
+    is read. Memory stays bounded by one batch's text and records, however many years of bills are being back-filled.
+
+    Methodology:
+        1. Find every PDF in the `raw` directories, unless specific `files` are given.
+        2. Route each file to the first format whose `detect` pattern matches its first page.
+        3. Stream the pages of the format's files with its `extract` options, grouped into batches of `batch_size` files.
+        4. Parse each batch in one call. If that fails, parse its files one at a time, so only the files that fail are
+           left out.
+        5. Check that the records carry every field in `FIELDS`, then write them without the `file_path` they came from,
+           replacing the format's output with the first batch (if `overwrite` is set) and appending every batch after it.
+        6. Report every file with its format, the number of records it produced, and any error.
+
+    Parameters:
+        raw        (List[str])      : Directories of bill PDFs. Defaults to the `raw` directory of every format in
+                                      `formats`.
+        formats    (List[str])      : The formats in `PARSERS` to route bills to, in order. Defaults to every format.
+        outputs    (Dict[str, str]) : Maps formats to the directories their records are written to, in place of their
+                                      `output` in `PARSERS`. Defaults to None.
+        batch_size (int)            : The number of files parsed and written together. Defaults to 100.
+        files      (List[str])      : Specific PDFs to scrape in place of every PDF in `raw`. Defaults to None.
+        overwrite  (bool)           : Whether the first batch replaces each format's output, rather than every batch
+                                      being appended to it. Defaults to True.
+
+    Returns:
+        pd.DataFrame: One row per file with its `format`, `records` and `error`, which is None for every parsed file.
+    '''
+
+    formats = formats or list(PARSERS)
+    raw     = raw     or [PARSERS[name]['raw'] for name in formats]
+    outputs = {name: PARSERS[name]['output'] for name in formats} | (outputs or {})
+
+    # Step 1: Find every PDF
+    files = files or [file for path in raw for file in glob(os.path.join(path, "**", "*.pdf"), recursive = True)]
+
+    # Step 2: Route each file to a format
+    lg.info(f"Routing {len(files)} bills.")
+    routes = _route_bills(files, formats)
+    report = pd.DataFrame({'file_path' : routes.index,
+                           'format'    : routes.values,
+                           'records'   : 0,
+                           'error'     : [None if name else "No parser recognized this bill" for name in routes.values]})
+
+    for name in formats:
+        replace = overwrite # Only the first batch written can replace any previous output
+
+        # Step 3: Stream the format's pages in batches of files
+        pages = iter_pages(list(routes.index[routes == name]), **PARSERS[name]['extract'])
+
+        for batch in _page_batches(pages, batch_size):
+
+            # Step 4: Parse the batch, falling back to one file at a time
+            records = _parse_batch(name, batch, report)
+
+            # Step 5: Check the common fields and write the records
+            missing = [field for field in FIELDS if field not in records.columns]
+            if missing:
+                report.loc[report['file_path'].isin(batch['file_path']), 'error'] = f"Records are missing {missing}"
+                continue
+
+            if records.empty:
+                continue
+
+            counts  = records['file_path'].value_counts()
+            written = report['file_path'].isin(counts.index)
+            report.loc[written, 'records'] = report.loc[written, 'file_path'].map(counts)
+
+            write_results(data      = records.drop(columns = 'file_path'),
+                          dest      = outputs[name],
+                          overwrite = replace)
+
+            replace = False
+
+    # Step 6: Report every file
+    failed = report['error'].notna()
+    if failed.any():
+        lg.error(f"{failed.sum()} of {len(report)} bills couldn't be parsed:\n{report[failed].to_string(index = False)}\n")
+
+    lg.info(f"Scraped {report['records'].sum()} records from {(~failed).sum()} bills.\n")
+
+    return report
+
+def scrape_cmp_bills(raw    : str = "./data/cmp/raw/bills/pdf",
+                     output : str = "./data/cmp/raw/bills/parquet"):
+    '''
+    This function reads all PDFs in the specified `raw` directory, extracts specific information from CMP bills using 
+    `parse_cmp_bills`, and then saves a Parquet directory to the specified `output`.
+
+    Parameters:
+        raw    (str) : Path to the directory containing CMP bill PDF files.
+        output (str) : Directory where the scraped data should be saved.
+    '''
+
+    return scrape_bills(raw     = [raw],
+                        formats = ['cmp'],
+                        outputs = {'cmp': output})
     
 def scrape_ampion_bills(raw    : str = "./data/ampion/raw/pdf", 
                         output : str = "./data/ampion/raw/parquet"):
     '''
     This function reads all PDFs in the specified `raw` directory, extracts specific information from the 
-    Ampion bills using regular expressions, and then saves a Parquet directory to the specified `output`.
+    Ampion bills using `parse_ampion_bills`, and then saves a Parquet directory to the specified `output`.
 
-    Methodology:
-        1. Load data from PDF files in the `raw` directory using `load_data_files`.
-        2. Create a map of the bills' abbreviated account numbers to full account numbers.
-        3. Use regular expressions to find specific data fields in the extracted text.
-        4. Create a list of dictionaries containing the scraped data, including "Miscellaneous Charges" if present.
-        5. Write the data to CSV files in the `output` directory.
+    Parameters:
+        raw    (str) : Path to the directory containing raw Ampion bill PDF files.
+        output (str) : Directory where the scraped data should be saved.
+    '''
+
+    return scrape_bills(raw     = [raw],
+                        formats = ['ampion'],
+                        outputs = {'ampion': output})
 
-    The function handles standard charges as well as a conditional case for "Miscellaneous Charges" 
-    which requires a different extraction logic for certain fields.
+def check_scrape(scraper : Callable,
+                 golden  : str) -> pd.DataFrame:
+    '''
+    Runs a scraper into a temporary directory and compares its records against a known-good Parquet output, so a change
+    to the parsing logic can be checked against every bill before it replaces the scraped data.
+
+    Methodology:
+        1. Run `scraper` with its default `raw` directory, writing to a temporary `output` directory.
+        2. Read the scraped and the golden records, with every column as a string so types can't mask differences.
+        3. Match the records on every column, keeping any record that appears on only one side.
 
     Parameters:
-        raw    (str) : Path to the directory containing raw Ampion bill PDF files.
-        output (str) : Directory where the scraped data CSV files should be saved.
+        scraper (Callable) : A scraping function that takes an `output` directory, like `scrape_cmp_bills`.
+        golden  (str)      : Path to the known-good Parquet output of the same scraper.
+
+    Returns:
+        pd.DataFrame: Every record found on only one side, with a `side` column of 'golden' or 'scraped'. It's empty
+                      when the scraper reproduces the golden output exactly.
     '''
 
+    dest = mkdtemp()
+
     try:
-        # Step 1: Load data from PDF files
-        pdf_data = load_data_files(path = raw, 
-                                   type = 'PDF')
-
-        # Step 2: Map abbreviated account numbers to full account numbers
-        acc_map = {str(acc)[-4:]: acc for acc in locations['account_number']}
-
-        # Regular expressions for data fields
-        r_invoice       = r"Invoice:\s(\d+)"
-        r_abbr_acc      = r'\*{5}(\d+)'
-        r_dates         = r'(\d{2}\.\d{2}\.\d{4})\s*–\s*(\d{2}\.\d{2}\.\d{4})'
-        r_kwh           = r'(\d{1,4}(?:,\d{3})*?) kWh'
-        r_prices        = r'allocated\s+\$ (\d+(?:,\d{3})*\.\d{2})\s+\$ (\d+(?:,\d{3})*\.\d{2})\s+\$ (\d+(?:,\d{3})*\.\d{2})'
-        r_misc_abbr_acc = r"utility acct \*\*\*\*(\d+):"
-        r_misc_kwh      = r"\*{4}(\d+):(\d+)\s*kWh"
-        r_misc_credits  = r"\$(\d+(?:,\d{3})*\.\d{2})\s*bill credits"
-        r_misc_prices   = r'bill credits allocated @ \$\s*(\d+(?:,\d{3})*\.\d{2})\s+\$\s*(\d+(?:,\d{3})*\.\d{2})'
-
-        # Step 3: Use regular expressions to extract data
-        records = []
-        for _, row in pdf_data.iterrows():
-
-            invoice_number = search(r_invoice,   row['content']).group(1)
-            abbr_numbers   = findall(r_abbr_acc, row['content'])
-            dates          = findall(r_dates,    row['content'])
-            kwh_values     = findall(r_kwh,      row['content'])
-            prices         = findall(r_prices,   row['content'])
-
-             # Step 4: Create records for regular charges
-            for i, abbr_number in enumerate(abbr_numbers):
-
-                records.append({'invoice_number' : invoice_number,
-                                'account_number' : acc_map.get(abbr_number[-4:], abbr_number),
-                                'supplier'       : "Ampion",
-                                'interval_start' : datetime.strptime(dates[i][0], "%m.%d.%Y").strftime("%Y-%m-%d"),
-                                'interval_end'   : datetime.strptime(dates[i][1], "%m.%d.%Y").strftime("%Y-%m-%d"),
-                                'kwh'            : int(kwh_values[i].replace(',', '')),
-                                'bill_credits'   : float(prices[i][0]),
-                                'price'          : float(prices[i][1]) if int(invoice_number[0:4]) < 2023 else float(prices[i][2])})
-                
-            if "Miscellaneous Charges" in row['content']:
-
-                # Slice the content to only include text after "Miscellaneous Charges"
-                misc_content = row['content'][row['content'].find("Miscellaneous Charges"):]
-
-                misc_abbr_number  = search(r_misc_abbr_acc, misc_content).group(1)
-                misc_kwh          = search(r_misc_kwh,      misc_content).group(2)
-                misc_bill_credits = search(r_misc_credits,  misc_content).group(1)
-                misc_prices       = search(r_misc_prices,   misc_content).groups()
-
-                 # Step 4 (cont.): Create records for "Miscellaneous Charges" if present
-                records.append({'invoice_number' : invoice_number,
-                                'account_number' : acc_map.get(misc_abbr_number, misc_abbr_number),
-                                'supplier'       : "Ampion",
-                                'interval_start' : datetime.strptime(dates[0][0], "%m.%d.%Y").strftime("%Y-%m-%d"),
-                                'interval_end'   : datetime.strptime(dates[0][1], "%m.%d.%Y").strftime("%Y-%m-%d"),
-                                'kwh'            : int(misc_kwh.replace(',', '')),
-                                'bill_credits'   : float(misc_bill_credits),
-                                'price'          : float(misc_prices[0]) if int(invoice_number[0:4]) < 2023 else float(misc_prices[1])})
-
-        # Step 5: Write the data to Parquet
-        write_results(data = pd.DataFrame(records), 
-                      dest = output)
+        # Step 1: Scrape into a temporary directory
+        scraper(output = dest)
 
-    except Exception as e:
-        print(f"Error while processing and exporting Ampion bills: {e}\n")
+        # Step 2: Read both sides as strings, in the same column order
+        expected = pq.read_table(golden).to_pandas().astype(str)
+        scraped  = pq.read_table(dest).to_pandas().astype(str)[expected.columns]
+
+        # Step 3: Keep the records found on only one side
+        diff = expected.merge(scraped, how = 'outer', indicator = 'side') \
+                       .query("side != 'both'") \
+                       .replace({'side': {'left_only': 'golden', 'right_only': 'scraped'}})
+
+        lg.info(f"`{scraper.__name__}` reproduced {len(expected) - (diff['side'] == 'golden').sum()} of {len(expected)} "
+                f"golden records, with {(diff['side'] == 'scraped').sum()} unmatched records scraped.\n")
+
+        return diff.reset_index(drop = True)
+
+    finally:
+        rmtree(dest, ignore_errors = True)
+
+def check_green_button(source     : str = "./data/cmp/curated/meter_usage",
+                       batch_size : int = 100_000) -> pd.DataFrame:
+    '''
+    Writes `meter_usage` records to Green Button files in a temporary directory, streams them back in with
+    `load_green_button`, and compares the two, so the reader can be checked without a utility's download at hand.
+
+    Methodology:
+        1. Read the records in `source`, and write each account's records to its own Green Button file with
+           `write_green_button`, using each service point as a `UsagePoint`.
+        2. Stream the files back into a temporary dataset in batches of `batch_size` readings.
+        3. Read both sides under the `meter_usage` schema as strings, and keep any record that appears on only one side.
+
+    Parameters:
+        source     (str) : Path to the curated `meter_usage` records to round-trip. Defaults to the curated dataset.
+        batch_size (int) : The number of readings streamed in each batch. Defaults to 100,000.
+
+    Returns:
+        pd.DataFrame: Every record found on only one side, with a `side` column of 'written' or 'loaded'. It's empty
+                      when every record written comes back unchanged.
+    '''
+
+    folder = mkdtemp()
+
+    try:
+        # Step 1: Write one Green Button file per account
+        records      = read_data(source, schema = 'meter_usage').drop(columns = '__index_level_0__', errors = 'ignore')
+        usage_points = {str(service_point_id): {'account_number'   : meter['account_number'],
+                                                'service_point_id' : service_point_id,
+                                                'meter_id'         : meter['meter_id'],
+                                                'meter_channel'    : meter['meter_channel']}
+                        for service_point_id, meter in records.drop_duplicates('service_point_id')
+                                                              .set_index('service_point_id').iterrows()}
+
+        written = pd.concat([write_green_button(account, os.path.join(folder, f"{account_number}.xml"))
+                             for account_number, account in records.groupby('account_number', observed = True)],
+                            ignore_index = True)
+
+        # Step 2: Stream them back in
+        start = time.perf_counter()
+        rows  = load_green_button(folder, usage_points, dest = os.path.join(folder, "meter_usage"), batch_size = batch_size)
+        lg.info(f"Streamed {rows} readings in {time.perf_counter() - start:.1f} seconds.")
+
+        # Step 3: Keep the records found on only one side
+        expected = apply_schema(written, 'meter_usage').astype(str)
+        loaded   = apply_schema(pq.read_table(os.path.join(folder, "meter_usage")).to_pandas(), 'meter_usage') \
+                       .astype(str)[expected.columns]
+
+        diff = expected.merge(loaded, how = 'outer', indicator = 'side') \
+                       .query("side != 'both'") \
+                       .replace({'side': {'left_only': 'written', 'right_only': 'loaded'}})
+
+        lg.info(f"Green Button round trip matched {len(expected) - (diff['side'] == 'written').sum()} of "
+                f"{len(expected)} records, with {(diff['side'] == 'loaded').sum()} unmatched records loaded.\n")
+
+        return diff.reset_index(drop = True)
+
+    finally:
+        rmtree(folder, ignore_errors = True)
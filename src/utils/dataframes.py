@@ -16,13 +16,13 @@ Variables:
 '''
 
 # Curated DataFrames
-meter_usage       = read_data('./data/cmp/curated/meter_usage')
-locations         = read_data('./data/cmp/curated/locations')
-cmp_bills         = read_data('./data/cmp/curated/bills')
-ampion_bills      = read_data('./data/ampion/curated')
+meter_usage       = read_data('./data/cmp/curated/meter_usage',   schema = 'meter_usage')
+locations         = read_data('./data/cmp/curated/locations',     schema = 'locations')
+cmp_bills         = read_data('./data/cmp/curated/bills',         schema = 'cmp_bills')
+ampion_bills      = read_data('./data/ampion/curated',            schema = 'ampion_bills')
 
 # Modeled DataFrames
-dim_datetimes     = read_data('./data/modeled/dim_datetimes')
-dim_meters        = read_data('./data/modeled/dim_meters')
-dim_bills         = read_data('./data/modeled/dim_bills')
-fct_electric_brew = read_data('./data/modeled/fct_electric_brew')
\ No newline at end of file
+dim_datetimes     = read_data('./data/modeled/dim_datetimes',     schema = 'dim_datetimes')
+dim_meters        = read_data('./data/modeled/dim_meters',        schema = 'dim_meters')
+dim_bills         = read_data('./data/modeled/dim_bills',         schema = 'dim_bills')
+fct_electric_brew = read_data('./data/modeled/fct_electric_brew', schema = 'fct_electric_brew')
\ No newline at end of file
@@ -0,0 +1,432 @@
+from aiohttp        import web
+from glob           import glob
+from re             import compile
+from shutil         import copy2, rmtree
+from tempfile       import mkdtemp
+from typing         import Any, Dict, List
+from urllib.parse   import urljoin
+from utils.ingest   import SOURCES
+from utils.runtime  import find_project_root, hash_file, read_ledger, write_ledger
+
+import asyncio
+import os
+import random
+import time
+import aiohttp
+import logging      as lg
+import pandas       as pd
+
+lg.basicConfig(level  = lg.INFO,
+               format = '%(asctime)s | %(levelname)s | %(message)s')
+
+'''
+Contains an asynchronous bulk downloader that fetches bill PDFs and usage CSVs from a utility or supplier portal straight
+into the raw drop directories, where `scrape_bills` and the `watch` ingest mode pick them up.
+
+A portal is read through a JSON manifest listing its documents, each with a `url`, the `name` to save it under, and,
+where the portal publishes one, the `sha256` of its contents. Every download shares one pooled HTTP session, so
+connections are reused across documents, and the number open at once is capped overall and per host. Failed requests
+are retried with exponential backoff, and interrupted downloads resume from the bytes already on disk with an HTTP
+`Range` request rather than starting over.
+
+Documents are skipped by hash rather than by name, so an invoice already in its drop directory is never fetched twice,
+whatever either copy is called. A ledger of every document fetched lets later runs skip them without a request at all.
+
+Variables:
+    - RETRY (Set[int]) : The HTTP statuses worth retrying, as the portal is busy or briefly failing.
+
+Functions:
+    - download_documents : Fetches every new document in a portal's manifest into a drop directory.
+    - mock_portal        : Builds a local stand-in portal that serves a folder of documents, failing on purpose.
+    - check_downloads    : Downloads the drop directories from a mock portal and compares every file with its source.
+'''
+
+RETRY   = {408, 429, 500, 502, 503, 504}
+
+r_range = compile(r"bytes=(\d+)-")
+
+async def _fetch(session  : aiohttp.ClientSession,
+                 document : Dict[str, Any],
+                 path     : str,
+                 retries  : int,
+                 backoff  : float) -> str:
+    '''
+    Downloads one document to a `.part` file beside `path`, which the caller only moves into place once it knows the
+    contents are new, so the ingest mode never reads a half-written file and nothing on disk is overwritten. Each retry
+    resumes the `.part` file with a `Range` request, and waits `backoff` seconds doubled on every attempt, with jitter,
+    or as long as the portal's `Retry-After` asks. Returns the hash of the completed `.part` file, and raises the last
+    error once every retry has failed.
+    '''
+
+    part = f"{path}.part"
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+
+    for attempt in range(retries + 1):
+        wait = backoff * 2 ** attempt * (1 + random.random())
+
+        try:
+            start   = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'Range': f"bytes={start}-"} if start else {}
+
+            async with session.get(document['url'], headers = headers) as response:
+
+                if response.status == 416: # The partial file is no longer a prefix of the document
+                    os.remove(part)
+                    raise aiohttp.ClientResponseError(response.request_info, (), status = 416,
+                                                      message = "Range not satisfiable")
+
+                if response.status in RETRY:
+                    wait = float(response.headers.get('Retry-After', "").strip() or 0) or wait
+                    raise aiohttp.ClientResponseError(response.request_info, (), status = response.status,
+                                                      message = response.reason)
+
+                response.raise_for_status() # Any other error, like a missing document, won't succeed on a retry
+
+                # A portal that ignores the range sends the whole document again, so the partial file starts over
+                with open(part, 'ab' if response.status == 206 else 'wb') as file:
+                    async for chunk in response.content.iter_chunked(1 << 16):
+                        file.write(chunk)
+
+            sha256 = hash_file(part)
+            if document.get('sha256') and document['sha256'] != sha256:
+                os.remove(part)
+                raise ValueError(f"Downloaded contents don't match the manifest's hash of {document['sha256']}")
+
+            return sha256
+
+        except aiohttp.ClientResponseError as e:
+            if e.status not in RETRY | {416} or attempt == retries:
+                raise
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            if attempt == retries:
+                raise
+
+        lg.warning(f"Retrying {document['name']} in {wait:.1f} seconds, after attempt {attempt + 1} of {retries + 1}.")
+        await asyncio.sleep(wait)
+
+async def _download(manifest    : str,
+                    dest        : str,
+                    concurrency : int,
+                    per_host    : int,
+                    retries     : int,
+                    backoff     : float,
+                    timeout     : float,
+                    headers     : Dict[str, str],
+                    ledger      : str) -> pd.DataFrame:
+    '''
+    Runs `download_documents` inside an event loop, so the mock portal in `check_downloads` can share it.
+    '''
+
+    dest    = os.path.normpath(os.path.join(find_project_root(), dest)) # Relative to the project root, unless absolute
+    entries = read_ledger(ledger)
+    lock    = asyncio.Lock()
+
+    # Every file already in the drop directory is known by its hash, whatever it's named
+    hashes  = {hash_file(file) for file in glob(os.path.join(dest, "**", "*"), recursive = True)
+                           if os.path.isfile(file) and not file.endswith(".part")}
+
+    connector = aiohttp.TCPConnector(limit = concurrency, limit_per_host = per_host)
+    timeouts  = aiohttp.ClientTimeout(total = None, sock_connect = timeout, sock_read = timeout)
+
+    async with aiohttp.ClientSession(connector = connector, timeout = timeouts, headers = headers) as session:
+
+        async with session.get(manifest) as response:
+            response.raise_for_status()
+            documents = await response.json()
+
+        async def fetch(document : Dict[str, Any]) -> Dict[str, Any]:
+            document = {**document, 'url': urljoin(manifest, document['url'])}
+            path     = os.path.normpath(os.path.join(dest, document['name']))
+            entry    = entries.get(document['url'], {})
+            report   = {'name': document['name'], 'file': path, 'bytes': 0, 'status': 'skipped', 'error': None}
+
+            # Names come from the portal, so none may write outside the drop directory
+            if os.path.commonpath([dest, path]) != dest:
+                return report | {'status': 'failed', 'error': "The document's name leads outside the drop directory"}
+
+            # Documents whose contents are already on disk aren't requested at all
+            if document.get('sha256', entry.get('sha256')) in hashes:
+                return report
+
+            try:
+                sha256 = await _fetch(session, document, path, retries, backoff)
+
+            except Exception as e:
+                lg.error(f"Couldn't download {document['name']}: {e}\n")
+                return report | {'status': 'failed', 'error': str(e) or type(e).__name__}
+
+            # Decide what the download is before it's moved into place, so no file on disk is ever replaced
+            async with lock:
+                if sha256 in hashes: # Only known once downloaded, when the portal publishes no hashes
+                    os.remove(f"{path}.part")
+                    report['status'] = 'duplicate'
+
+                elif os.path.exists(path):
+                    os.remove(f"{path}.part")
+                    return report | {'status': 'failed', 'error': "A different file is already in place under this name"}
+
+                else:
+                    os.replace(f"{path}.part", path)
+                    hashes.add(sha256)
+                    report['status'] = 'fetched'
+
+                entries[document['url']] = {'name'    : document['name'],
+                                            'sha256'  : sha256,
+                                            'fetched' : time.strftime('%Y-%m-%d %H:%M:%S')}
+
+            return report | {'bytes': os.path.getsize(path) if report['status'] == 'fetched' else 0}
+
+        lg.info(f"Fetching {len(documents)} documents from {manifest}, {concurrency} at a time.")
+        reports = await asyncio.gather(*[fetch(document) for document in documents])
+
+    write_ledger(ledger, entries)
+
+    return pd.DataFrame(reports, columns = ['name', 'file', 'bytes', 'status', 'error'])
+
+def download_documents(manifest    : str,
+                       source      : str            = 'cmp_bills',
+                       dest        : str            = None,
+                       concurrency : int            = 16,
+                       per_host    : int            = 8,
+                       retries     : int            = 5,
+                       backoff     : float          = 0.5,
+                       timeout     : float          = 60.0,
+                       headers     : Dict[str, str] = None,
+                       ledger      : str            = './data/downloads/ledger.json') -> pd.DataFrame:
+    '''
+    Fetches every new document in a portal's manifest into a drop directory, concurrently over one pooled session.
+    Fetching hundreds of bills one at a time spends nearly all of its time waiting on the network, so running many
+    requests at once cuts onboarding a client's history from the sum of every request's latency to a few of them.
+
+    Methodology:
+        1. Hash every file already in the drop directory, and read the ledger of documents fetched by earlier runs.
+        2. Read the manifest, a JSON list of documents with a `url` (absolute, or relative to the manifest), the `name`
+           to save it under in the drop directory, and optionally the `sha256` of its contents.
+        3. Skip every document whose hash, from the manifest or the ledger, matches a file already on disk.
+        4. Fetch the rest over one session capped at `concurrency` connections, and `per_host` to any one host.
+           Timeouts, dropped connections and busy or failing portals (408, 429 and 5xx) are retried up to `retries`
+           times with exponential backoff, each retry resuming the partial download with a `Range` request.
+        5. Check each download against the manifest's hash where there is one, and only then decide what it is.
+           Downloads whose contents turn out to be on disk already are removed as duplicates, and ones whose name is
+           taken by a different file are removed and reported as failed. Only new contents are moved into place, so
+           no file already in the drop directory is ever overwritten.
+        6. Record each document's hash in the ledger.
+
+    Parameters:
+        manifest    (str)            : URL of the portal's JSON manifest of documents.
+        source      (str)            : The drop directory in the ingest mode's `SOURCES` to fetch into. Defaults to
+                                       'cmp_bills'.
+        dest        (str)            : A directory to fetch into instead of the source's. Defaults to None.
+        concurrency (int)            : The most connections open at once. Defaults to 16.
+        per_host    (int)            : The most connections open to any one host, to stay within a portal's rate
+                                       limits. Defaults to 8.
+        retries     (int)            : Retries for each document before it's reported as failed. Defaults to 5.
+        backoff     (float)          : Seconds waited before the first retry, doubled on each after. Defaults to 0.5.
+        timeout     (float)          : Seconds to wait for a connection, or for the next bytes of a download, before
+                                       retrying. Defaults to 60.
+        headers     (Dict[str, str]) : Headers sent with every request, such as a portal's session cookie or token.
+                                       Defaults to None.
+        ledger      (str)            : Path to the JSON ledger of documents fetched. Defaults to
+                                       './data/downloads/ledger.json'.
+
+    Returns:
+        pd.DataFrame: One row per document with its `file`, the `bytes` downloaded, its `status` ('fetched', 'skipped',
+                      'duplicate' or 'failed') and any `error`.
+    '''
+
+    return asyncio.run(_download(manifest    = manifest,
+                                 dest        = dest or SOURCES[source]['raw'],
+                                 concurrency = concurrency,
+                                 per_host    = per_host,
+                                 retries     = retries,
+                                 backoff     = backoff,
+                                 timeout     = timeout,
+                                 headers     = headers,
+                                 ledger      = ledger))
+
+def mock_portal(folder : str,
+                flaky  : int   = 3,
+                delay  : float = 0.05,
+                hashes : bool  = True) -> web.Application:
+    '''
+    Builds a local stand-in for a utility or supplier portal, serving every file in a folder at `/files/{name}` with
+    support for `Range` requests, and their manifest at `/manifest.json`. It misbehaves the way real portals do, so
+    the downloader's retries and resumes are exercised without a network.
+
+    Parameters:
+        folder (str)   : The folder of documents to serve.
+        flaky  (int)   : Every `flaky`-th document answers its first request with a 503 and its second by dropping the
+                         connection halfway through, before serving it whole. Defaults to 3.
+        delay  (float) : Seconds every request waits before it's answered, standing in for network latency. Defaults
+                         to 0.05.
+        hashes (bool)  : Whether the manifest publishes the `sha256` of each document, as not every portal does.
+                         Defaults to True.
+
+    Returns:
+        web.Application: The portal, ready to run with `web.AppRunner`.
+    '''
+
+    files    = sorted(os.path.relpath(file, folder) for file in glob(os.path.join(folder, "**", "*"), recursive = True)
+                      if os.path.isfile(file))
+    attempts = {name: 0 for name in files}
+
+    async def manifest(request : web.Request) -> web.Response:
+        return web.json_response([{'url'  : f"files/{name}",
+                                   'name' : name} | ({'sha256' : hash_file(os.path.join(folder, name))} if hashes else {})
+                                  for name in files])
+
+    async def document(request : web.Request) -> web.StreamResponse:
+        name = request.match_info['name']
+        if name not in attempts:
+            raise web.HTTPNotFound()
+
+        await asyncio.sleep(delay)
+        attempts[name] += 1
+        flaky_file      = flaky and files.index(name) % flaky == 0
+
+        if flaky_file and attempts[name] == 1:
+            raise web.HTTPServiceUnavailable(headers = {'Retry-After': "0.1"})
+
+        with open(os.path.join(folder, name), 'rb') as file:
+            body = file.read()
+
+        match    = r_range.fullmatch(request.headers.get('Range', ""))
+        start    = int(match.group(1)) if match else 0
+        if start >= len(body) and start:
+            raise web.HTTPRequestRangeNotSatisfiable()
+
+        response = web.StreamResponse(status = 206 if match else 200)
+        response.content_length = len(body) - start
+        if match:
+            response.headers['Content-Range'] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+
+        await response.prepare(request)
+
+        # Drop the connection halfway through, so the next request has to resume
+        if flaky_file and attempts[name] == 2:
+            await response.write(body[start:(start + len(body)) // 2])
+            request.transport.close()
+            return response
+
+        await response.write(body[start:])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.add_routes([web.get("/manifest.json", manifest),
+                    web.get("/files/{name:.+}", document)])
+
+    return app
+
+def check_downloads(sources     : List[str] = ['cmp_bills', 'ampion_bills'],
+                    concurrency : int       = 16,
+                    delay       : float     = 0.05) -> pd.DataFrame:
+    '''
+    Serves the drop directories from a local mock portal, downloads them into a temporary directory, and compares every
+    file with its source, so the downloader can be checked without a real portal or a network. Each source is served
+    twice, once with a manifest that publishes hashes and once with one that doesn't.
+
+    Methodology:
+        1. Serve each source's drop directory with `mock_portal`, so a third of its documents fail once and drop their
+           connection once before they're served.
+        2. Download every document with `download_documents` into a temporary directory, with a seeded partial file for
+           one document to resume, a renamed copy of another and a hand-placed copy of a third under its own name
+           already in place, and a different hand-placed file under a fourth's name, which must never be overwritten.
+        3. Download again with the same ledger, which should fetch nothing.
+        4. Compare the hash of every file downloaded against its source, check every file skipped or found to be a
+           duplicate is still on disk, and check the hand-placed file under another's name is untouched.
+
+    Parameters:
+        sources     (List[str]) : The sources in `SOURCES` whose drop directories are served.
+                                  Defaults to ['cmp_bills', 'ampion_bills'].
+        concurrency (int)       : The most connections open at once. Defaults to 16.
+        delay       (float)     : Seconds the portal waits before answering each request. Defaults to 0.05.
+
+    Returns:
+        pd.DataFrame: One row per document and manifest with its `source`, the `status` of the first and second runs,
+                      and whether the drop directory ends up with the right contents, in `match`.
+    '''
+
+    async def run(source : str,
+                  folder : str,
+                  hashes : bool) -> pd.DataFrame:
+        manifest = 'hashed' if hashes else 'hashless'
+        raw      = find_project_root(SOURCES[source]['raw'])
+        dest     = os.path.join(folder, source, manifest)
+        ledger   = os.path.join(folder, f"{source}_{manifest}.json")
+        files  = sorted(os.path.relpath(file, raw) for file in glob(os.path.join(raw, "**", "*"), recursive = True)
+                        if os.path.isfile(file))
+
+        # Step 1: Serve the drop directory
+        runner = web.AppRunner(mock_portal(raw, delay = delay, hashes = hashes), access_log = None)
+        await runner.setup()
+        site   = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port   = runner.addresses[0][1]
+
+        try:
+            # Step 2: Download it, resuming one document, with copies of others and a different file already in place
+            for name in files[:3]:
+                os.makedirs(os.path.dirname(os.path.join(dest, name)), exist_ok = True)
+
+            with open(os.path.join(raw, files[0]), 'rb') as file:
+                head = file.read()[:1000]
+            with open(os.path.join(dest, f"{files[0]}.part"), 'wb') as file:
+                file.write(head)
+            with open(os.path.join(dest, files[2]), 'w') as file:
+                file.write("A hand-placed file that isn't the portal's")
+
+            copy2(os.path.join(raw, files[-1]), os.path.join(dest, "renamed_copy"))
+            copy2(os.path.join(raw, files[1]),  os.path.join(dest, files[1]))
+            placed = {name: hash_file(os.path.join(dest, name)) for name in files[1:3]}
+
+            settings = {'manifest'    : f"http://127.0.0.1:{port}/manifest.json",
+                        'dest'        : dest,
+                        'concurrency' : concurrency,
+                        'per_host'    : concurrency,
+                        'retries'     : 5,
+                        'backoff'     : 0.1,
+                        'timeout'     : 10.0,
+                        'headers'     : None,
+                        'ledger'      : ledger}
+
+            start  = time.perf_counter()
+            first  = await _download(**settings)
+            kept   = {name: os.path.exists(os.path.join(dest, name)) and hash_file(os.path.join(dest, name)) == sha256
+                      for name, sha256 in placed.items()}
+            lg.info(f"Downloaded {(first['status'] == 'fetched').sum()} of {len(first)} documents for {source} in "
+                    f"{time.perf_counter() - start:.1f} seconds.")
+
+            # Step 3: Download again, which should fetch nothing
+            second = await _download(**settings)
+
+        finally:
+            await runner.cleanup()
+
+        # Step 4: Compare every file with its source, and check the hand-placed files survived both runs untouched
+        on_disk = {hash_file(file) for file in glob(os.path.join(dest, "**", "*"), recursive = True)
+                               if os.path.isfile(file) and not file.endswith(".part")}
+        report  = first[['name', 'status']].merge(second[['name', 'status']], on = 'name', suffixes = ('_first', '_second'))
+
+        report['match'] = [kept[name] and hash_file(os.path.join(dest, name)) == placed[name] if name in placed else
+                           os.path.exists(os.path.join(dest, name)) and
+                           hash_file(os.path.join(dest, name)) == hash_file(os.path.join(raw, name)) if status == 'fetched' else
+                           hash_file(os.path.join(raw, name)) in on_disk # Skipped or duplicate, so on disk under some name
+                           for name, status in zip(report['name'], report['status_first'])]
+
+        return report.assign(source = source, manifest = manifest)
+
+    folder = mkdtemp()
+
+    try:
+        report = pd.concat([asyncio.run(run(source, folder, hashes)) for source in sources for hashes in [True, False]],
+                           ignore_index = True)
+
+        lg.info(f"Downloads matched {report['match'].sum()} of {len(report)} documents, and the second run fetched "
+                f"{(report['status_second'] == 'fetched').sum()}.\n")
+
+        return report[['source', 'manifest', 'name', 'status_first', 'status_second', 'match']]
+
+    finally:
+        rmtree(folder, ignore_errors = True)
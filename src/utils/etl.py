@@ -2,6 +2,7 @@ from glob           import glob
 from utils.curation import *
 from utils.modeling import *
 from utils.runtime  import connect_to_db, find_project_root
+from utils.slots    import build_slots
 
 import os
 
@@ -20,17 +21,19 @@ Workflow Summary
 5. Removing Pickles     : Deletes any existing pickle files for model persistence, assuming they will now be outdated.
 
 Raw Data Scraping
-  • scrape_cmp_bills
-      Retrieves raw billing data from Central Maine Power (CMP). This includes details like billing periods, amounts, and 
-      associated account information.
-  • scrape_ampion_bills
-      Gathers raw billing data from Ampion, focusing on renewable energy credits and related billing details.
+  • scrape_bills
+      Routes every bill PDF to the parser for its format in `PARSERS`, and reports any bill that couldn't be parsed.
+      - Central Maine Power (CMP) bills include details like billing periods, amounts, and associated account information.
+      - Ampion bills focus on renewable energy credits and related billing details.
 
 Data Curation
   • write_results(load_data_files)
       A two-step process that first loads raw data files from specified paths and then writes this data into a curated 
       format. The curation process includes filtering, cleaning, and structuring data into a format that's more conducive 
       to analysis. It's applied to various datasets like meter usage, locations, and the bills from CMP and Ampion.
+  • build_slots
+      Writes the curated meter usage into a dense, memory-mapped store of one float32 array per meter and channel, 
+      indexed by 15-minute slot, for analyses that reduce over time rather than group rows.
 
 Data Modeling
   • model_dim_datetimes
@@ -51,53 +54,71 @@ These functions and sections collectively form the backbone of the Electric Brew
 is accurately extracted, transformed, and loaded for effective analysis and reporting.
 '''
 
-# RAW DATA SCRAPING (`/raw/parquet/`)
+def main():
+    '''
+    Runs every stage of the pipeline in order. It's only called when this file is run as a script, since the fact table's
+    spawned workers re-import it, and would otherwise run the whole pipeline again in every worker.
+    '''
 
-scrape_cmp_bills()
-scrape_ampion_bills()
+    # RAW DATA SCRAPING (`/raw/parquet/`)
 
+    scrape_bills()
 
-# DATA CURATION (`/curated/`)
 
-# CMP meter usage data
-write_results(
-    load_data_files(path = "./data/cmp/raw/meter_usage",
-                    cols = ["account_number", "service_point_id", "meter_id", "interval_end_datetime", "meter_channel", "kwh"]),
-                    dest = "./data/cmp/curated/meter_usage")
+    # DATA CURATION (`/curated/`)
 
-# CMP location data
-write_results(
-    load_data_files(path = "./data/cmp/raw/locations"),
-                    dest = "./data/cmp/curated/locations")
+    # CMP meter usage data
+    write_results(
+        load_data_files(path = "./data/cmp/raw/meter_usage",
+                        cols = ["account_number", "service_point_id", "meter_id", "interval_end_datetime", "meter_channel", "kwh"]),
+                        dest   = "./data/cmp/curated/meter_usage",
+                        schema = "meter_usage")
 
-# CMP billing data
-write_results(
-    load_data_files(path = "./data/cmp/raw/bills/parquet",
-                    type = 'parquet'),
-                    dest = "./data/cmp/curated/bills")
+    # CMP meter usage as dense 15-minute slots
+    build_slots()
 
-# Ampion billing data
-write_results(
-    load_data_files(path = "./data/ampion/raw/parquet", 
-                    type = 'parquet'), 
-                    dest = "./data/ampion/curated")
+    # CMP location data
+    write_results(
+        load_data_files(path = "./data/cmp/raw/locations"),
+                        dest   = "./data/cmp/curated/locations",
+                        schema = "locations")
 
+    # CMP billing data
+    write_results(
+        load_data_files(path = "./data/cmp/raw/bills/parquet",
+                        type = 'parquet'),
+                        dest   = "./data/cmp/curated/bills",
+                        schema = "cmp_bills")
 
-# DATA MODELING (`/modeled/`)
+    # Ampion billing data
+    write_results(
+        load_data_files(path = "./data/ampion/raw/parquet", 
+                        type = 'parquet'), 
+                        dest   = "./data/ampion/curated",
+                        schema = "ampion_bills")
 
-model_dim_datetimes()
-model_dim_meters()
-model_dim_bills()
-model_fct_electric_brew()
 
+    # DATA MODELING (`/modeled/`)
 
-# DATABASE INTEGRATION (`/sql/`)
+    model_dim_datetimes()
+    model_dim_meters()
+    model_dim_bills()
+    model_fct_electric_brew()
 
-connect_to_db()
 
+    # DATABASE INTEGRATION (`/sql/`)
 
-# REMOVING PICKLES
+    connect_to_db()
 
-pkl_files = glob(os.path.join(find_project_root(), "**", "*.pkl"), recursive = True)
-for file in pkl_files:
-    os.remove(file)
\ No newline at end of file
+
+    # REMOVING PICKLES (and the feature matrices memory-mapped alongside them)
+
+    pkl_files = glob(os.path.join(find_project_root(), "**", "*.pkl"), recursive = True) + \
+                glob(os.path.join(find_project_root(), "**", "pickled", "*.npy"), recursive = True)
+    for file in pkl_files:
+        os.remove(file)
+
+
+if __name__ == "__main__":
+
+    main()
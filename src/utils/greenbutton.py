@@ -0,0 +1,269 @@
+from re        import compile
+from typing    import Any, Dict, Iterator, List, Tuple
+from xml.etree import ElementTree as ET
+
+import numpy  as np
+import pandas as pd
+
+'''
+Contains a streaming reader for Green Button (ESPI) XML downloads of interval data, and a writer that produces the same
+format from `meter_usage` records, so the reader can be checked against files generated locally.
+
+A Green Button download is an Atom feed whose entries each hold one ESPI resource. A `UsagePoint` is a metered service,
+its `MeterReading` links to the `ReadingType` that gives the unit and scale of its values, and its `IntervalBlock`s hold
+the readings themselves, each a start time in UTC seconds, a duration, and a value. Multi-year downloads run to
+gigabytes, so the reader parses one entry at a time with `iterparse` and discards it once read, emitting records in
+batches instead of building the whole document.
+
+Variables:
+    - ATOM    (str)       : The Atom namespace, as ElementTree prefixes tags with it.
+    - ESPI    (str)       : The ESPI namespace, as ElementTree prefixes tags with it.
+    - COLUMNS (List[str]) : The columns of `meter_usage`, in the order `load_data_files` reads them from CMP's CSVs.
+
+Functions:
+    - iter_green_button  : Streams a Green Button file as batches of `meter_usage` records.
+    - write_green_button : Writes `meter_usage` records to a Green Button file.
+'''
+
+ATOM    = "{http://www.w3.org/2005/Atom}"
+ESPI    = "{http://naesb.org/espi}"
+COLUMNS = ["account_number", "service_point_id", "meter_id", "interval_end_datetime", "meter_channel", "kwh"]
+
+# Resources are tied together by the paths in their links, e.g. `.../UsagePoint/1/MeterReading/01/IntervalBlock/173`
+r_usage_point   = compile(r"/UsagePoint/([^/]+)")
+r_meter_reading = compile(r"/UsagePoint/[^/]+/MeterReading/[^/]+")
+r_reading_type  = compile(r"/ReadingType/[^/]+")
+
+def _href(entry : ET.Element,
+          rel   : str) -> List[str]:
+    '''
+    Returns the targets of an Atom entry's links of one relation ('self', 'up' or 'related').
+    '''
+
+    return [link.get('href', "") for link in entry.findall(f"{ATOM}link") if link.get('rel') == rel]
+
+def _kwh_scale(reading_type : ET.Element) -> float:
+    '''
+    Returns the factor that converts a `ReadingType`'s values to kWh, or None if its readings aren't energy delivered to
+    the customer (in Wh, unit code 72, flowing forward or in an unspecified direction), like CMP's kWh channel.
+    '''
+
+    uom  = reading_type.findtext(f"{ESPI}uom")
+    flow = reading_type.findtext(f"{ESPI}flowDirection")
+
+    if uom != "72" or flow not in (None, "1"):
+        return None
+
+    return 10.0 ** int(reading_type.findtext(f"{ESPI}powerOfTenMultiplier") or 0) / 1000
+
+def _format_local(seconds  : np.ndarray,
+                  timezone : str) -> pd.Series:
+    '''
+    Formats UTC seconds as local times the way CMP's CSVs write `interval_end_datetime` (e.g. '10/1/2022 1:15:00 AM'),
+    without the zero-padding `strftime` adds to months, days and hours.
+    '''
+
+    local = pd.Series(pd.to_datetime(seconds, unit = 's', utc = True)).dt.tz_convert(timezone)
+
+    return local.dt.strftime('%m/%d/%Y %I:%M:%S %p').str.replace(r"^0|(?<=/)0|(?<= )0", "", regex = True)
+
+def _to_records(blocks       : List[Tuple[str, np.ndarray, np.ndarray]],
+                usage_points : Dict[str, Dict[str, Any]],
+                timezone     : str) -> pd.DataFrame:
+    '''
+    Turns parsed interval blocks (a usage point, end times in UTC seconds, and kWh) into `meter_usage` records, with each
+    usage point's identifiers from `usage_points`.
+    '''
+
+    ids  = np.concatenate([np.repeat(usage_point, len(ends)) for usage_point, ends, _ in blocks])
+    ends = np.concatenate([ends for _, ends, _ in blocks])
+    kwh  = np.concatenate([kwh  for _, _, kwh  in blocks])
+
+    meters = pd.DataFrame.from_dict(usage_points, orient = 'index')
+
+    return meters.loc[ids].reset_index(drop = True) \
+                 .assign(interval_end_datetime = _format_local(ends, timezone),
+                         kwh                   = kwh)[COLUMNS]
+
+def iter_green_button(file         : str,
+                      usage_points : Dict[str, Dict[str, Any]],
+                      batch_size   : int = 100_000,
+                      timezone     : str = 'America/New_York') -> Iterator[pd.DataFrame]:
+    '''
+    Streams a Green Button (ESPI) XML file as batches of `meter_usage` records, holding no more than one Atom entry and
+    one batch of records in memory at a time.
+
+    Methodology:
+        1. Parse the feed with `iterparse`, acting on each entry once it's complete and clearing it from the tree after.
+        2. Remember which `ReadingType` each `MeterReading` links to, and the scale to kWh of each `ReadingType`. These
+           are a few entries per usage point, so they're kept for the whole file.
+        3. Read the start, duration and value of every reading in each `IntervalBlock`, and scale the values to kWh.
+           Feeds normally list a reading's `ReadingType` before its blocks. If one hasn't arrived yet, its blocks wait for
+           it, and a `ReadingType` that never arrives raises a ValueError.
+        4. Skip usage points missing from `usage_points` and readings that aren't kWh delivered, logging neither as an
+           error since Green Button downloads often include services and channels CMP's exports don't.
+        5. Emit the readings as records with `meter_usage`'s columns whenever `batch_size` have accumulated, with each
+           interval's end formatted in local time like CMP's CSVs.
+
+    Parameters:
+        file         (str)                       : Path to the Green Button XML file.
+        usage_points (Dict[str, Dict[str, Any]]) : Maps each `UsagePoint` id in the feed (the segment after
+                                                   `UsagePoint/` in its links) to its `account_number`,
+                                                   `service_point_id`, `meter_id` and `meter_channel`.
+        batch_size   (int)                       : The number of readings in each batch. Defaults to 100,000.
+        timezone     (str)                       : The time zone of the local times written. Defaults to
+                                                   'America/New_York', where every meter is.
+
+    Yields:
+        pd.DataFrame: Batches of records with the columns of `meter_usage`.
+    '''
+
+    meter_readings = {} # MeterReading path -> ReadingType path
+    scales         = {} # ReadingType path  -> factor to kWh, or None if its readings are skipped
+    waiting        = {} # ReadingType path  -> blocks read before it arrived
+    batch, size    = [], 0
+
+    # Step 1: Parse the feed one entry at a time, holding on to its root so finished entries can be cleared from it
+    events  = ET.iterparse(file, events = ('start', 'end'))
+    _, root = next(events)
+
+    for event, entry in events:
+        if event != 'end' or entry.tag != f"{ATOM}entry":
+            continue
+
+        content  = entry.find(f"{ATOM}content")
+        resource = content[0] if content is not None and len(content) else None
+        links    = _href(entry, 'self') + _href(entry, 'up')
+
+        # Step 2: Record how each meter reading is scaled
+        if resource is None:
+            pass
+
+        elif resource.tag == f"{ESPI}MeterReading":
+            related = [r_reading_type.search(href) for href in _href(entry, 'related')]
+            reading = next((r_meter_reading.search(href) for href in links if r_meter_reading.search(href)), None)
+            if reading:
+                meter_readings[reading.group()] = next((match.group() for match in related if match), None)
+
+        elif resource.tag == f"{ESPI}ReadingType":
+            reading_type = next((r_reading_type.search(href).group() for href in links if r_reading_type.search(href)), None)
+            scales[reading_type] = _kwh_scale(resource)
+
+            for usage_point, ends, values in waiting.pop(reading_type, []):
+                if scales[reading_type]:
+                    batch.append((usage_point, ends, values * scales[reading_type]))
+                    size += len(ends)
+
+        # Step 3: Read every reading in the block, as end times in UTC seconds and raw values
+        elif resource.tag == f"{ESPI}IntervalBlock":
+            usage_point  = next((r_usage_point.search(href).group(1) for href in links if r_usage_point.search(href)), None)
+            reading      = next((r_meter_reading.search(href).group() for href in links if r_meter_reading.search(href)), None)
+            reading_type = meter_readings.get(reading)
+
+            # Step 4: Skip usage points that aren't mapped to a meter, and readings that aren't kWh delivered
+            if usage_point in usage_points and scales.get(reading_type, 0) is not None:
+                readings = resource.findall(f"{ESPI}IntervalReading")
+                ends     = np.array([int(r.findtext(f"{ESPI}timePeriod/{ESPI}start")) +
+                                     int(r.findtext(f"{ESPI}timePeriod/{ESPI}duration")) for r in readings], dtype = np.int64)
+                values   = np.array([float(r.findtext(f"{ESPI}value")) for r in readings])
+
+                if reading_type in scales:
+                    batch.append((usage_point, ends, values * scales[reading_type]))
+                    size += len(ends)
+                else:
+                    waiting.setdefault(reading_type, []).append((usage_point, ends, values))
+
+        root.clear() # Drops the finished entry, and any feed-level elements before it
+
+        # Step 5: Emit a batch once it's full
+        if size >= batch_size:
+            yield _to_records(batch, usage_points, timezone)
+            batch, size = [], 0
+
+    if waiting:
+        raise ValueError(f"`{file}` has interval blocks for reading types it never defines: {list(waiting)}")
+
+    if batch:
+        yield _to_records(batch, usage_points, timezone)
+
+def _entry(feed     : ET.Element,
+           href     : str,
+           resource : str,
+           related  : str = None) -> ET.Element:
+    '''
+    Appends an Atom entry to a feed, linked to itself and optionally to a related resource, and returns the empty ESPI
+    resource inside its content.
+    '''
+
+    element = ET.SubElement(feed, f"{ATOM}entry")
+    ET.SubElement(element, f"{ATOM}link", rel = 'self', href = href)
+
+    if related:
+        ET.SubElement(element, f"{ATOM}link", rel = 'related', href = related)
+
+    return ET.SubElement(ET.SubElement(element, f"{ATOM}content"), f"{ESPI}{resource}")
+
+def write_green_button(data     : pd.DataFrame,
+                       file     : str,
+                       timezone : str = 'America/New_York') -> pd.DataFrame:
+    '''
+    Writes `meter_usage` records to a Green Button (ESPI) XML file, with one `UsagePoint` per service point, one
+    `MeterReading` and `ReadingType` (Wh, delivered) each, and an `IntervalBlock` per day of readings. Files written
+    here are how `iter_green_button` is checked without a utility's download at hand.
+
+    Methodology:
+        1. Convert each interval's local end time to UTC seconds. Times the spring-forward hour skips (e.g. 2:00 AM)
+           can't be placed in UTC, so their records are left out. Repeated fall-back times are read as standard time.
+        2. Take each interval's duration from the gap to the meter's next reading, or the previous gap for its last.
+        3. Write the feed, with readings as whole Wh, entry by entry.
+
+    Parameters:
+        data     (pd.DataFrame) : Records with the columns of `meter_usage`.
+        file     (str)          : Path of the XML file to write.
+        timezone (str)          : The time zone of the records' local times. Defaults to 'America/New_York'.
+
+    Returns:
+        pd.DataFrame: The records written, which are all of `data` but those at times that don't exist locally.
+    '''
+
+    # Step 1: Place each local end time in UTC, dropping those the spring-forward hour skips
+    local = pd.to_datetime(data['interval_end_datetime'].astype(str), format = '%m/%d/%Y %I:%M:%S %p')
+    utc   = local.dt.tz_localize(timezone, ambiguous = False, nonexistent = 'NaT')
+    kept  = utc.notna().values
+    data  = data[kept].assign(end = utc[kept].astype('int64').values // 10**9) \
+                      .sort_values(['service_point_id', 'end'], kind = 'stable')
+
+    # Step 2: Infer each interval's duration from the gap to the next one
+    gaps          = data.groupby('service_point_id', observed = True)['end'].diff(-1).abs()
+    data['start'] = data['end'] - gaps.fillna(gaps.groupby(data['service_point_id'], observed = True).ffill()) \
+                                      .fillna(900).astype('int64')
+
+    # Step 3: Write the feed entry by entry
+    feed = ET.Element(f"{ATOM}feed")
+    base = "https://example.invalid/espi/1_1/resource/Subscription/1"
+
+    for service_point_id, readings in data.groupby('service_point_id', observed = True):
+        usage_point = f"{base}/UsagePoint/{service_point_id}"
+        reading     = f"{usage_point}/MeterReading/1"
+        _entry(feed, usage_point, 'UsagePoint')
+        _entry(feed, reading,     'MeterReading', related = f"{base}/ReadingType/{service_point_id}")
+
+        reading_type = _entry(feed, f"{base}/ReadingType/{service_point_id}", 'ReadingType')
+        for tag, value in [('flowDirection', "1"), ('powerOfTenMultiplier', "0"), ('uom', "72")]:
+            ET.SubElement(reading_type, f"{ESPI}{tag}").text = value
+
+        days = pd.to_datetime(readings['start'], unit = 's').dt.date
+        for number, (_, day) in enumerate(readings.groupby(days.values)):
+            block = _entry(feed, f"{reading}/IntervalBlock/{number}", 'IntervalBlock')
+            for start, end, kwh in zip(day['start'], day['end'], day['kwh']):
+                interval = ET.SubElement(block, f"{ESPI}IntervalReading")
+                period   = ET.SubElement(interval, f"{ESPI}timePeriod")
+                ET.SubElement(period,   f"{ESPI}duration").text = str(end - start)
+                ET.SubElement(period,   f"{ESPI}start").text    = str(start)
+                ET.SubElement(interval, f"{ESPI}value").text    = str(round(float(kwh) * 1000))
+
+    ET.register_namespace('', ATOM[1:-1])
+    ET.register_namespace('espi', ESPI[1:-1])
+    ET.ElementTree(feed).write(file, encoding = 'utf-8', xml_declaration = True)
+
+    return data.drop(columns = ['end', 'start'])
@@ -0,0 +1,399 @@
+from concurrent.futures import ProcessPoolExecutor
+from glob               import glob
+from shutil             import rmtree
+from tempfile           import mkdtemp
+from typing             import Any, Dict, List, Set
+from utils.curation     import load_data_files, scrape_bills, write_results
+from utils.parsers      import FIELDS, PARSERS
+from utils.runtime      import connect_to_db, find_project_root, hash_file, read_ledger, write_ledger
+from utils.schemas      import apply_schema
+
+import os
+import time
+import logging          as lg
+import multiprocessing  as mp
+import pandas           as pd
+import pyarrow.parquet  as pq
+
+lg.basicConfig(level  = lg.INFO,
+               format = '%(asctime)s | %(levelname)s | %(message)s')
+
+'''
+Contains a long-running ingest mode that watches the raw drop directories and brings new files into the curated and
+modeled datasets in micro-batches, so dashboards stay current without re-running the whole ETL pipeline every time a
+file lands.
+
+Every file is recorded in a JSON ledger with the hash of its contents, so a file is ingested once however many times
+the watcher sees it, copies of a file already ingested are skipped, and a stopped watcher picks up where it left off.
+Curation is incremental: new meter readings are merged into the account partitions they belong to, and new bills are
+appended to their format's records. The modeled tables a batch affects are rebuilt in a fresh process, so the
+long-running watcher never holds the tables a rebuild reads, and their DuckDB views are refreshed.
+
+Variables:
+    - SOURCES (Dict[str, Dict[str, Any]]) : Maps each kind of raw file to where it lands, how it's curated, and the
+                                            modeled tables built from it.
+    - MODELS  (List[List[str]])           : The modeled tables in build stages. Each stage reads the tables of the last,
+                                            so each runs in its own process.
+
+Functions:
+    - find_new_files : Lists the files in the drop directories that the ledger hasn't seen in their current state.
+    - ingest_batch   : Curates a micro-batch of new files, appending them to the curated datasets.
+    - refresh_models : Rebuilds modeled tables in fresh processes and refreshes their DuckDB views.
+    - watch          : Polls the drop directories and ingests new files in micro-batches until stopped.
+'''
+
+SOURCES = {'meter_usage'  : {'raw'     : './data/cmp/raw/meter_usage',
+                             'type'    : 'csv',
+                             'cols'    : ["account_number", "service_point_id", "meter_id",
+                                          "interval_end_datetime", "meter_channel", "kwh"],
+                             'curated' : './data/cmp/curated/meter_usage',
+                             'models'  : ['dim_datetimes', 'dim_meters', 'fct_electric_brew']},
+
+           'cmp_bills'    : {'raw'     : PARSERS['cmp']['raw'],
+                             'type'    : 'pdf',
+                             'format'  : 'cmp',
+                             'curated' : './data/cmp/curated/bills',
+                             'models'  : ['dim_bills', 'fct_electric_brew']},
+
+           'ampion_bills' : {'raw'     : PARSERS['ampion']['raw'],
+                             'type'    : 'pdf',
+                             'format'  : 'ampion',
+                             'curated' : './data/ampion/curated',
+                             'models'  : ['dim_bills', 'fct_electric_brew']}}
+
+MODELS  = [['dim_datetimes', 'dim_meters', 'dim_bills'],
+           ['fct_electric_brew']]
+
+def find_new_files(entries : Dict[str, Dict[str, Any]],
+                   settle  : float = 5.0) -> List[Dict[str, Any]]:
+    '''
+    Lists the files in every drop directory in `SOURCES` that the ledger hasn't seen in their current state, oldest
+    first. Only sizes and modification times are compared here, so a scan stays cheap however large the backlog is.
+
+    Parameters:
+        entries (Dict[str, Dict[str, Any]]) : The ledger, keyed by each file's path from the project root.
+        settle  (float)                     : Seconds a file must go unmodified before it's picked up, so files still
+                                              being copied in aren't read half-written. Defaults to 5.
+
+    Returns:
+        List[Dict[str, Any]]: Each new or changed file's `file` path, `key` in the ledger, `source`, `size` and
+                              `mtime_ns`.
+    '''
+
+    found = []
+    now   = time.time()
+
+    for source, spec in SOURCES.items():
+        for file in glob(os.path.join(find_project_root(spec['raw']), "**", f"*.{spec['type']}"), recursive = True):
+
+            stat  = os.stat(file)
+            key   = os.path.relpath(file, find_project_root())
+            entry = entries.get(key, {})
+
+            if (entry.get('size'), entry.get('mtime_ns')) == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            if now - stat.st_mtime < settle:
+                continue
+
+            found.append({'file'     : file,
+                          'key'      : key,
+                          'source'   : source,
+                          'size'     : stat.st_size,
+                          'mtime_ns' : stat.st_mtime_ns})
+
+    return sorted(found, key = lambda candidate: candidate['mtime_ns'])
+
+def _merge_partitions(records : pd.DataFrame,
+                      dest    : str,
+                      schema  : str):
+    '''
+    Merges new records into the `account_number` partitions of a curated dataset, rewriting only the partitions they
+    touch. Records already present are dropped, so re-exported or overlapping files don't duplicate readings.
+    '''
+
+    for account_number, rows in records.groupby('account_number', observed = True):
+
+        partition = os.path.join(dest, f"account_number={account_number}")
+        existing  = [pq.read_table(partition).to_pandas()] if os.path.exists(partition) else []
+        combined  = pd.concat(existing + [rows.drop(columns = 'account_number')], ignore_index = True) \
+                      .pipe(apply_schema, schema) \
+                      .drop_duplicates(ignore_index = True)
+
+        write_results(data         = combined,
+                      dest         = partition,
+                      partition_by = None,
+                      schema       = schema)
+
+def _bill_keys(bills : Any) -> pd.Series:
+    '''
+    Joins each bill record's natural key, every field in `FIELDS` but the file it came from, into a single string, for
+    a DataFrame of records or the path of a curated bills table, of which only the key columns are read.
+    '''
+
+    keys = FIELDS[1:]
+
+    if isinstance(bills, str):
+        path  = find_project_root(bills)
+        bills = pq.read_table(path, columns = keys).to_pandas() if os.path.exists(path) else pd.DataFrame(columns = keys)
+
+    return bills[keys].astype(str).agg('|'.join, axis = 1)
+
+def ingest_batch(files : List[Dict[str, Any]]) -> pd.DataFrame:
+    '''
+    Curates a micro-batch of new files from `find_new_files`, appending them to the curated datasets rather than
+    rebuilding them.
+
+    Methodology:
+        1. Read each new meter usage CSV on its own, so one bad export doesn't hold back the rest, and merge their
+           readings into the curated `meter_usage` partitions of the accounts they cover.
+        2. Scrape each format's new bills with `scrape_bills` into a temporary directory of their own.
+        3. Append the records whose natural key, a bill's invoice, account, supplier and billing period, isn't already
+           curated to both the format's raw Parquet and its curated table. Neither is rewritten, and a bill scraped
+           again, say after the ledger is lost, adds nothing.
+
+    Parameters:
+        files (List[Dict[str, Any]]) : The new files, each with its `file` path and `source` in `SOURCES`.
+
+    Returns:
+        pd.DataFrame: One row per file with its `records` and `error`, which is None for every file ingested.
+    '''
+
+    report = pd.DataFrame(files, columns = ['file', 'source']).assign(records = 0, error = None)
+
+    # Step 1: Merge new meter readings into their account partitions
+    spec     = SOURCES['meter_usage']
+    readings = []
+
+    for i in report.index[report['source'] == 'meter_usage']:
+        rows = load_data_files(path = spec['raw'], cols = spec['cols'], files = [report.at[i, 'file']])
+
+        if rows is None:
+            report.at[i, 'error'] = "The file couldn't be read"
+        else:
+            readings.append(rows)
+            report.at[i, 'records'] = len(rows)
+
+    if readings:
+        _merge_partitions(pd.concat(readings, ignore_index = True), spec['curated'], 'meter_usage')
+
+    # Step 2: Scrape new bills into a directory of the batch's own
+    for source in ['cmp_bills', 'ampion_bills']:
+        spec  = SOURCES[source]
+        bills = report[report['source'] == source]
+        if bills.empty:
+            continue
+
+        stage = mkdtemp()
+
+        try:
+            scraped = scrape_bills(formats = [spec['format']],
+                                   files   = bills['file'].tolist(),
+                                   outputs = {spec['format']: stage}).set_index('file_path')
+
+            report.loc[bills.index, 'records'] = bills['file'].map(scraped['records']).fillna(0).astype(int)
+            report.loc[bills.index, 'error']   = bills['file'].map(scraped['error'])
+
+            if not scraped['records'].sum():
+                continue
+
+            # Step 3: Append only the records of bills not already curated, to the raw records and the curated table
+            records = apply_schema(pq.read_table(stage).to_pandas(), source)
+            keys    = _bill_keys(records)
+            new     = records[(~keys.isin(_bill_keys(spec['curated'])) & ~keys.duplicated()).to_numpy()]
+
+            if new.empty:
+                continue
+
+            for dest, schema in [(PARSERS[spec['format']]['output'], None), (spec['curated'], source)]:
+                write_results(data      = new.reset_index(drop = True),
+                              dest      = dest,
+                              overwrite = False,
+                              schema    = schema)
+
+        finally:
+            rmtree(stage, ignore_errors = True)
+
+    return report
+
+def _build_models(tables : List[str]):
+    '''
+    Rebuilds modeled tables in a worker process, from the project root like `etl.py`, so the memory a rebuild takes is
+    returned once the worker exits.
+    '''
+
+    os.chdir(find_project_root())
+
+    import utils.modeling as modeling
+
+    for table in tables:
+        getattr(modeling, f"model_{table}")()
+
+def refresh_models(tables : Set[str],
+                   views  : Dict[str, str] = None):
+    '''
+    Rebuilds the given modeled tables, stage by stage in `MODELS`, each stage in its own fresh process after the stage
+    before it has written its tables. Then refreshes the DuckDB views over the rebuilt and newly curated tables,
+    and deletes the pickles built from the old data, as `etl.py` does after a full run.
+
+    Parameters:
+        tables (Set[str])       : The modeled tables to rebuild.
+        views  (Dict[str, str]) : Maps any curated tables to refresh views over to their paths. Defaults to None.
+    '''
+
+    for stage in MODELS:
+        stage = [table for table in stage if table in tables]
+        if not stage:
+            continue
+
+        lg.info(f"Rebuilding {stage}.")
+        with ProcessPoolExecutor(max_workers = 1, mp_context = mp.get_context('spawn')) as pool:
+            pool.submit(_build_models, stage).result()
+
+    try:
+        connect_to_db(vws = (views or {}) | {table: f"./data/modeled/{table}" for table in tables}).close()
+
+    except Exception as e:
+        lg.error(f"Couldn't refresh the DuckDB views, which may be locked by another connection: {e}\n")
+
+    for file in glob(os.path.join(find_project_root(), "**", "*.pkl"), recursive = True) + \
+                glob(os.path.join(find_project_root(), "**", "pickled", "*.npy"), recursive = True):
+        os.remove(file)
+
+def watch(poll          : float = 10.0,
+          settle        : float = 5.0,
+          batch_files   : int   = 50,
+          refresh_every : float = 300.0,
+          ledger        : str   = './data/ingest/ledger.json',
+          once          : bool  = False) -> pd.DataFrame:
+    '''
+    Polls the drop directories in `SOURCES` and ingests new files in micro-batches until stopped with Ctrl+C, keeping
+    the curated tables, modeled tables and DuckDB views current.
+
+    Backpressure comes from two limits. Each micro-batch takes at most `batch_files` of the oldest new files, leaving
+    the rest for the next batch, so a large drop is worked through in bounded steps. And the modeled tables, which take
+    far longer to rebuild than a batch takes to curate, are rebuilt once the backlog is empty, or at most every
+    `refresh_every` seconds while it drains, rather than after every batch.
+
+    Methodology:
+        1. Scan the drop directories for files the ledger hasn't seen in their current state.
+        2. Take the oldest `batch_files` of them, and hash their contents. Files whose contents were already ingested,
+           under any name, are recorded as duplicates and skipped. Files already ingested but not yet modeled when a
+           watcher last stopped leave their tables stale from the start.
+        3. Curate the rest with `ingest_batch`, and record each file's hash, outcome and time in the ledger. Files that
+           fail are recorded too, and are only retried once their contents change. A batch that raises is recorded as
+           failed file by file with the error, so the watcher carries on rather than crashing on it again at restart.
+        4. Mark the modeled tables built from the batch's sources as stale.
+        5. Rebuild the stale tables with `refresh_models` when the backlog is empty or `refresh_every` has passed, and
+           mark every ingested file as modeled in the ledger.
+        6. Sleep for `poll` seconds once the backlog is empty, or return if `once` is set.
+
+    Parameters:
+        poll          (float) : Seconds between scans once the backlog is empty. Defaults to 10.
+        settle        (float) : Seconds a file must go unmodified before it's picked up. Defaults to 5.
+        batch_files   (int)   : The most files curated in one micro-batch. Defaults to 50.
+        refresh_every (float) : The fewest seconds between rebuilds of the modeled tables while a backlog drains.
+                                Defaults to 300.
+        ledger        (str)   : Path to the JSON ledger of files seen. Defaults to './data/ingest/ledger.json'.
+        once          (bool)  : Whether to return once the backlog is ingested and modeled, instead of watching on.
+                                Defaults to False.
+
+    Returns:
+        pd.DataFrame: Every file handled while watching, with its `source`, `records`, `status` and `error`.
+    '''
+
+    os.chdir(find_project_root()) # Curated and modeled paths are relative to the project root, as in `etl.py`
+
+    entries   = read_ledger(ledger)
+    handled   = []
+    refreshed = time.monotonic()
+
+    # Files ingested before a watcher stopped, but not yet modeled, leave their tables stale
+    stale = {table for entry in entries.values() if entry.get('status') == 'ingested' and not entry.get('modeled')
+                   for table in SOURCES[entry['source']]['models']}
+
+    lg.info(f"Watching {[spec['raw'] for spec in SOURCES.values()]} with {len(entries)} files in the ledger.")
+
+    try:
+        while True:
+
+            # Step 1: Scan for files the ledger hasn't seen
+            found = find_new_files(entries, settle)
+
+            # Step 2: Take the oldest files, and skip any whose contents were already ingested
+            batch  = []
+            hashes = {entry['sha256'] for entry in entries.values() if entry.get('status') == 'ingested'}
+
+            for candidate in found[:batch_files]:
+                candidate['sha256'] = hash_file(candidate['file'])
+                entry               = entries.get(candidate['key'], {})
+
+                # A file that was only touched keeps its outcome, with its new size and time
+                if entry.get('sha256') == candidate['sha256']:
+                    entry.update(size = candidate['size'], mtime_ns = candidate['mtime_ns'])
+
+                elif candidate['sha256'] in hashes:
+                    entries[candidate['key']] = {key: candidate[key] for key in ['source', 'size', 'mtime_ns', 'sha256']} | \
+                                                {'status': 'duplicate', 'error': None}
+                    handled.append({**candidate, 'records': 0, 'status': 'duplicate', 'error': None})
+                else:
+                    hashes.add(candidate['sha256'])
+                    batch.append(candidate)
+
+            if found and not batch:
+                write_ledger(ledger, entries)
+
+            # Step 3: Curate the batch and record every file's outcome
+            if batch:
+                lg.info(f"Ingesting {len(batch)} of {len(found)} new files.")
+                try:
+                    report = ingest_batch(batch)
+
+                except Exception as e:
+                    lg.error(f"Error ingesting a batch of {len(batch)} files: {e}\n")
+                    report = pd.DataFrame(batch, columns = ['file', 'source']).assign(records = 0, error = f"{type(e).__name__}: {e}")
+
+                for candidate, (_, row) in zip(batch, report.iterrows()):
+                    error  = row['error'] if pd.notna(row['error']) else None
+                    status = 'failed' if error else 'ingested'
+                    entries[candidate['key']] = {'source'   : candidate['source'],
+                                                 'size'     : candidate['size'],
+                                                 'mtime_ns' : candidate['mtime_ns'],
+                                                 'sha256'   : candidate['sha256'],
+                                                 'status'   : status,
+                                                 'error'    : error,
+                                                 'ingested' : time.strftime('%Y-%m-%d %H:%M:%S'),
+                                                 'modeled'  : False}
+                    handled.append({**candidate, 'records': int(row['records']), 'status': status, 'error': error})
+
+                # Step 4: Mark the modeled tables built from these sources as stale
+                stale |= {table for source in report.loc[report['error'].isna(), 'source']
+                                for table in SOURCES[source]['models']}
+
+                write_ledger(ledger, entries)
+
+            # Step 5: Rebuild stale tables once the backlog is empty, or periodically while it drains
+            backlog = len(found) > batch_files
+            if stale and (not backlog or time.monotonic() - refreshed >= refresh_every):
+                refresh_models(stale, views = {source: spec['curated'] for source, spec in SOURCES.items()})
+
+                for entry in entries.values():
+                    entry['modeled'] = entry.get('status') == 'ingested'
+
+                write_ledger(ledger, entries)
+                stale, refreshed = set(), time.monotonic()
+
+            # Step 6: Keep draining a backlog, or wait for new files
+            if backlog:
+                continue
+
+            if once:
+                break
+
+            time.sleep(poll)
+
+    except KeyboardInterrupt:
+        write_ledger(ledger, entries)
+        lg.info("Stopped watching. Files ingested since the last model rebuild will be modeled on the next run.")
+
+    return pd.DataFrame(handled, columns = ['key', 'source', 'records', 'status', 'error']).rename(columns = {'key': 'file'})
@@ -1,34 +1,50 @@
-from typing           import Optional
-from utils.curation   import write_results
-from utils.dataframes import *
-
-import logging as lg
-import numpy   as np
-import pandas  as pd
+from concurrent.futures import ProcessPoolExecutor
+from contextlib         import nullcontext
+from itertools          import repeat
+from shutil             import rmtree
+from tempfile           import mkdtemp
+from typing             import Dict
+from utils.allocation   import allocate_kwh, segment_ratio
+from utils.curation     import assign_keys, write_results
+from utils.runtime      import find_project_root, read_data
+from utils.slots        import EPOCH, SLOT, SLOTS_DAY, slot_index, slot_times
+
+import os
+import time
+import logging         as lg
+import multiprocessing as mp
+import numpy           as np
+import pandas          as pd
+import pyarrow.parquet as pq
 
 lg.basicConfig(level  = lg.INFO, 
                format = '%(asctime)s | %(levelname)s | %(message)s')
 
 '''
-Contains functions that transform DATAFRAMES into a star schema optimized for analytical queries and 
+Contains functions that transform the curated tables into a star schema optimized for analytical queries and 
 data visualization. The aim is to create a structured, denormalized data model that enables fast and 
 intuitive querying.
 
+Each function reads the tables it needs when it's called, rather than through `utils.dataframes`, so it models the
+data as it is on disk now, and the fact table's spawned workers don't load every table just by importing this module.
+
 Functions:
-    - model_dim_datetimes     : Generates a datetime dimension table from `meter_usage` timestamps.
+    - model_dim_datetimes     : Generates a datetime dimension table of every 15-minute slot `meter_usage` can fall in.
     - model_dim_meters        : Extracts account numbers, service points, streets, and labels.
     - model_dim_bills         : Groups by common dimensions and aggregates relevant metrics across all billing sources.
     - model_fct_electric_brew : Generates a central fact table of all electric usage records and their associated charges.
+    - check_fct_electric_brew : Compares a serial build of the fact table against one across a process pool.
 '''
 
 def model_dim_datetimes(model: str = "./data/modeled/dim_datetimes"):
     '''
-    This function creates a datetime dimension table from the `meter_usage` DataFrame.
-    It extracts unique timestamps, generates various time components, and saves the result as a .parquet file.
+    This function creates a datetime dimension table from a full calendar of 15-minute slots, from the slot epoch
+    through the end of the last year `meter_usage` has readings in. Each id is the slot number of its timestamp, so any
+    timestamp's key can be computed without a lookup, and ids stay the same however the readings' coverage changes.
     
     Methodology:
-        1. Extract unique timestamps from `meter_usage['interval_end_datetime']` and sort them.
-        2. Create a DataFrame with these timestamps and generate time components such as increment, hour, etc.
+        1. Generate every slot from `EPOCH` through the end of the last year with readings, keyed by slot number.
+        2. Generate time components such as increment, hour, etc. from each slot's timestamp.
         3. Define the period of the day based on the hour.
         4. Save the DataFrame as a .parquet file in the specified `model` directory with snappy compression.
         
@@ -37,22 +53,24 @@ def model_dim_datetimes(model: str = "./data/modeled/dim_datetimes"):
     '''
     
     try:
-        # Step 1: Extract unique timestamps and sort them
-        timestamps = pd.to_datetime(meter_usage['interval_end_datetime'].unique(), format = '%m/%d/%Y %I:%M:%S %p')
-        timestamps = np.sort(timestamps)
+        # Step 1: Generate every slot through the end of the last year with readings
+        meter_usage = read_data('./data/cmp/curated/meter_usage', schema = 'meter_usage')
 
-        # Step 2: Create a DataFrame for the datetime dimension
-        df = pd.DataFrame(timestamps, columns = ['timestamp'])
-        
-        # Generate standard datetime components from the timestamp
+        last = slot_times([slot_index(meter_usage['interval_end_datetime']).max()])[0]
+        end  = pd.Timestamp(year = last.year + 1, month = 1, day = 1)
+
+        df = pd.DataFrame({'id': np.arange((end - EPOCH) // SLOT)})
+        df['timestamp'] = slot_times(df['id'])
+
+        # Step 2: Generate standard datetime components from the timestamp
         df['increment']    = df['timestamp'].dt.minute
         df['hour']         = df['timestamp'].dt.hour
         df['date']         = df['timestamp'].dt.normalize()
         df['week']         = df['timestamp'].dt.isocalendar().week
-        df['week_start']   = df['timestamp'].dt.to_period('W').apply(lambda r: r.start_time)
+        df['week_start']   = df['timestamp'].dt.to_period('W').dt.start_time
         df['month']        = df['timestamp'].dt.month
         df['month_name']   = df['timestamp'].dt.month_name()
-        df['month_start']  = df['timestamp'].dt.to_period('M').apply(lambda r: r.start_time)
+        df['month_start']  = df['timestamp'].dt.to_period('M').dt.start_time
         df['quarter']      = df['timestamp'].dt.quarter
         df['year']         = df['timestamp'].dt.year
 
@@ -65,60 +83,77 @@ def model_dim_datetimes(model: str = "./data/modeled/dim_datetimes"):
         # Step 4: Save the DataFrame as a .parquet file
         write_results(data         = df, 
                       dest         = model,
-                      add_id       = True,
-                      partition_by = None)
+                      partition_by = None,
+                      schema       = 'dim_datetimes')
 
     except Exception as e:
         lg.error(f"Error creating datetime dimension table: {e}\n")
 
-def model_dim_meters(model: str = "./data/modeled/dim_meters"):
+def model_dim_meters(model : str = "./data/modeled/dim_meters",
+                     keys  : str = "./data/modeled/keys/dim_meters.json"):
     '''
     This function creates a meters dimension table by joining data from the `meter_usage` and `locations` DataFrames.
     It extracts account numbers, service points, meter IDs, streets, and labels, and saves the result as a .parquet file.
 
     Methodology:
         1. Extract and join relevant columns based on `account_number`.
-        2. Save the resulting DataFrame as a .parquet file in the specified `model` directory with snappy compression.
+        2. Assign each meter its persistent id from the key map.
+        3. Save the resulting DataFrame as a .parquet file in the specified `model` directory with snappy compression.
 
     Parameters:
         model (str): Directory where the .parquet file should be saved.
+        keys  (str): Path to the key map of meter ids.
     '''
 
     try:
         # Step 1: Extract and join relevant columns
+        meter_usage = read_data('./data/cmp/curated/meter_usage', schema = 'meter_usage')
+        locations   = read_data('./data/cmp/curated/locations',   schema = 'locations')
+
         df = pd.merge(meter_usage[['meter_id', 'service_point_id', 'account_number']].drop_duplicates(), 
                       locations[['account_number', 'street', 'label', 'operational_area']].drop_duplicates(), 
                       on  = 'account_number', 
                       how = 'left')
 
-        # Step 2: Save the DataFrame as a .parquet file
+        # Step 2: Assign persistent ids, keyed on the meter
+        df = assign_keys(df, natural_key = ['meter_id'], key_map = keys)
+
+        # Step 3: Save the DataFrame as a .parquet file
         write_results(data         = df, 
                       dest         = model,
-                      add_id       = True,
-                      partition_by = None)
+                      partition_by = None,
+                      schema       = 'dim_meters')
+
+    except ValueError:
+        raise # A natural key that isn't unique, or a key map built on other columns, can't be logged and skipped
 
     except Exception as e:
         lg.error(f"Error creating meters dimension table: {e}\n")
 
-def model_dim_bills(model: str = "./data/modeled/dim_bills"):
+def model_dim_bills(model : str = "./data/modeled/dim_bills",
+                    keys  : str = "./data/modeled/keys/dim_bills.json"):
     '''
     This function creates a bills dimension table from both the `cmp_bills` and `ampion_bills` DataFrames.
     It groups by common dimensions, aggregates relevant metrics, and concatenates the results from both DataFrames.
 
     Methodology:
         1. Group `cmp_bills` and `ampion_bills` by common dimensions and aggregate metrics.
-        2. Concatenate the results and assign a source identifier for each row.
+        2. Concatenate the results, assign a source identifier for each row, and assign each bill its persistent id.
         3. Replace `interval_start` and `interval_end` with `billing_interval`
         4. Save the resulting DataFrame as a .parquet file in the specified `model` directory with snappy compression.
     
     Parameters:
         model (str): Directory where the .parquet file should be saved.
+        keys  (str): Path to the key map of bill ids.
     '''
 
     try:
         # Step 1: Define common dimensions, standardize against them, and aggregate numerics
         common_dims = ['invoice_number', 'account_number', 'interval_start', 'interval_end', 'supplier']
 
+        cmp_bills    = read_data('./data/cmp/curated/bills', schema = 'cmp_bills')
+        ampion_bills = read_data('./data/ampion/curated',    schema = 'ampion_bills')
+
         # Standardize `cmp_bills`
         df1 = cmp_bills.apply(lambda col: col.fillna(0) if col.dtype.kind in 'biufc' else col)
         df1['kwh_delivered']
@@ -144,6 +179,10 @@ def model_dim_bills(model: str = "./data/modeled/dim_bills"):
         df1 = df1[df2.columns]
         df = pd.concat([df1, df2], ignore_index = True)
 
+        # An invoice can cover several accounts and billing periods, so a bill is keyed on all of them
+        df = assign_keys(df, natural_key = ['source', 'invoice_number', 'account_number', 
+                                            'interval_start', 'interval_end', 'supplier'], key_map = keys)
+
         # Step 3: Replace `interval_start` and `interval_end` with `billing_interval`
         df['billing_interval'] = [pd.date_range(s, e, inclusive = 'both').date.tolist() 
                                   for s, e in zip(df['interval_start'], df['interval_end'])]
@@ -152,106 +191,247 @@ def model_dim_bills(model: str = "./data/modeled/dim_bills"):
         # Step 4: Save the DataFrame as a .parquet file
         write_results(data         = df, 
                       dest         = model,
-                      add_id       = True,
-                      partition_by = None)
+                      partition_by = None,
+                      schema       = 'dim_bills')
+
+    except ValueError:
+        raise # A natural key that isn't unique, or a key map built on other columns, can't be logged and skipped
 
     except Exception as e:
         lg.error(f"Error creating bills dimension table: {e}\n")
 
-def model_fct_electric_brew(model: str  = "./data/modeled/fct_electric_brew"):
+def _fct_account(account : str,
+                 sources : Dict[str, str],
+                 stage   : str) -> int:
+    '''
+    Builds the fact rows of one account from its own meter readings and bills, read from the `sources` paths of
+    `meter_usage`, `dim_meters` and `dim_bills`, and stages them in `stage` until the rows of the accounts before it are 
+    counted. Returns the number of rows.
+    '''
+
+    # Step 1: Read the account's readings, meters and bills, and expand its bills to daily granularity
+    filters = [('account_number', '=', account)]
+    usage   = read_data(sources['meter_usage'], schema = 'meter_usage', filters = filters)
+    meters  = read_data(sources['dim_meters'],  schema = 'dim_meters',  filters = filters)
+    bills   = read_data(sources['dim_bills'],   schema = 'dim_bills',   filters = filters)
+
+    explode = bills.explode('billing_interval') \
+                   .assign(date     = lambda x: pd.to_datetime(x['billing_interval']),
+                           kwh_left = 0.0,
+                           kwh_used = 0.0) \
+                   .rename(columns = {'id': 'dim_bills_id'})
+
+    # Step 2: Key each reading by its slot, which is its `dim_datetimes` id, and merge with the meters dimension
+    flat_df = usage.assign(id   = lambda df: slot_index(df['interval_end_datetime'])) \
+                   .assign(date = lambda df: slot_times(df['id'] // SLOTS_DAY * SLOTS_DAY)) \
+                   .merge(meters, on = 'meter_id', how = 'left', suffixes = ('', '_met')) \
+                   .sort_values(by = 'id', kind = 'stable').reset_index() \
+                   .rename(columns = {'index': 'flat_id'})
+
+    # Filter to only dates with corresponding bills
+    flat_df = flat_df[flat_df['date'] <= '2023-08-10']
+
+    # Rows draw down the same bill when they share its source, invoice, account and kWh delivered
+    bill_segments = lambda df: df.groupby(['source', 'invoice_number', 'account_number', 'kwh_delivered'], observed = True, sort = False) \
+                                 .ngroup().fillna(-1).astype(int)
+
+    # Step 3: Merge with CMP and Ampion billing data
+    matched_c = flat_df.merge(explode[explode['source'] == 'CMP'],    on = ['account_number', 'date'], how = 'inner')
+    matched_a = flat_df.merge(explode[explode['source'] == 'Ampion'], on = ['account_number', 'date'], how = 'inner')
+
+    # Step 4: Process Ampion data for kWh usage. These stay merges on `flat_id` rather than aligning rows by position,
+    # since a reading on the day two CMP bills overlap matches both, and each match is allocated on its own
+    kwh_used_a = matched_a.merge(matched_c[['flat_id', 'dim_bills_id', 'service_charge', 'taxes']], on = 'flat_id', how = 'left', suffixes = ('', '_cmp'))
+    kwh_used_a['ratio_bill_id']  = kwh_used_a['dim_bills_id_cmp'].combine_first(kwh_used_a['dim_bills_id'])
+    kwh_used_a['service_charge'] = kwh_used_a['service_charge_cmp'].combine_first(kwh_used_a['service_charge'])
+    kwh_used_a['taxes']          = kwh_used_a['taxes_cmp'].combine_first(kwh_used_a['taxes'])
+    kwh_used_a = kwh_used_a.drop(kwh_used_a.filter(regex = '_cmp$').columns, axis = 1) # Drop temporary `_cmp` columns for subsequent `pd.concat()`
+
+    kwh_used_a['kwh_left'], kwh_used_a['kwh_used'], kwh_used_a['kwh_unused'] = allocate_kwh(segments = bill_segments(kwh_used_a),
+                                                                                             kwh      = kwh_used_a['kwh'],
+                                                                                             capacity = kwh_used_a['kwh_delivered'])
+
+    # Step 5: Incorporate unused kWh from CMP if processing Ampion data
+    kwh_used_c = matched_c.merge(kwh_used_a[['flat_id', 'kwh_unused']], on = 'flat_id', how = 'left')
+    kwh_used_c['ratio_bill_id'] = kwh_used_c['dim_bills_id']
+    kwh_used_c['kwh']           = kwh_used_c['kwh_unused'].combine_first(kwh_used_c['kwh'])
+
+    kwh_used_c['kwh_left'], kwh_used_c['kwh_used'], kwh_used_c['kwh_unused'] = allocate_kwh(segments = bill_segments(kwh_used_c),
+                                                                                             kwh      = kwh_used_c['kwh'],
+                                                                                             capacity = kwh_used_c['kwh_delivered'])
+
+    # Step 6: Combine CMP and Ampion data
+    int_df = pd.concat([kwh_used_a, kwh_used_c.reindex(columns = kwh_used_a.columns)])[lambda x: x['kwh_used'] > 0]
+
+    # Step 7: Calculate the kWh usage ratio
+    int_df['kwh_ratio'] = segment_ratio(segments = int_df.groupby('ratio_bill_id', sort = False).ngroup().fillna(-1).astype(int),
+                                        values   = int_df['kwh_used'])
+
+    # Step 8: Merge with flat data and sort
+    df = flat_df.merge(int_df, on  = 'flat_id', how = 'left', suffixes = ('', '_int')) \
+                .sort_values(by = 'id', kind = 'stable')
+
+    # Step 9: Compute cost metrics and keys, and stage the rows
+    df['dim_datetimes_id'] = df['id']
+    df['dim_meters_id']    = df['id_met']
+    df['kwh']              = df['kwh_used'].combine_first(df['kwh'])
+    df['delivery_cost']    = df['kwh_used']       * df['delivery_rate']
+    df['service_cost']     = df['service_charge'] * df['kwh_ratio']
+    df['supply_cost']      = df['kwh_used']       * df['supply_rate']
+    df['tax_cost']         = df['taxes']          * df['kwh_ratio']
+    df['total_cost']       = df.filter(regex = '_cost$').sum(axis = 1)
+
+    df[['dim_datetimes_id', 'dim_meters_id', 'dim_bills_id', 'account_number', 'kwh', 
+        'delivery_cost', 'service_cost', 'supply_cost', 'tax_cost', 'total_cost']].to_parquet(os.path.join(stage, f"{account}.parquet"))
+
+    return len(df)
+
+def _write_fct_account(account : str,
+                       offset  : int,
+                       stage   : str,
+                       model   : str):
+    '''
+    Numbers an account's staged fact rows after the `offset` rows of the accounts before it, and writes its partition.
+    '''
+
+    df = pd.read_parquet(os.path.join(stage, f"{account}.parquet"))
+    df.insert(0, 'id', range(offset + 1, offset + len(df) + 1))
+
+    write_results(data            = df, 
+                  dest            = model,
+                  overwrite       = False,
+                  schema          = 'fct_electric_brew',
+                  sort_by         = ['dim_datetimes_id', 'dim_meters_id'],
+                  row_group_size  = 8640, # About 90 days of 15-minute readings from one meter
+                  column_encoding = {'id'               : 'DELTA_BINARY_PACKED', # Sorted keys delta-encode to a few bits
+                                     'dim_datetimes_id' : 'DELTA_BINARY_PACKED'})
+
+def model_fct_electric_brew(model   : str            = "./data/modeled/fct_electric_brew",
+                            workers : int            = None,
+                            sources : Dict[str, str] = {'meter_usage' : './data/cmp/curated/meter_usage',
+                                                        'dim_meters'  : './data/modeled/dim_meters',
+                                                        'dim_bills'   : './data/modeled/dim_bills'}):
     
     '''
     This function generates a central fact table recording electric usage and associated charges for each account per time interval.
     It integrates data from meter readings, customer billing, and rate information, applying business rules to calculate the cost
     of electric delivery and usage.
 
+    Every step of the allocation is grouped within an account, so each account is built in its own worker of a process pool,
+    reading only its own partition of `meter_usage` and its own meters and bills, and writing its own partition. Workers are
+    spawned, so they inherit no thread pools or file handles from this process, and each is passed only its account and
+    the paths it reads. Importing this module loads no tables, so a worker holds only its own account's data. Accounts
+    are listed from the partitions of `meter_usage` on disk, so the build always covers the data it reads. Spawned
+    workers re-import the calling script, so it must run the build under an `if __name__ == "__main__":` guard, as
+    `etl.py` does. Ids run in account order, so they're assigned once every
+    account's rows are counted, and match a serial build.
+
     Methodology:
-        1. Expand 'dim_bills' for daily granularity based on billing intervals and group by the source.
-        2. Merge expanded billing data with meter usage and dimension tables, sorting by account number and timestamp ID.
+        1. Read each account's meters and bills, expand its bills for daily granularity based on billing intervals.
+        2. Compute each reading's timestamp ID as its slot number, merge expanded billing data with meter usage and the
+           meters dimension, and sort by timestamp ID.
         3. Merge the result with billing information from CMP and Ampion sources.
         4. Process Ampion data to calculate kWh usage details.
         5. Process CMP data, incorporating unused kWh from Ampion, to complete kWh usage details.
         6. Combine processed CMP and Ampion data into an integrated DataFrame.
         7. Calculate the ratio of kWh used for service and tax cost allocation.
-        8. Merge the integrated data with flat data, sort by account number and timestamp ID.
+        8. Merge the integrated data with flat data, sort by timestamp ID.
         9. Compute delivery, service, supply, and tax costs, and aggregate to get the total cost.
-       10. Save the DataFrame as a .parquet file
+       10. Number every account's rows after those of the accounts before it, and save each account's partition as .parquet,
+           sorted by time and meter so readers can skip row groups outside a date range, into a directory beside `model`
+           that replaces it only once every account has succeeded.
+
+    Any error is raised once the partial build is cleaned up and the previous table is back in place.
 
     Parameters:
-        model (str): Directory where the .parquet file should be saved.
+        model   (str)            : Directory where the .parquet file should be saved.
+        workers (int)            : Number of worker processes. Defaults to one per CPU, and 1 builds every account in this
+                                   process.
+        sources (Dict[str, str]) : Paths of the `meter_usage`, `dim_meters` and `dim_bills` tables the build reads.
     '''
     
+    # Partitions are written beside the table and swapped in whole, so a failed build leaves the previous table in place
+    parent = os.path.dirname(os.path.abspath(model))
+    os.makedirs(parent, exist_ok = True)
+
+    stage = mkdtemp()
+    build = mkdtemp(dir = parent, prefix = f".{os.path.basename(os.path.normpath(model))}.")
+
     try:
-        # Step 1: Expand 'dim_bills' and group by source
-        explode = {s: df.rename(columns = {'id': 'dim_bills_id'}) 
-                   for s, df in dim_bills.explode('billing_interval')
-                                         .assign(date = lambda x: pd.to_datetime(x['billing_interval']),
-                                                 kwh_left = 0.0,
-                                                 kwh_used = 0.0)
-                                         .groupby('source')}
-
-
-        # Step 2: Merge expanded billing data with meter usage and dimension tables
-        flat_df = meter_usage.assign(timestamp = lambda df: pd.to_datetime(df['interval_end_datetime'], format = '%m/%d/%Y %I:%M:%S %p')) \
-                             .merge(dim_datetimes,     on = 'timestamp', how = 'left', suffixes = ('', '_dat')) \
-                             .merge(dim_meters,        on = 'meter_id',  how = 'left', suffixes = ('', '_met')) \
-                             .sort_values(by = ['account_number', 'id']).reset_index() \
-                             .rename(columns = {'index': 'flat_id'})
-
-        # Filter to only dates with corresponding bills
-        flat_df = flat_df[flat_df['date'] <= '2023-08-10']
-
-        # Step 3: Merge with CMP and Ampion billing data
-        matched_c = flat_df.merge(explode['CMP'],    on = ['account_number', 'date'], how = 'inner')
-        matched_a = flat_df.merge(explode['Ampion'], on = ['account_number', 'date'], how = 'inner')
-
-        # Step 4: Process Ampion data for kWh usage
-        kwh_used_a = matched_a.merge(matched_c[['flat_id', 'dim_bills_id', 'service_charge', 'taxes']], on = 'flat_id', how = 'left', suffixes = ('', '_cmp'))
-        kwh_used_a['ratio_bill_id']  = kwh_used_a['dim_bills_id_cmp'].combine_first(kwh_used_a['dim_bills_id'])
-        kwh_used_a['service_charge'] = kwh_used_a['service_charge_cmp'].combine_first(kwh_used_a['service_charge'])
-        kwh_used_a['taxes']          = kwh_used_a['taxes_cmp'].combine_first(kwh_used_a['taxes'])
-        kwh_used_a = kwh_used_a.drop(kwh_used_a.filter(regex = '_cmp$').columns, axis = 1) # Drop temporary `_cmp` columns for subsequent `pd.concat()`
-
-        group = kwh_used_a.groupby(['source', 'invoice_number', 'account_number', 'kwh_delivered'], observed = True)
-        kwh_used_a['kwh_left']   = (group['kwh_delivered'].transform('first') - group['kwh'].cumsum()).clip(lower = 0)
-        kwh_used_a['kwh_used']   = np.minimum(kwh_used_a['kwh'], kwh_used_a['kwh_left'])
-        kwh_used_a['kwh_unused'] = kwh_used_a['kwh'] - kwh_used_a['kwh_used']
-
-        # Step 5: Incorporate unused kWh from CMP if processing Ampion data
-        kwh_used_c = matched_c.merge(kwh_used_a[['flat_id', 'kwh_unused']], on = 'flat_id', how = 'left')
-        kwh_used_c['ratio_bill_id'] = kwh_used_c['dim_bills_id']
-        kwh_used_c['kwh']           = kwh_used_c['kwh_unused'].combine_first(kwh_used_c['kwh'])
-
-        group = kwh_used_c.groupby(['source', 'invoice_number', 'account_number', 'kwh_delivered'], observed = True)
-        kwh_used_c['kwh_left']   = (group['kwh_delivered'].transform('first') - group['kwh'].cumsum()).clip(lower = 0)
-        kwh_used_c['kwh_used']   = np.minimum(kwh_used_c['kwh'], kwh_used_c['kwh_left'])
-        kwh_used_c['kwh_unused'] = kwh_used_c['kwh'] - kwh_used_c['kwh_used']
-
-        # Step 6: Combine CMP and Ampion data
-        int_df = pd.concat([kwh_used_a, kwh_used_c.reindex(columns = kwh_used_a.columns)])[lambda x: x['kwh_used'] > 0]
-
-        # Step 7: Calculate the kWh usage ratio
-        int_df['kwh_ratio'] = int_df['kwh_used'] / int_df.groupby(['ratio_bill_id'])['kwh_used'].transform('sum')
-
-        # Step 8: Merge with flat data and sort
-        df = flat_df.merge(int_df, on  = 'flat_id', how = 'left', suffixes = ('', '_int')) \
-                    .sort_values(by = ['account_number', 'id'])
-
-        # Step 9: Compute cost metrics and keys
-        df['dim_datetimes_id'] = df['id']
-        df['dim_meters_id']    = df['id_met']
-        df['kwh']              = df['kwh_used'].combine_first(df['kwh'])
-        df['delivery_cost']    = df['kwh_used']       * df['delivery_rate']
-        df['service_cost']     = df['service_charge'] * df['kwh_ratio']
-        df['supply_cost']      = df['kwh_used']       * df['supply_rate']
-        df['tax_cost']         = df['taxes']          * df['kwh_ratio']
-        df['total_cost']       = df.filter(regex = '_cost$').sum(axis = 1)
-
-        # Step 10: Save the DataFrame as a .parquet file
-        write_results(data   = df[['dim_datetimes_id', 'dim_meters_id', 'dim_bills_id', 'account_number', 
-                                   'kwh', 'delivery_cost', 'service_cost', 'supply_cost', 'tax_cost', 'total_cost']], 
-                      dest   = model,
-                      add_id = True)
+        accounts = pq.read_table(find_project_root(sources['meter_usage']), columns = ['account_number']) \
+                     .to_pandas()['account_number'].astype(str).drop_duplicates().sort_values().tolist()
+        workers  = max(1, min(workers or os.cpu_count(), len(accounts)))
+
+        # Steps 1-9: Build and stage every account's rows, then number and write them in account order
+        with ProcessPoolExecutor(max_workers = workers, mp_context = mp.get_context('spawn')) if workers > 1 else nullcontext() as pool:
+            run     = pool.map if pool else map
+            rows    = list(run(_fct_account, accounts, repeat(sources), repeat(stage)))
+            offsets = np.cumsum([0] + rows[:-1]).tolist()
+
+            # Step 10: Save each account's partition as a .parquet file
+            list(run(_write_fct_account, accounts, offsets, repeat(stage), repeat(build)))
+
+        # Swap the finished table in for the previous one only once every account has succeeded
+        if os.path.exists(model):
+            os.replace(model, f"{build}.old")
+
+        os.replace(build, model)
+        rmtree(f"{build}.old", ignore_errors = True)
+
+        lg.info(f"Built {sum(rows)} fact rows across {len(accounts)} accounts with {workers} workers.\n")
 
     except Exception as e:
-        lg.error(f"Error while creating the final fact table: {e}\n")
\ No newline at end of file
+        if os.path.exists(f"{build}.old") and not os.path.exists(model):
+            os.replace(f"{build}.old", model)
+
+        lg.error(f"Error while creating the final fact table, which was left as it was: {e}\n")
+        raise
+
+    finally:
+        rmtree(stage, ignore_errors = True)
+        rmtree(build, ignore_errors = True)
+
+def check_fct_electric_brew(workers : int = None) -> pd.DataFrame:
+    '''
+    Builds `fct_electric_brew` serially and across a process pool into temporary directories, and compares each
+    account's rows, ids included, between the two builds.
+
+    Parameters:
+        workers (int): Number of worker processes for the parallel build. Defaults to one per CPU.
+
+    Returns:
+        pd.DataFrame: One row per account with its `rows` in each build and whether they `match`, plus a final row with
+                      the `seconds` each build took.
+    '''
+
+    builds  = {}
+    seconds = {}
+    tmp     = mkdtemp()
+
+    try:
+        # Build the table both ways and read each back in id order
+        for name, n in [('serial', 1), ('parallel', workers)]:
+            start = time.perf_counter()
+            model_fct_electric_brew(model = os.path.join(tmp, name), workers = n)
+
+            seconds[name] = time.perf_counter() - start
+            builds[name]  = pd.read_parquet(os.path.join(tmp, name)).sort_values('id', ignore_index = True)
+
+    finally:
+        rmtree(tmp, ignore_errors = True)
+
+    # Compare each account's rows between the builds
+    serial, parallel = builds['serial'], builds['parallel']
+    results = [{'account_number' : account,
+                'serial'         : (serial['account_number'] == account).sum(),
+                'parallel'       : (parallel['account_number'] == account).sum(),
+                'match'          : serial[serial['account_number'] == account].reset_index(drop = True) \
+                                         .equals(parallel[parallel['account_number'] == account].reset_index(drop = True))}
+               for account in serial['account_number'].cat.categories]
+
+    results.append({'account_number' : 'seconds',
+                    'serial'         : round(seconds['serial'],   2),
+                    'parallel'       : round(seconds['parallel'], 2),
+                    'match'          : serial.equals(parallel)})
+
+    return pd.DataFrame(results)
@@ -0,0 +1,240 @@
+from datetime         import datetime
+from re               import compile, DOTALL, Pattern
+from typing           import Dict, Iterator, Tuple
+from utils.runtime    import read_data
+
+import os
+import pandas as pd
+
+'''
+Contains the bill parsers behind `scrape_bills`, one per utility or supplier format. Each format declares a rule that
+recognizes its bills, how their pages are extracted, a parser that turns those pages into records, and where the
+records are written, so supporting a new community-solar supplier means adding one parser and one entry to `PARSERS`.
+
+Every parser takes the extracted pages of any number of bills (a DataFrame with `file_path`, `page_number` and
+`content`, as `load_data_files` returns for PDFs) and returns one row per record. Its records must include `FIELDS`,
+and may add any fields specific to the format.
+
+Variables:
+    - FIELDS  (List[str])                 : The fields every parser's records share, whatever the format.
+    - PARSERS (Dict[str, Dict[str, Any]]) : Maps each format to its detection rule, extraction options, parser and
+                                            output directory.
+
+Functions:
+    - parse_cmp_bills    : Parses CMP bills into one record per delivery group.
+    - parse_ampion_bills : Parses Ampion invoices into one record per utility account.
+'''
+
+FIELDS = ['file_path', 'invoice_number', 'account_number', 'supplier', 'interval_start', 'interval_end']
+
+def _first_group(pattern : Pattern,
+                 text    : str,
+                 default : str = "0") -> str:
+    '''
+    Searches for a precompiled pattern in text and returns either the first group if found or the default value.
+    '''
+
+    match = pattern.search(text)
+    return match.group(1) if match else default
+
+# Regular expressions for CMP data fields, compiled once rather than on every search
+r_cmp = {'amount_due'       : compile(r"Amount Due.*?\$\s*(\d+\.\d{2})", DOTALL),
+         'delivery_tax'     : compile(r"Maine Sales Tax \+\$(\d+\.\d{2})", DOTALL),
+         'delivery_group'   : compile(r"Delivery Charges:.*?\(\s*(\d{2}/\d{2}/\d{4})\s*-\s*(\d{2}/\d{2}/\d{4})\s*\)", DOTALL),
+         'group_boundary'   : compile(r"\s*Delivery Charges:"),
+         'service_charge'   : compile(r"Service Charge.*?\+\$(\d+\.\d{2})", DOTALL),
+         'delivery_service' : compile(r"Delivery Service: ([\d,]+) KWH (?:@\$\d+\.\d{6} )?\+\$(\d+\.\d{2})", DOTALL),
+         'supplier_info'    : compile(r"Prior Balance for ([A-Z\s\w.]+)(?: Supplier)? \$\d+\.\d{2}", DOTALL),
+         'kwh_supplied'     : compile(r"Energy Charge ([\d,]+) KWH", DOTALL),
+         'supply_charge'    : compile(r"Energy Charge.*?\+\$(\d+\.\d{2})", DOTALL),
+         'supply_tax'       : compile(r"Maine Sales Tax \+\$(\d+\.\d{2})", DOTALL)}
+
+def _cmp_delivery_groups(text : str) -> Iterator[Tuple[str, str, str]]:
+    '''
+    Splits the delivery page of a CMP bill into its delivery groups in a single pass, yielding each group's start date,
+    end date, and content from its start date up to the next "Delivery Charges:" heading (or the end of the page).
+    '''
+
+    for group in r_cmp['delivery_group'].finditer(text):
+        boundary = r_cmp['group_boundary'].search(text, group.end())
+        yield group.group(1), group.group(2), text[group.start(1):boundary.start() if boundary else len(text)]
+
+def _cmp_supplier(pages : Dict[int, str]) -> Dict[str, str]:
+    '''
+    Finds the first page from page 3 onward that names a supplier, and extracts the supplier's fields from it. Every
+    delivery group on a bill shares these, so they're looked up once per file.
+    '''
+
+    for number, text in pages.items():
+        if number >= 3 and r_cmp['supplier_info'].search(text):
+            return {'supplier'      : _first_group(r_cmp['supplier_info'], text, "").strip().replace(" Supplier", ""),
+                    'kwh_supplied'  : _first_group(r_cmp['kwh_supplied'],  text).replace(",", ""),
+                    'supply_charge' : _first_group(r_cmp['supply_charge'], text),
+                    'supply_tax'    : _first_group(r_cmp['supply_tax'],    text)}
+
+    return {'supplier': "", 'kwh_supplied': "0", 'supply_charge': "0", 'supply_tax': "0"}
+
+def parse_cmp_bills(pages : pd.DataFrame) -> pd.DataFrame:
+    '''
+    Parses CMP bills into one record per delivery group, with the bill's amount due, delivery tax and supplier fields
+    repeated on each of its groups.
+
+    Methodology:
+        1. Extract the bill-level fields from pages 1 and 2 using precompiled regular expressions.
+        2. Look up the supplier once per file, on the first page from page 3 onward that names one.
+        3. Split page 2 into its delivery groups in a single pass, and extract each group's charges from its own content.
+
+    Parameters:
+        pages (pd.DataFrame) : The extracted pages of one or more CMP bills.
+
+    Returns:
+        pd.DataFrame: One record per delivery group.
+    '''
+
+    records = []
+    for file_path, row in pages.groupby("file_path"): # Adding records file-by-file
+
+        # Some string patterns can only exist on certain pages, so this helps narrow the search
+        page = {n: s for n, s in zip(row['page_number'], row['content'])}
+
+        # Step 1: Extract the bill-level fields
+        invoice_number = os.path.basename(file_path).split('_')[0]
+        account_number = os.path.basename(os.path.dirname(file_path))
+        amount_due     = _first_group(r_cmp['amount_due'],   page.get(1))
+        delivery_tax   = _first_group(r_cmp['delivery_tax'], page.get(2))
+
+        # Step 2: Extract supplier information, shared by every delivery group on the bill
+        supplier = _cmp_supplier(page)
+
+        # Step 3: Extract each delivery group's charges
+        for start, end, delivery_content in _cmp_delivery_groups(page.get(2)):
+
+            service_charge  = _first_group(r_cmp['service_charge'], delivery_content)
+            delivery_search = r_cmp['delivery_service'].search(delivery_content)
+            kwh_delivered   = delivery_search.group(1).replace(",", "") if delivery_search else "0"
+            delivery_charge = delivery_search.group(2)                  if delivery_search else "0"
+
+            records.append({'file_path'       : file_path,
+                            'invoice_number'  : invoice_number,
+                            'account_number'  : account_number,
+                            'amount_due'      : float(amount_due),
+                            'delivery_tax'    : float(delivery_tax),
+                            'interval_start'  : datetime.strptime(start.strip(), "%m/%d/%Y").strftime("%Y-%m-%d"),
+                            'interval_end'    : datetime.strptime(end.strip(), "%m/%d/%Y").strftime("%Y-%m-%d"),
+                            'service_charge'  : float(service_charge),
+                            'kwh_delivered'   : int(kwh_delivered),
+                            'delivery_charge' : float(delivery_charge),
+                            'supplier'        : supplier['supplier'],
+                            'kwh_supplied'    : int(supplier['kwh_supplied']),
+                            'supply_charge'   : float(supplier['supply_charge']),
+                            'supply_tax'      : float(supplier['supply_tax'])})
+
+    return pd.DataFrame(records)
+
+# Regular expressions for Ampion data fields, with named groups that become the columns `str.extractall` returns
+r_ampion = {'invoice'       : compile(r"Invoice:\s(?P<invoice_number>\d+)"),
+            'abbr_acc'      : compile(r"\*{5}(?P<abbr_number>\d+)"),
+            'dates'         : compile(r"(?P<start>\d{2}\.\d{2}\.\d{4})\s*–\s*(?P<end>\d{2}\.\d{2}\.\d{4})"),
+            'kwh'           : compile(r"(?P<kwh>\d{1,4}(?:,\d{3})*?) kWh"),
+            'prices'        : compile(r"allocated\s+\$ (?P<bill_credits>\d+(?:,\d{3})*\.\d{2})\s+"
+                                      r"\$ (?P<price_before>\d+(?:,\d{3})*\.\d{2})\s+"
+                                      r"\$ (?P<price_after>\d+(?:,\d{3})*\.\d{2})"),
+            'misc_abbr_acc' : compile(r"utility acct \*\*\*\*(?P<abbr_number>\d+):"),
+            'misc_kwh'      : compile(r"\*{4}\d+:(?P<kwh>\d+)\s*kWh"),
+            'misc_credits'  : compile(r"\$(?P<bill_credits>\d+(?:,\d{3})*\.\d{2})\s*bill credits"),
+            'misc_prices'   : compile(r"bill credits allocated @ \$\s*(?P<price_before>\d+(?:,\d{3})*\.\d{2})\s+"
+                                      r"\$\s*(?P<price_after>\d+(?:,\d{3})*\.\d{2})")}
+
+def parse_ampion_bills(pages : pd.DataFrame) -> pd.DataFrame:
+    '''
+    Parses Ampion invoices into one record per utility account on each page, plus a record for any
+    "Miscellaneous Charges", which follow a different layout.
+
+    Every field is extracted from all pages at once with `str.extractall`, which numbers each match within its page,
+    so an account's dates, kWh and prices are paired with it by page and position, as they're laid out on the invoice.
+
+    Methodology:
+        1. Extract each page's invoice number, and every match of each regular charge's fields, pairing them by position.
+        2. Extract the first match of each "Miscellaneous Charges" field from the text after that heading, on the pages
+           that have one. These charges share the dates of the page's first account.
+        3. Order the records page by page, with any miscellaneous charge after the page's regular charges.
+        4. Join the abbreviated account numbers against the curated `locations` to recover the full account numbers.
+           They're read here rather than from `utils.dataframes`, so importing the parsers doesn't load every table.
+        5. Parse the dates and numbers, and pick the price column by the invoice's year.
+
+    Parameters:
+        pages (pd.DataFrame) : The extracted pages of one or more Ampion invoices.
+
+    Returns:
+        pd.DataFrame: One record per utility account and invoice.
+    '''
+
+    content  = pages['content'].reset_index(drop = True).rename_axis('page')
+    invoices = content.str.extract(r_ampion['invoice'])['invoice_number']
+    dates    = content.str.extractall(r_ampion['dates'])
+
+    # Step 1: Pair each page's matches by position, keeping every account even if a later field is missing
+    charges = content.str.extractall(r_ampion['abbr_acc']) \
+                     .join(dates) \
+                     .join(content.str.extractall(r_ampion['kwh'])) \
+                     .join(content.str.extractall(r_ampion['prices'])) \
+                     .reset_index()
+
+    charges['suffix'] = charges['abbr_number'].str[-4:]
+
+    # Step 2: Extract the first match of each miscellaneous field, after the heading on pages that have one
+    misc_content = content[content.str.contains("Miscellaneous Charges", regex = False)] \
+                          .str.split("Miscellaneous Charges", n = 1).str[1]
+
+    misc = pd.concat([misc_content.str.extract(r_ampion[field])
+                      for field in ['misc_abbr_acc', 'misc_kwh', 'misc_credits', 'misc_prices']], axis = 1) \
+             .join(dates.xs(0, level = 'match')) \
+             .reset_index()
+
+    misc['suffix'] = misc['abbr_number']
+
+    # Step 3: Stable sorting by page keeps each page's regular charges ahead of its miscellaneous charge
+    records = pd.concat([charges, misc], ignore_index = True).sort_values('page', kind = 'stable')
+
+    # Step 4: Map abbreviated account numbers to full account numbers, keeping the abbreviation when there's no match
+    locations = read_data('./data/cmp/curated/locations', schema = 'locations')
+    accounts  = pd.DataFrame({'suffix'         : locations['account_number'].astype(str).str[-4:],
+                              'account_number' : locations['account_number'].astype(str)}) \
+                  .drop_duplicates('suffix', keep = 'last')
+
+    records = records.merge(accounts, on = 'suffix', how = 'left')
+
+    # Step 5: Parse the dates and numbers, with invoices from 2023 onward listing their price in the last column
+    year   = invoices.str[:4].astype(int)
+    before = records['page'].map(year) < 2023
+
+    return pd.DataFrame({'file_path'      : records['page'].map(pages['file_path'].reset_index(drop = True)),
+                         'invoice_number' : records['page'].map(invoices),
+                         'account_number' : records['account_number'].fillna(records['abbr_number']),
+                         'supplier'       : "Ampion",
+                         'interval_start' : pd.to_datetime(records['start'], format = "%m.%d.%Y").dt.strftime("%Y-%m-%d"),
+                         'interval_end'   : pd.to_datetime(records['end'],   format = "%m.%d.%Y").dt.strftime("%Y-%m-%d"),
+                         'kwh'            : records['kwh'].str.replace(",", "").astype(int),
+                         'bill_credits'   : records['bill_credits'].str.replace(",", "").astype(float),
+                         'price'          : records['price_before'].where(before, records['price_after'])
+                                                                   .str.replace(",", "").astype(float)})
+
+# Each format's `detect` pattern is searched for on the first page of every bill, in order, to route it to a parser.
+# Its `extract` options are passed to `extract_pages`, with regions given as fractions (left, top, right, bottom).
+PARSERS = {'cmp'    : {'detect'  : compile(r"cmpco\.com"),
+                       'extract' : {'engine'  : 'pdfium',                # Every field sits in a labeled line or block
+                                    'regions' : {1: (0, 0,    1, 0.5),   # Page 1's account summary, above the payment
+                                                                         # stub, which repeats "Amount Due" as $0.00
+                                                 2: (0, 0.05, 1, 0.6),   # Page 2's delivery groups and their tax
+                                                 3: (0, 0.15, 1, 0.5),   # The supplier's charges, which sit in the same
+                                                 4: (0, 0.15, 1, 0.5),   # band of page 3 or 4 (and page 5 is cropped
+                                                 5: (0, 0.15, 1, 0.5)}}, # the same way in case they ever move there)
+                       'parse'   : parse_cmp_bills,
+                       'raw'     : "./data/cmp/raw/bills/pdf",
+                       'output'  : "./data/cmp/raw/bills/parquet"},
+
+           'ampion' : {'detect'  : compile(r"ampion\.net"),
+                       'extract' : {'engine'  : 'pdfplumber'},           # Its price columns need the visual line layout
+                       'parse'   : parse_ampion_bills,
+                       'raw'     : "./data/ampion/raw/pdf",
+                       'output'  : "./data/ampion/raw/parquet"}}
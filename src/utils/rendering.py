@@ -0,0 +1,302 @@
+from concurrent.futures import ProcessPoolExecutor
+from glob               import glob
+from matplotlib.axes    import Axes
+from matplotlib.cm      import ScalarMappable
+from typing             import Dict, List
+from utils.runtime      import find_project_root
+
+import hashlib
+import json
+import multiprocessing  as mp
+import os
+import runpy
+import sys
+import time
+import logging          as lg
+import matplotlib.dates as mdates
+import numpy            as np
+import pandas           as pd
+
+lg.basicConfig(level  = lg.INFO,
+               format = '%(asctime)s | %(levelname)s | %(message)s')
+
+'''
+Contains utility functions that render the project's figures without a display, so the full report set can be
+regenerated as a single unattended job instead of closing `plt.show()` windows one at a time, and that keep large
+scatter plots cheap to draw no matter how many rows sit behind them.
+
+Functions:
+    - render_figures  : Discovers every figure-producing script and renders them headlessly in a process pool.
+    - lttb            : Downsamples a time series to a fixed number of points with Largest-Triangle-Three-Buckets.
+    - density_scatter : Draws a scatter plot, or a hexbin of the same data once there are too many points to draw.
+'''
+
+def _fingerprint(script : str,
+                 inputs : List[str]) -> str:
+    '''
+    Hashes everything a script's figures depend on: the sources in its own directory (which covers shared modules like
+    `flat.py` and `eda_features.py`), the `utils` sources, and the path, size and modification time of every input file.
+    '''
+
+    sha = hashlib.sha256()
+
+    sources = sorted(glob(os.path.join(os.path.dirname(script), "*.py")) +
+                     glob(os.path.join(find_project_root('./src/utils'), "*.py")))
+
+    for source in sources:
+        with open(source, 'rb') as file:
+            sha.update(file.read())
+
+    for path in inputs:
+        for file in sorted(glob(os.path.join(find_project_root(path), "**", "*"), recursive = True)):
+            if os.path.isfile(file):
+                stat = os.stat(file)
+                sha.update(f"{os.path.relpath(file, find_project_root())}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+
+    return sha.hexdigest()
+
+def _render_group(scripts : List[str]) -> List[Dict]:
+    '''
+    Runs a group of scripts, in order, inside a single worker process using the non-interactive Agg backend.
+    Each script runs as `__main__` from the project root, exactly as `make` would run it, so `plt.show()` becomes a no-op.
+    '''
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    root = find_project_root()
+    os.chdir(root) # Several scripts save figures relative to the project root
+
+    results = []
+    for script in scripts:
+
+        path  = sys.path.copy()
+        start = time.perf_counter()
+        sys.path[:0] = [os.path.dirname(script), os.path.join(root, 'src')]
+
+        try:
+            runpy.run_path(script, run_name = '__main__')
+            status = 'rendered'
+
+        except Exception as e:
+            lg.error(f"Error rendering `{os.path.relpath(script, root)}`: {e}\n")
+            status = 'failed'
+
+        finally:
+            plt.close('all')
+            sys.path[:] = path
+
+        results.append({'script'  : script,
+                        'status'  : status,
+                        'seconds' : round(time.perf_counter() - start, 2)})
+
+    return results
+
+def render_figures(scripts : List[str] = None,
+                   workers : int       = None,
+                   force   : bool      = False,
+                   ledger  : str       = './fig/.render_ledger.json',
+                   inputs  : List[str] = None) -> pd.DataFrame:
+    '''
+    Discovers every figure-producing script in `/src/` and renders them headlessly with the Agg backend in a process pool,
+    skipping any script whose inputs haven't changed since it was last rendered.
+
+    Methodology:
+        1. Discover all scripts under `src/eda` and `src/analysis` that call `savefig`.
+        2. Fingerprint each script against its sources and input data, and compare it to the ledger of the last render.
+        3. Group the scripts that can't safely run side by side:
+           a. Scripts that call `connect_to_db` share one group, since DuckDB holds a file lock on `electric_brew.db`.
+           b. Scripts that import each other's pickled outputs (e.g. the `jp` chain) share one group per directory.
+           c. Every other script is its own group.
+        4. Render each group in a process pool, running the scripts within a group in order.
+        5. Record the fingerprint of every successful render in the ledger.
+
+    Parameters:
+        scripts (List[str]) : Paths of the scripts to render. Defaults to every discovered figure-producing script.
+        workers (int)       : Number of worker processes. Defaults to the number of CPUs.
+        force   (bool)      : Whether to render scripts even when their fingerprints are unchanged. Defaults to False.
+        ledger  (str)       : Path to the JSON ledger of fingerprints from the last successful render.
+        inputs  (List[str]) : Directories whose files feed the figures, relative to the project root. Defaults to the
+                              curated CMP and Ampion data and the modeled tables.
+
+    Returns:
+        pd.DataFrame: One row per script with its render `status` ('rendered', 'skipped' or 'failed') and `seconds`.
+    '''
+
+    if inputs is None:
+        inputs = ['./data/cmp/curated', './data/ampion/curated', './data/modeled']
+
+    # Step 1: Discover all figure-producing scripts
+    if scripts is None:
+        scripts = []
+        for script in sorted(glob(find_project_root('./src/eda/*.py')) +
+                             glob(find_project_root('./src/analysis/**/*.py'), recursive = True)):
+            with open(script) as file:
+                if 'savefig' in file.read():
+                    scripts.append(script)
+
+    scripts = [os.path.abspath(script) for script in scripts]
+
+    # Step 2: Fingerprint each script and compare against the ledger
+    ledger_path = find_project_root(ledger)
+    try:
+        with open(ledger_path) as file:
+            rendered = json.load(file)
+
+    except (FileNotFoundError, json.JSONDecodeError):
+        rendered = {}
+
+    fingerprints = {script: _fingerprint(script, inputs) for script in scripts}
+    key          = lambda script: os.path.relpath(script, find_project_root())
+    stale        = [script for script in scripts if force or rendered.get(key(script)) != fingerprints[script]]
+    results      = [{'script': script, 'status': 'skipped', 'seconds': 0.0} for script in scripts if script not in stale]
+
+    # Step 3: Group scripts that share a database lock or pickled state
+    groups = {}
+    for script in stale:
+        with open(script) as file:
+            source = file.read()
+
+        group = ('duckdb'                if 'connect_to_db' in source else
+                 os.path.dirname(script) if 'from analysis.' in source else
+                 script)
+        groups.setdefault(group, []).append(script)
+
+    lg.info(f"Rendering {len(stale)} of {len(scripts)} scripts across {len(groups)} groups.")
+
+    # Step 4: Render each group in a process pool
+    if groups:
+        with ProcessPoolExecutor(max_workers = workers or os.cpu_count(),
+                                 mp_context  = mp.get_context('spawn')) as pool:
+            for group_results in pool.map(_render_group, groups.values()):
+                results.extend(group_results)
+
+    # Step 5: Record the fingerprints of successful renders
+    for result in results:
+        if result['status'] == 'rendered':
+            rendered[key(result['script'])] = fingerprints[result['script']]
+
+    os.makedirs(os.path.dirname(ledger_path), exist_ok = True)
+    with open(ledger_path, 'w') as file:
+        json.dump(rendered, file, indent = 2, sort_keys = True)
+
+    results = pd.DataFrame(results).assign(script = lambda df: df['script'].map(key)).sort_values('script')
+    lg.info(f"Render complete: {results['status'].value_counts().to_dict()}\n")
+
+    return results.reset_index(drop = True)
+
+def _as_numeric(values : pd.Series) -> np.ndarray:
+    '''
+    Converts a Series to floats, mapping datetimes onto Matplotlib's date numbers so they still sit on a date axis.
+    '''
+
+    values = pd.Series(values)
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return mdates.date2num(values.to_numpy())
+
+    return values.to_numpy(dtype = float)
+
+def lttb(x     : pd.Series,
+         y     : pd.Series,
+         n_out : int = 5000) -> np.ndarray:
+    '''
+    Downsamples a time series with the Largest-Triangle-Three-Buckets algorithm, returning the positions of the points
+    to keep. The result always includes the first and last points, and keeps the peaks and troughs that define the
+    series' visual shape, which plain decimation tends to drop.
+
+    Methodology:
+        1. Split every point between the first and the last into `n_out - 2` buckets of (nearly) equal size.
+        2. Walking the buckets in order, keep the point that forms the largest triangle with the previously kept point
+           and the average of the next bucket.
+
+    Parameters:
+        x     (pd.Series) : The x values (numeric or datetime), sorted in ascending order.
+        y     (pd.Series) : The y values, aligned with `x`.
+        n_out (int)       : The number of points to keep. Defaults to 5000.
+
+    Returns:
+        np.ndarray: The sorted positions of the kept points, suitable for `.iloc`.
+    '''
+
+    x, y = _as_numeric(x), _as_numeric(y)
+    n    = len(x)
+
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    # Step 1: Bucket edges for every point between the first and the last
+    edges = (np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(int) + 1
+    edges = np.append(edges, n)
+
+    # Step 2: Keep the point forming the largest triangle in each bucket
+    keep    = np.empty(n_out, dtype = int)
+    keep[0] = a = 0
+
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_x     = x[end:edges[i + 2]].mean()
+        next_y     = y[end:edges[i + 2]].mean()
+
+        area        = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        keep[i + 1] = a = start + int(np.argmax(area))
+
+    keep[-1] = n - 1
+
+    return keep
+
+def density_scatter(ax         : Axes,
+                    x          : pd.Series,
+                    y          : pd.Series,
+                    c          : pd.Series = None,
+                    max_points : int       = 50000,
+                    gridsize   : int       = 150,
+                    **kwargs) -> ScalarMappable:
+    '''
+    Draws `x` against `y` as an ordinary scatter plot when there are at most `max_points` points. Beyond that, it bins
+    the points into a hexbin of the same extent, so the figure draws a fixed number of cells regardless of row count.
+
+    Methodology:
+        1. Fall back to `ax.scatter` for small inputs, passing along every keyword argument.
+        2. Otherwise, convert datetime columns to date numbers and restore the date formatting on that axis.
+        3. Draw a hexbin colored by the mean of `c` in each cell, or by the count of points if `c` isn't given.
+
+    Parameters:
+        ax         (Axes)      : The axes to draw on.
+        x          (pd.Series) : The x values (numeric or datetime).
+        y          (pd.Series) : The y values (numeric or datetime).
+        c          (pd.Series) : Optional values to color by. Defaults to None.
+        max_points (int)       : The most points to draw individually before switching to a hexbin. Defaults to 50000.
+        gridsize   (int)       : The number of hexagons across the x-axis. Defaults to 150.
+        **kwargs               : Passed to `ax.scatter` or `ax.hexbin` (e.g. `cmap`, `vmin`, `vmax`).
+
+    Returns:
+        ScalarMappable: The drawn collection, for use with `plt.colorbar`.
+    '''
+
+    # Step 1: Draw small inputs point by point
+    if len(x) <= max_points:
+        return ax.scatter(x = x, y = y, c = c, **kwargs)
+
+    # Step 2: Keep date axes for datetime inputs
+    if pd.api.types.is_datetime64_any_dtype(x):
+        ax.xaxis_date()
+    if pd.api.types.is_datetime64_any_dtype(y):
+        ax.yaxis_date()
+
+    # Step 3: Bin the points into hexagons
+    kwargs.pop('edgecolor', None) # Hexbin cells take the color of their face
+
+    return ax.hexbin(x                 = _as_numeric(x),
+                     y                 = _as_numeric(y),
+                     C                 = None if c is None else _as_numeric(c),
+                     reduce_C_function = np.mean,
+                     gridsize          = gridsize,
+                     mincnt            = 1,
+                     **kwargs)
+
+
+if __name__ == "__main__":
+
+    render_figures()
@@ -1,17 +1,31 @@
 from alive_progress    import alive_bar
+from functools         import lru_cache
+from glob              import glob
 from matplotlib.pyplot import rcParams
-from typing            import Any, Callable
+from re                import compile, escape, search
+from typing            import Any, Callable, Dict, List, Tuple
+from utils.schemas     import apply_schema
 
+import hashlib
+import json
 import os
 import pickle
 import duckdb          as dd
 import logging         as lg
+import numpy           as np
 import pandas          as pd
+import pyarrow         as pa
 import pyarrow.parquet as pq
 
 lg.basicConfig(level  = lg.INFO, 
                format = '%(asctime)s | %(levelname)s | %(message)s')
 
+# Splits SQL into its string literals and the code between them, strips its line comments, and finds the files a view
+# or query reads
+r_literals = compile(r"('(?:[^']|'')*')")
+r_comments = compile(r"('(?:[^']|'')*')|--[^\n]*") # Matches literals too, so a `--` inside one isn't taken for a comment
+r_sources  = compile(r"read_(?:parquet|csv_auto|csv)\(\[?'([^']+)'")
+
 '''
 Contains utility functions that configure the runtime environment and are called as scripts are
 executed. These include `rcParams` and specific paradigms for reading data into dataframes.
@@ -21,6 +35,14 @@ Functions:
     - find_project_root : Finds the project directory by searching for a specified identifier in the directory tree.
     - read_data         : Reads a .parquet file into a Pandas DataFrame.
     - connect_to_db     : Connects to DuckDB and creates specified views within it if not already present.
+    - cached_query      : Runs a DuckDB query, or reads its result from a cache if its SQL and data are unchanged.
+    - pickle_and_load   : Loads pickled data if available, otherwise generates and pickles it.
+    - memmap_matrix     : Stores a feature matrix once as a dense .npy file and memory-maps it read-only.
+    - column_means      : Computes and caches the column means of a memory-mapped matrix.
+    - hash_file         : Hashes a file's contents, so a ledger recognizes a file by what it holds rather than its name.
+    - read_ledger       : Reads a JSON ledger of files already seen, or an empty one if there's none.
+    - write_ledger      : Writes a JSON ledger atomically, so a run stopped mid-write never leaves it torn.
+    - execution_config  : Resolves the worker count, thread cap, backend and seed shared by every analysis model.
 '''
 
 def setup_plot_params():
@@ -99,20 +121,27 @@ def find_project_root(rel_path : str = None,
     except Exception as e:
         lg.error(f"Error finding project root: {e}\n")
 
-def read_data(file_path: str) -> pd.DataFrame:
+def read_data(file_path : str,
+              schema    : str         = None,
+              filters   : List[Tuple] = None) -> pd.DataFrame:
     '''
     Reads a .parquet file from a specified relative path into a Pandas DataFrame.
     The function automatically resolves the path relative to the project's /data/ directory.
 
     Parameters:
-        file_path (str): Relative path to the .parquet file, starting from the /data/ directory.
+        file_path (str)         : Relative path to the .parquet file, starting from the /data/ directory.
+        schema    (str)         : Name of the table in `SCHEMAS` whose compact dtypes to apply. Defaults to None.
+        filters   (List[Tuple]) : Row filters like `[('account_number', '=', '30010320353')]`, which skip the partitions
+                                  and row groups that can't match. Defaults to None.
         
     Returns:
         pd.DataFrame: DataFrame containing the data read from the .parquet file.
     '''
 
     # Read the .parquet file and return as a Pandas DataFrame
-    return pq.read_table(find_project_root(file_path)).to_pandas()
+    df = pq.read_table(find_project_root(file_path), filters = filters).to_pandas()
+
+    return apply_schema(df, schema) if schema else df
 
 def connect_to_db(path : str = './data/sql/electric_brew.db',
                   vws  : dict = {'meter_usage'       : './data/cmp/curated/meter_usage',
@@ -157,19 +186,113 @@ def connect_to_db(path : str = './data/sql/electric_brew.db',
 
     return db
 
-def pickle_and_load(fun  : Callable, 
-                    name : str, 
-                    base : str = './src/analysis/jp/pickled', 
+def cached_query(db        : dd.DuckDBPyConnection,
+                 sql       : str,
+                 cache     : str = './data/cache/queries',
+                 max_bytes : int = 512 * 2**20) -> pd.DataFrame:
+    '''
+    Runs a query against a connection from `connect_to_db`, or reads its result from a cache when the same query has
+    already been run against the same data, so regenerating a figure after a change to its plotting code doesn't scan
+    the fact table again.
+
+    Methodology:
+        1. Normalize the SQL, dropping comments, collapsing whitespace and lowercasing everything outside of string
+           literals, so queries that differ only in formatting share a result.
+        2. Find the files the query reads, through the views it names and any `read_parquet` calls of its own, and
+           fingerprint them by path, size and modification time.
+        3. Key the result on a hash of both, and read it from its Arrow IPC file if one exists, marking it as used.
+        4. Otherwise, run the query and store its result as Arrow IPC, with the pandas metadata that restores the same
+           dtypes on read.
+        5. Evict the least recently used results until the cache holds no more than `max_bytes`.
+
+    Results keyed on an old fingerprint are never read again once the data changes, so they simply age out of the cache.
+
+    Parameters:
+        db        (dd.DuckDBPyConnection) : The connection to run the query on.
+        sql       (str)                   : The query.
+        cache     (str)                   : Directory the results are stored in. Defaults to './data/cache/queries'.
+        max_bytes (int)                   : The most bytes of results kept. Defaults to 512 MB.
+
+    Returns:
+        pd.DataFrame: The query's result, as `db.execute(sql).df()` would return it.
+    '''
+
+    # Step 1: Normalize the SQL, leaving string literals as they are and dropping comments only outside of them
+    parts      = r_literals.split(r_comments.sub(lambda match: match.group(1) or " ", sql).strip())
+    normalized = "".join(part if i % 2 else " ".join(part.lower().split()) for i, part in enumerate(parts)).rstrip("; ")
+
+    # Step 2: Fingerprint the files read by the query, and by every view it names, including views within views
+    views   = dict(db.execute("SELECT view_name, sql FROM duckdb_views() WHERE NOT internal").fetchall())
+    sources = r_sources.findall(normalized)
+    pending = [normalized]
+
+    while pending:
+        text = pending.pop()
+        for view in [view for view in views if search(rf"\b{escape(view.lower())}\b", text.lower())]:
+            pending.append(views.pop(view))
+            sources += r_sources.findall(pending[-1])
+
+    fingerprint = sorted([file, os.path.getsize(file), os.stat(file).st_mtime_ns]
+                         for source in sources for file in glob(source, recursive = True))
+
+    # Step 3: Read a cached result for the same query and data
+    key  = hashlib.sha256(json.dumps([normalized, fingerprint]).encode()).hexdigest()
+    path = os.path.join(find_project_root(cache), f"{key}.arrow")
+
+    try:
+        with pa.memory_map(path) as source:
+            result = pa.ipc.open_file(source).read_all().to_pandas()
+
+        os.utime(path) # Marks the result as recently used
+        return result
+
+    except (FileNotFoundError, pa.ArrowInvalid):
+        pass
+
+    # Step 4: Run the query and store its result
+    result = db.execute(sql).df()
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        table = pa.Table.from_pandas(result, preserve_index = False)
+
+        with pa.OSFile(f"{path}.tmp", 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        os.replace(f"{path}.tmp", path)
+
+        # Step 5: Evict the least recently used results beyond the limit
+        results = sorted(glob(os.path.join(os.path.dirname(path), "*.arrow")), key = os.path.getmtime, reverse = True)
+        total   = 0
+        for file in results:
+            total += os.path.getsize(file)
+            if total > max_bytes and file != path:
+                os.remove(file)
+
+    except Exception as e:
+        lg.error(f"Couldn't cache the result of a query, which was returned uncached: {e}\n")
+
+    return result
+
+def pickle_and_load(fun     : Callable, 
+                    name    : str, 
+                    base    : str = './src/analysis/jp/pickled', 
                     *args, 
+                    refresh : bool = False,
                     **kwargs) -> Any:
     '''
     Attempts to load pickled data if available, otherwise runs the data_func to generate data.
 
+    With `refresh`, pickled data is passed back to the Callable as `previous`, which returns it unchanged when it's still
+    current, or an updated result that then replaces the pickle. A pickle is only ever replaced once its new data exists,
+    so a failed update leaves the previous data in place.
+
     Parameters:
-        fun  (Callable) : The function to generate data if pickled data is not available.
-        name (str)      : Name of the pickle file.
-        base (str)      : Base directory where pickle files are stored.
-        *args, **kwargs : Arguments passed to the Callable.
+        fun     (Callable) : The function to generate data if pickled data is not available.
+        name    (str)      : Name of the pickle file.
+        base    (str)      : Base directory where pickle files are stored.
+        refresh (bool)     : Whether to pass pickled data to the Callable as `previous` to be brought up to date.
+        *args, **kwargs    : Arguments passed to the Callable.
 
     Returns:
         Any: Data loaded from pickle or generated by the Callable.
@@ -179,17 +302,24 @@ def pickle_and_load(fun  : Callable,
 
     # Construct the full file path
     pkl_path = os.path.join(find_project_root(base), name)
+    previous = None
 
     try:
 
         with open(pkl_path, 'rb') as file:
             lg.info(f"Loading pickled data from {name}.")
-            return pickle.load(file)
+            previous = pickle.load(file)
+
+        if not refresh:
+            return previous
+
+        kwargs['previous'] = previous
         
     except (FileNotFoundError, EOFError):
 
         os.makedirs(os.path.dirname(pkl_path), exist_ok = True) # Create the base directory if it doesn't exist
 
+    if previous is None:
         with alive_bar(title   = f"Generating data using `{fun.__name__}` and pickling",
                        bar     = None,
                        monitor = False,
@@ -197,9 +327,200 @@ def pickle_and_load(fun  : Callable,
             
             data = fun(*args, **kwargs)
             bar()
+    else:
+        data = fun(*args, **kwargs) # Usually returns `previous` unchanged, so it runs without a progress bar
 
-        # Pickle the new data for future use
-        with open(pkl_path, 'wb') as file:
+    # Pickle the new data for future use, replacing the previous pickle only once it's fully written
+    if data is not previous:
+        with open(f"{pkl_path}.tmp", 'wb') as file:
             pickle.dump(data, file)
 
-        return data
+        os.replace(f"{pkl_path}.tmp", pkl_path)
+
+    return data
+
+def _matrix_hash(X          : Any,
+                 chunk_size : int = 65536) -> str:
+    '''
+    Hashes a feature matrix's shape and values, a chunk of rows at a time for dense arrays, so a stored copy is only
+    reused while it holds the same values.
+    '''
+
+    sha = hashlib.sha256(repr(X.shape).encode())
+
+    if hasattr(X, 'tocsr'):
+        X = X.tocsr()
+        for part in (X.data, X.indices, X.indptr):
+            sha.update(np.ascontiguousarray(part).tobytes())
+
+    else:
+        for start in range(0, X.shape[0], chunk_size):
+            sha.update(np.ascontiguousarray(X[start:start + chunk_size]).tobytes())
+
+    return sha.hexdigest()
+
+def memmap_matrix(X          : Any,
+                  name       : str,
+                  base       : str = './src/analysis/jp/pickled',
+                  dtype      : str = 'float32',
+                  chunk_size : int = 65536) -> np.memmap:
+    '''
+    Stores a feature matrix once as a dense `.npy` file and returns it memory-mapped and read-only, so every script and
+    parallel worker reading it shares the operating system's page cache instead of holding its own dense copy.
+
+    Methodology:
+        1. Reuse the stored matrix if one with the same name, shape and dtype already exists, and the hash of `X` stored
+           next to it matches, so a regenerated matrix of the same shape is never served stale.
+        2. Otherwise, densify the (possibly sparse) matrix `chunk_size` rows at a time into a new `.npy` file, so the 
+           full dense matrix is never held in memory.
+        3. Map the file back in read-only mode.
+
+    Parameters:
+        X          (Any) : The feature matrix, either a SciPy sparse matrix or a NumPy array.
+        name       (str) : Name of the `.npy` file.
+        base       (str) : Base directory where the file is stored, alongside the pickles it was derived from.
+        dtype      (str) : The dtype of the stored matrix. Defaults to 'float32', the precision tree models split on.
+        chunk_size (int) : The number of rows densified at a time.
+
+    Returns:
+        np.memmap: The read-only, memory-mapped dense matrix.
+    '''
+
+    npy_path  = os.path.join(find_project_root(base), name)
+    hash_path = npy_path.replace('.npy', '.sha256')
+    digest    = _matrix_hash(X, chunk_size)
+
+    # Step 1: Reuse the stored matrix when it matches
+    try:
+        matrix = np.load(npy_path, mmap_mode = 'r')
+        with open(hash_path) as file:
+            if matrix.shape == X.shape and matrix.dtype == np.dtype(dtype) and file.read() == digest:
+                return matrix
+
+    except (FileNotFoundError, ValueError):
+        pass
+
+    # Step 2: Densify the matrix into the file in chunks, dropping any column means cached for a previous version
+    os.makedirs(os.path.dirname(npy_path), exist_ok = True)
+    if os.path.exists(npy_path.replace('.npy', '.means.npy')):
+        os.remove(npy_path.replace('.npy', '.means.npy'))
+
+    matrix = np.lib.format.open_memmap(npy_path, mode = 'w+', dtype = dtype, shape = X.shape)
+
+    for start in range(0, X.shape[0], chunk_size):
+        chunk = X[start:start + chunk_size]
+        matrix[start:start + chunk_size] = chunk.toarray() if hasattr(chunk, 'toarray') else chunk
+
+    matrix.flush()
+    del matrix
+
+    with open(hash_path, 'w') as file:
+        file.write(digest)
+
+    # Step 3: Map the file back in read-only mode
+    return np.load(npy_path, mmap_mode = 'r')
+
+def column_means(matrix     : np.ndarray,
+                 chunk_size : int = 65536) -> np.ndarray:
+    '''
+    Computes the column means of a memory-mapped matrix from `memmap_matrix`, accumulating in float64 a chunk of rows at
+    a time. The result is cached in a `.means.npy` file next to the matrix, so it's only computed once per matrix.
+
+    Parameters:
+        matrix     (np.ndarray) : The memory-mapped matrix.
+        chunk_size (int)        : The number of rows summed at a time.
+
+    Returns:
+        np.ndarray: The mean of every column.
+    '''
+
+    means_path = matrix.filename.replace('.npy', '.means.npy') if isinstance(matrix, np.memmap) else None
+
+    if means_path and os.path.exists(means_path):
+        return np.load(means_path)
+
+    totals = np.zeros(matrix.shape[1], dtype = np.float64)
+    for start in range(0, matrix.shape[0], chunk_size):
+        totals += matrix[start:start + chunk_size].sum(axis = 0, dtype = np.float64)
+
+    means = totals / matrix.shape[0]
+
+    if means_path:
+        np.save(means_path, means)
+
+    return means
+
+def hash_file(file : str) -> str:
+    '''
+    Hashes a file's contents in 1 MB chunks, so a ledger recognizes a file by what it holds rather than its name.
+    '''
+
+    sha = hashlib.sha256()
+    with open(file, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+def read_ledger(ledger : str) -> Dict[str, Dict[str, Any]]:
+    '''
+    Reads a JSON ledger, such as the ingest mode's files or the downloader's documents already seen, or an empty one if
+    there's none. The ledger's path is relative to the project root, unless it's absolute.
+    '''
+
+    try:
+        with open(os.path.join(find_project_root(), ledger)) as file:
+            return json.load(file)
+
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_ledger(ledger  : str,
+                 entries : Dict[str, Dict[str, Any]]):
+    '''
+    Writes a ledger to a temporary file and moves it into place, so a run stopped mid-write never leaves it torn.
+    '''
+
+    path = os.path.join(find_project_root(), ledger)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+
+    with open(f"{path}.tmp", 'w') as file:
+        json.dump(entries, file, indent = 2, sort_keys = True)
+
+    os.replace(f"{path}.tmp", path)
+
+@lru_cache(maxsize = None)
+def execution_config() -> Dict[str, Any]:
+    '''
+    Resolves the parallel execution settings shared by every analysis model, so worker counts, thread caps and seeds are
+    set in one place instead of each stage asking for every core with `n_jobs = -1`.
+
+    Each setting can be overridden through an environment variable, e.g. `ELECTRIC_BREW_N_JOBS=8 make jp-all`:
+        - ELECTRIC_BREW_N_JOBS   : Worker processes for joblib-parallel fits. Defaults to -1, one per core.
+        - ELECTRIC_BREW_THREADS  : BLAS and OpenMP threads per worker process. Defaults to the cores left per worker, so
+                                   that workers × threads never exceeds the machine.
+        - ELECTRIC_BREW_BACKEND  : The joblib backend for the process-based searches. Defaults to 'loky'.
+        - ELECTRIC_BREW_SEED     : The seed for every sample, split and estimator. Defaults to 0.
+
+    Nothing is set globally here. The process-based searches and cross-validations apply 'backend' and 'threads' 
+    themselves, with `with parallel_config(backend = config['backend'], inner_max_num_threads = config['threads'])`, 
+    so tree ensembles like RandomForest and IsolationForest keep their thread backend and share their data in memory.
+
+    The result is cached, so the settings are resolved once per process no matter how many stages import it.
+
+    Returns:
+        Dict[str, Any]: The resolved 'n_jobs', 'threads', 'backend' and 'seed'.
+    '''
+
+    # Read the settings from the environment
+    n_jobs  = int(os.environ.get('ELECTRIC_BREW_N_JOBS', -1))
+    workers = os.cpu_count() if n_jobs < 0 else n_jobs
+    threads = int(os.environ.get('ELECTRIC_BREW_THREADS', max(1, os.cpu_count() // max(1, workers))))
+    config  = {'n_jobs'  : n_jobs,
+               'threads' : threads,
+               'backend' : os.environ.get('ELECTRIC_BREW_BACKEND', 'loky'),
+               'seed'    : int(os.environ.get('ELECTRIC_BREW_SEED', 0))}
+
+    lg.info(f"Execution config: {config}")
+
+    return config
@@ -0,0 +1,138 @@
+from typing import Any, Dict
+
+import pandas as pd
+
+'''
+Declares the compact in-memory types of every curated and modeled table, so repeated strings are stored once as
+dictionary-encoded categoricals, calendar parts fit in one or two bytes, and measurements use float32 where the
+source data doesn't carry more precision than that.
+
+`write_results` applies a schema before writing, so the Parquet files store the same dictionary and narrow types, and
+`read_data` applies it again on read, so tables written before a schema changed still load compactly.
+
+It also declares how each table is stored on disk: the storage profiles (codec, level and encodings) that
+`benchmark_storage` compares, and the profile each table was assigned from those measurements.
+
+Variables:
+    - SCHEMAS   (Dict[str, Dict[str, str]]) : Maps each table to the dtype of each of its columns that should be narrowed.
+    - CODECS    (Dict[str, Dict[str, Any]]) : Maps each codec and level a profile can use to its pyarrow options.
+    - ENCODINGS (Dict[str, Dict[str, str]]) : Maps each profile suffix to the Parquet encodings it uses by dtype kind.
+    - PROFILES  (Dict[str, Dict[str, Any]]) : Maps each storage profile (a codec plus a suffix) to its options.
+    - STORAGE   (Dict[str, str])            : Maps each table to the storage profile `write_results` uses for it.
+
+Functions:
+    - apply_schema    : Casts a DataFrame's columns to the dtypes declared for a table.
+    - storage_options : Resolves a storage profile into `write_results` options for a DataFrame's columns.
+'''
+
+SCHEMAS = {'meter_usage'       : {'meter_id'              : 'category',
+                                  'interval_end_datetime' : 'category', # ~100k distinct timestamps repeated per meter
+                                  'meter_channel'         : 'int8',
+                                  'kwh'                   : 'float32'},  # Readings carry three decimals
+
+           'locations'         : {'street'                : 'category',
+                                  'label'                 : 'category',
+                                  'operational_area'      : 'category'},
+
+           'cmp_bills'         : {'invoice_number'        : 'category',
+                                  'supplier'              : 'category'},
+
+           'ampion_bills'      : {'invoice_number'        : 'category',
+                                  'supplier'              : 'category'},
+
+           'dim_datetimes'     : {'id'                    : 'int32', # The slot number, computable from any timestamp
+                                  'increment'             : 'int8',
+                                  'hour'                  : 'int8',
+                                  'week'                  : 'int8',
+                                  'month'                 : 'int8',
+                                  'month_name'            : 'category',
+                                  'quarter'               : 'int8',
+                                  'year'                  : 'int16',
+                                  'period'                : 'category'},
+
+           'dim_meters'        : {'meter_id'              : 'category',
+                                  'street'                : 'category',
+                                  'label'                 : 'category',
+                                  'operational_area'      : 'category'},
+
+           'dim_bills'         : {'invoice_number'        : 'category',
+                                  'supplier'              : 'category',
+                                  'source'                : 'category'},
+
+           'fct_electric_brew' : {'id'                    : 'int32',
+                                  'dim_datetimes_id'      : 'int32',
+                                  'dim_meters_id'         : 'int16',
+                                  'dim_bills_id'          : 'Int32',   # Nullable, since readings without a bill have none
+                                  'kwh'                   : 'float32',
+                                  'delivery_cost'         : 'float32',
+                                  'service_cost'          : 'float32',
+                                  'supply_cost'           : 'float32',
+                                  'tax_cost'              : 'float32',
+                                  'total_cost'            : 'float32'}}
+
+# Codecs and levels, crossed with the encodings below to form every profile
+CODECS    = {'snappy' : {'compression' : 'snappy', 'compression_level' : None},
+             'lz4'    : {'compression' : 'lz4',    'compression_level' : None},
+             'zstd-1' : {'compression' : 'zstd',   'compression_level' : 1},
+             'zstd-3' : {'compression' : 'zstd',   'compression_level' : 3},
+             'zstd-9' : {'compression' : 'zstd',   'compression_level' : 9}}
+
+# Encodings are keyed by dtype kind ('i' for integers, 'f' for floats). Every other column stays dictionary-encoded.
+ENCODINGS = {''       : {},
+             '-delta' : {'i' : 'DELTA_BINARY_PACKED'},   # Stores the differences between neighbors, small for keys and counts
+             '-split' : {'i' : 'DELTA_BINARY_PACKED',
+                         'f' : 'BYTE_STREAM_SPLIT'}}     # Groups the bytes of each float, so the codec sees runs of exponents
+
+PROFILES  = {codec + suffix: {**settings, 'encodings' : encodings} for codec,  settings  in CODECS.items()
+                                                                   for suffix, encodings in ENCODINGS.items()}
+
+# Chosen from `benchmark_storage`. For every table larger than a few KB, 'zstd-3-delta' came within 10% of the smallest
+# profile while writing about as fast as snappy, and read times differed by no more than run-to-run noise
+STORAGE   = {'meter_usage'       : 'zstd-3-delta', # 13.5 MB -> 3.8 MB
+             'locations'         : 'snappy',       # Tables of a few KB come out the same under every profile
+             'cmp_bills'         : 'snappy',
+             'ampion_bills'      : 'snappy',
+             'dim_datetimes'     : 'zstd-3-delta', # 1.6 MB -> 0.7 MB
+             'dim_meters'        : 'snappy',
+             'dim_bills'         : 'zstd-3-delta',
+             'fct_electric_brew' : 'zstd-3-delta'} # 10.0 MB -> 4.2 MB
+
+def apply_schema(df     : pd.DataFrame,
+                 schema : str) -> pd.DataFrame:
+    '''
+    Casts the columns of a DataFrame to the compact dtypes declared for a table in `SCHEMAS`. Columns the schema doesn't
+    mention, or that the DataFrame doesn't have, are left as they are.
+
+    Parameters:
+        df     (pd.DataFrame) : The DataFrame to cast.
+        schema (str)          : The name of the table in `SCHEMAS`.
+
+    Returns:
+        pd.DataFrame: The same DataFrame with its declared columns cast.
+    '''
+
+    dtypes = {col: dtype for col, dtype in SCHEMAS[schema].items() if col in df.columns}
+
+    return df.astype(dtypes)
+
+def storage_options(df      : pd.DataFrame,
+                    profile : str) -> Dict[str, Any]:
+    '''
+    Resolves a storage profile from `PROFILES` into the compression options `write_results` passes to pyarrow, assigning
+    the profile's encodings to the DataFrame's columns by dtype.
+
+    Parameters:
+        df      (pd.DataFrame) : The DataFrame about to be written, already cast to its schema.
+        profile (str)          : The name of the profile in `PROFILES`.
+
+    Returns:
+        Dict[str, Any]: The profile's `compression` and `compression_level`, plus the `column_encoding` of every column
+                        whose dtype the profile encodes.
+    '''
+
+    settings = PROFILES[profile]
+
+    return {'compression'       : settings['compression'],
+            'compression_level' : settings['compression_level'],
+            'column_encoding'   : {col: settings['encodings'][df[col].dtype.kind] for col in df.columns
+                                   if df[col].dtype.kind in settings['encodings']}}
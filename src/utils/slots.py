@@ -0,0 +1,342 @@
+from glob          import glob
+from typing        import Any, Dict, List
+from utils.runtime import find_project_root, read_data
+
+import json
+import os
+import time
+import logging     as lg
+import numpy       as np
+import pandas      as pd
+
+lg.basicConfig(level  = lg.INFO,
+               format = '%(asctime)s | %(levelname)s | %(message)s')
+
+'''
+Contains a dense store of 15-minute interval data, holding every meter and channel's readings as one contiguous float32
+array indexed by slot number from a fixed epoch, with a bitmap marking the slots that hold a reading.
+
+In `meter_usage`, every reading is a row carrying its own timestamp string, meter and account. Here a reading's
+timestamp is implied by its position, so the whole history of every meter is a (series × slots) matrix that's
+memory-mapped from disk rather than parsed, and whole days are runs of 96 slots. Rolling windows, hour-of-day by month
+profiles and per-meter statistics become reshapes and reductions along an axis rather than groupbys over every row.
+
+Slots are counted in local wall-clock time, the same time `interval_end_datetime` is written in, so a slot's hour is
+the hour CMP reports. The hour repeated when clocks fall back therefore holds both of its readings in one slot, summed,
+and slots in the hour skipped when they spring forward are simply gaps.
+
+Variables:
+    - EPOCH     (pd.Timestamp) : The local time of slot 0, midnight of the first day any slot can hold.
+    - SLOT      (pd.Timedelta) : The length of one slot.
+    - SLOTS_DAY (int)          : The number of slots in a day, as every day of the store is whole.
+    - SERIES    (List[str])    : The columns that identify a series, one per meter and channel.
+
+Functions:
+    - slot_index     : Converts timestamps into slot numbers from `EPOCH`.
+    - slot_times     : Converts slot numbers back into timestamps.
+    - build_slots    : Writes the curated `meter_usage` readings into the dense store.
+    - load_slots     : Memory-maps the dense store, rebuilding it first if `meter_usage` has changed.
+    - series_stats   : Computes each series' count, total, mean, max and extent of readings.
+    - hourly_profile : Totals each series' readings by month and hour of the day.
+    - rolling_total  : Sums each series' readings over a rolling window of slots.
+    - check_slots    : Compares the store's aggregates against the same groupbys over `meter_usage`.
+'''
+
+EPOCH     = pd.Timestamp('2020-01-01')
+SLOT      = pd.Timedelta(minutes = 15)
+SLOTS_DAY = 96
+SERIES    = ['meter_id', 'meter_channel']
+
+def slot_index(timestamps : pd.Series) -> np.ndarray:
+    '''
+    Converts timestamps into slot numbers from `EPOCH`. Strings are read in CMP's format (e.g. `10/1/2022 1:15:00 AM`),
+    parsing each distinct string once, as every meter repeats the same ~100k timestamps.
+
+    Parameters:
+        timestamps (pd.Series) : The timestamps, as datetimes or as strings in CMP's format.
+
+    Returns:
+        np.ndarray: The slot number of every timestamp, as int64.
+    '''
+
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        codes      = timestamps.astype('category')
+        parsed     = pd.to_datetime(codes.cat.categories, format = '%m/%d/%Y %I:%M:%S %p')
+        timestamps = pd.Series(parsed.take(codes.cat.codes.to_numpy()), index = timestamps.index)
+
+    return ((timestamps - EPOCH) // SLOT).to_numpy(dtype = np.int64)
+
+def slot_times(slots : np.ndarray) -> pd.DatetimeIndex:
+    '''
+    Converts slot numbers back into the timestamps they stand for.
+    '''
+
+    return EPOCH + pd.to_timedelta(np.asarray(slots) * SLOT.value, unit = 'ns')
+
+def _fingerprint(source : str) -> List[List[Any]]:
+    '''
+    Fingerprints a Parquet dataset by the path, size and modification time of every file, so the store can tell when
+    the readings it was built from have changed.
+    '''
+
+    return sorted([os.path.relpath(file, find_project_root()), os.path.getsize(file), os.stat(file).st_mtime_ns]
+                  for file in glob(os.path.join(find_project_root(source), "**", "*.parquet"), recursive = True))
+
+def build_slots(source : str = "./data/cmp/curated/meter_usage",
+                store  : str = "./data/cmp/slots") -> Dict[str, Any]:
+    '''
+    Writes the curated `meter_usage` readings into the dense store, as one row of slots per meter and channel.
+
+    Methodology:
+        1. Read the readings, and number each one's series and its slot from `EPOCH`.
+        2. Sum the readings of every slot into a (series × slots) float32 matrix, padded to whole days, so the two
+           readings CMP reports for each slot of the hour repeated when clocks fall back are kept as one.
+        3. Mark every slot that holds a reading in a bitmap, packed 8 slots to a byte.
+        4. Write the matrix and bitmap as `.npy` files, and each series' meter, channel, account and service point to
+           `series.json`, along with the epoch and a fingerprint of the readings. Each file is written beside its
+           destination and moved into place, so readers never map a half-written store.
+
+    The store sits in its own directory rather than a `pickled` one, so the clean-up of pickles and `.npy` files at
+    the end of the ETL pipeline doesn't delete it.
+
+    Parameters:
+        source (str) : Path to the curated `meter_usage` dataset. Defaults to './data/cmp/curated/meter_usage'.
+        store  (str) : Directory the store is written to. Defaults to './data/cmp/slots'.
+
+    Returns:
+        Dict[str, Any]: The store's metadata, as written to `series.json`.
+    '''
+
+    # Step 1: Number every reading's series and slot
+    readings = read_data(source, schema = 'meter_usage')
+    slots    = slot_index(readings['interval_end_datetime'])
+
+    if slots.min() < 0:
+        raise ValueError(f"Readings from before {EPOCH} can't be placed in a slot.")
+
+    series   = readings[SERIES + ['account_number', 'service_point_id']].astype(str) \
+                   .drop_duplicates(SERIES).sort_values(SERIES, ignore_index = True)
+    codes    = readings[SERIES].astype(str).merge(series[SERIES].reset_index(), on = SERIES, how = 'left')['index']
+    n_slots  = -(-(slots.max() + 1) // SLOTS_DAY) * SLOTS_DAY
+
+    # Step 2: Sum the readings of each slot
+    flat     = codes.to_numpy() * n_slots + slots
+    values   = np.bincount(flat, weights = readings['kwh'].to_numpy(np.float64), minlength = len(series) * n_slots)
+
+    # Step 3: Mark the slots holding a reading
+    valid    = np.zeros(len(series) * n_slots, dtype = bool)
+    valid[flat] = True
+
+    # Step 4: Write the store
+    path     = find_project_root(store)
+    os.makedirs(path, exist_ok = True)
+
+    meta     = {'epoch'       : str(EPOCH),
+                'slot'        : str(SLOT),
+                'slots'       : int(n_slots),
+                'series'      : series.to_dict('records'),
+                'fingerprint' : _fingerprint(source)}
+
+    for name, array in {'values': values.astype(np.float32).reshape(len(series), n_slots),
+                        'valid' : np.packbits(valid.reshape(len(series), n_slots), axis = 1)}.items():
+        np.save(os.path.join(path, f"{name}.tmp.npy"), array)
+        os.replace(os.path.join(path, f"{name}.tmp.npy"), os.path.join(path, f"{name}.npy"))
+
+    with open(os.path.join(path, "series.tmp.json"), 'w') as file:
+        json.dump(meta, file, indent = 2)
+
+    os.replace(os.path.join(path, "series.tmp.json"), os.path.join(path, "series.json"))
+
+    lg.info(f"Wrote {valid.sum()} readings from {len(readings)} rows into {len(series)} series of {n_slots} slots.")
+
+    return meta
+
+def load_slots(source : str = "./data/cmp/curated/meter_usage",
+               store  : str = "./data/cmp/slots") -> Dict[str, Any]:
+    '''
+    Memory-maps the dense store, building it first if it doesn't exist, or if the readings in `source` have changed
+    since it was built.
+
+    Parameters:
+        source (str) : Path to the curated `meter_usage` dataset. Defaults to './data/cmp/curated/meter_usage'.
+        store  (str) : Directory of the store. Defaults to './data/cmp/slots'.
+
+    Returns:
+        Dict[str, Any]: The store, with:
+                        - 'series' (pd.DataFrame) : Each series' `meter_id`, `meter_channel`, `account_number` and
+                                                    `service_point_id`, in the order of the matrix's rows.
+                        - 'values' (np.memmap)    : The read-only (series × slots) float32 matrix of kWh, with 0 in
+                                                    every gap.
+                        - 'valid'  (np.ndarray)   : The (series × slots) boolean mask of slots holding a reading.
+                        - 'times'  (pd.DatetimeIndex) : The timestamp of every slot.
+    '''
+
+    path = find_project_root(store)
+
+    try:
+        with open(os.path.join(path, "series.json")) as file:
+            meta = json.load(file)
+
+        if meta['epoch'] != str(EPOCH) or meta['fingerprint'] != _fingerprint(source):
+            raise ValueError("The store is out of date")
+
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError):
+        meta = build_slots(source, store)
+
+    values = np.load(os.path.join(path, "values.npy"), mmap_mode = 'r')
+    valid  = np.unpackbits(np.load(os.path.join(path, "valid.npy")), axis = 1, count = meta['slots']).astype(bool)
+
+    return {'series' : pd.DataFrame(meta['series']).astype({'meter_channel': 'int8'}),
+            'values' : values,
+            'valid'  : valid,
+            'times'  : slot_times(np.arange(meta['slots']))}
+
+def series_stats(slots : Dict[str, Any]) -> pd.DataFrame:
+    '''
+    Computes each series' number of readings, total, mean and max kWh, and the first and last slots it has a reading
+    in, as reductions along the slot axis of the store.
+
+    Parameters:
+        slots (Dict[str, Any]) : The store, from `load_slots`.
+
+    Returns:
+        pd.DataFrame: One row per series with its identifiers, `readings`, `kwh`, `mean`, `max`, `first` and `last`.
+    '''
+
+    values, valid = slots['values'], slots['valid']
+    readings      = valid.sum(axis = 1)
+    total         = values.sum(axis = 1, dtype = np.float64)
+
+    return slots['series'].assign(readings = readings,
+                                  kwh      = total,
+                                  mean     = total / np.maximum(readings, 1),
+                                  max      = np.where(valid, values, -np.inf).max(axis = 1),
+                                  first    = slots['times'][valid.argmax(axis = 1)],
+                                  last     = slots['times'][valid.shape[1] - 1 - valid[:, ::-1].argmax(axis = 1)])
+
+def hourly_profile(slots : Dict[str, Any]) -> pd.DataFrame:
+    '''
+    Totals each series' kWh and readings by calendar month and hour of the day, the aggregate behind the hour by month
+    heatmaps, without grouping a single row.
+
+    Methodology:
+        1. Reshape each series' slots into (days × 24 hours × 4 quarter-hours), as the store holds whole days from
+           midnight, and sum away the quarter-hours.
+        2. Sum the days of each calendar month with a (days × 12) indicator matrix.
+
+    Parameters:
+        slots (Dict[str, Any]) : The store, from `load_slots`.
+
+    Returns:
+        pd.DataFrame: One row per series, month and hour with its `kwh` and `readings`, so means can be taken after
+                      combining series, e.g. by operational area.
+    '''
+
+    values, valid = slots['values'], slots['valid']
+    n, days       = values.shape[0], values.shape[1] // SLOTS_DAY
+
+    # Step 1: Reshape each series into days, hours and quarter-hours
+    kwh      = values.reshape(n, days, 24, 4).sum(axis = 3, dtype = np.float64)
+    readings = valid.reshape(n, days, 24, 4).sum(axis = 3)
+
+    # Step 2: Sum the days of each month
+    months   = slot_times(np.arange(days) * SLOTS_DAY).month.to_numpy()
+    monthly  = (months[:, None] == np.arange(1, 13)).astype(np.float64)
+
+    profile  = pd.DataFrame({'kwh'      : np.einsum('ndh,dm->nmh', kwh, monthly).ravel(),
+                             'readings' : np.einsum('ndh,dm->nmh', readings, monthly).ravel().astype(np.int64)},
+                            index = pd.MultiIndex.from_product([range(n), range(1, 13), range(24)],
+                                                               names = ['series', 'month', 'hour']))
+
+    return slots['series'].reset_index(names = 'series') \
+                          .merge(profile.reset_index(), on = 'series') \
+                          .drop(columns = 'series') \
+                          .query("readings > 0") \
+                          .reset_index(drop = True)
+
+def rolling_total(slots  : Dict[str, Any],
+                  window : int = SLOTS_DAY) -> np.ndarray:
+    '''
+    Sums each series' kWh over a rolling window of slots ending at each slot, as the difference of two offsets of a
+    cumulative sum along the slot axis, so every window costs the same however wide it is.
+
+    Parameters:
+        slots  (Dict[str, Any]) : The store, from `load_slots`.
+        window (int)            : The width of the window in slots. Defaults to a day of 96 slots.
+
+    Returns:
+        np.ndarray: A (series × slots) float32 matrix of totals, which is NaN until a series' first full window and
+                    wherever a window holds no readings.
+    '''
+
+    values, valid = slots['values'], slots['valid']
+
+    totals = np.cumsum(values, axis = 1, dtype = np.float64)
+    counts = np.cumsum(valid,  axis = 1)
+
+    rolled = np.full(values.shape, np.nan, dtype = np.float32)
+    rolled[:, window - 1:] = totals[:, window - 1:] - np.pad(totals, ((0, 0), (1, 0)))[:, :-window]
+
+    held   = counts[:, window - 1:] - np.pad(counts, ((0, 0), (1, 0)))[:, :-window]
+    rolled[:, window - 1:][held == 0] = np.nan
+
+    return rolled
+
+def check_slots(source : str = "./data/cmp/curated/meter_usage") -> pd.DataFrame:
+    '''
+    Compares the store's per-series statistics and hour by month profile against the same groupbys over the readings
+    in `meter_usage`, timing both, so the store can be checked against the rows it was built from.
+
+    Parameters:
+        source (str) : Path to the curated `meter_usage` dataset. Defaults to './data/cmp/curated/meter_usage'.
+
+    Returns:
+        pd.DataFrame: One row per aggregate with the seconds each approach took, and the largest absolute difference
+                      between them.
+    '''
+
+    report = []
+
+    # Both sides start from data on disk, the store memory-mapped and the readings parsed
+    start    = time.perf_counter()
+    slots    = load_slots(source)
+    loaded   = time.perf_counter() - start
+
+    start    = time.perf_counter()
+    readings = read_data(source, schema = 'meter_usage')
+    readings['timestamp'] = slot_times(slot_index(readings['interval_end_datetime']))
+    readings = readings.astype({'meter_id': str, 'kwh': 'float64'}) # Sums float32 readings as precisely as the store
+    parsed   = time.perf_counter() - start
+
+    report.append({'aggregate': 'load', 'slots_seconds': loaded, 'rows_seconds': parsed, 'max_difference': 0.0})
+
+    # Per-series statistics
+    start    = time.perf_counter()
+    stats    = series_stats(slots).set_index(SERIES)
+    dense    = time.perf_counter() - start
+
+    start    = time.perf_counter()
+    summed   = readings.groupby(SERIES + ['timestamp'])['kwh'].sum().reset_index() # The store sums repeated slots
+    grouped  = summed.groupby(SERIES).agg(readings = ('kwh', 'size'), kwh = ('kwh', 'sum'), max = ('kwh', 'max'))
+    rows     = time.perf_counter() - start
+
+    diff     = (stats[['readings', 'kwh', 'max']] - grouped.reindex(stats.index)).abs().max().max()
+    report.append({'aggregate': 'series_stats', 'slots_seconds': dense, 'rows_seconds': rows, 'max_difference': diff})
+
+    # Hour by month profile
+    start    = time.perf_counter()
+    profile  = hourly_profile(slots).set_index(SERIES + ['month', 'hour'])[['kwh', 'readings']]
+    dense    = time.perf_counter() - start
+
+    start    = time.perf_counter()
+    grouped  = summed.assign(month = summed['timestamp'].dt.month, hour = summed['timestamp'].dt.hour) \
+                     .groupby(SERIES + ['month', 'hour']).agg(kwh = ('kwh', 'sum'), readings = ('kwh', 'size'))
+    rows     = time.perf_counter() - start
+
+    diff     = (profile - grouped.reindex(profile.index)).abs().max().max()
+    report.append({'aggregate': 'hourly_profile', 'slots_seconds': dense, 'rows_seconds': rows, 'max_difference': diff})
+
+    report = pd.DataFrame(report)
+    lg.info(f"Slots matched the readings' aggregates to within {report['max_difference'].max():.2e} kWh.\n")
+
+    return report